@@ -0,0 +1,588 @@
+"""asyncio entry point serving the same routes as main:app.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 4
+
+The hot read routes (products, product variations and materials) and
+/api/batch are handled here on an aiomysql pool, so one worker can keep many
+queries in flight without tying up a thread per request. /api/batch runs
+independent sub-requests concurrently instead of one after another, and
+/api/events streams are served without holding a thread each. Query
+building and row shaping are shared with main.py, so the JSON is the same.
+Every other route, including writes, is passed through to main:app on a
+thread pool.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import re
+import time
+import uuid
+
+import aiomysql
+import pymysql
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags
+from urllib.parse import parse_qsl
+
+import compression
+import creds
+import events
+import logpipeline
+import main
+import metrics
+import resilience
+import responsecache
+
+ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', '50'))  # connections per worker process
+ASYNC_WSGI_THREADS = int(os.getenv('ASYNC_WSGI_THREADS', '10'))  # threads for routes served by main:app
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'*'),
+    (b'access-control-allow-methods', b'*'),
+    (b'access-control-expose-headers', b'X-Next-Cursor, ETag, X-Request-ID'),
+]
+
+
+class Response:
+    def __init__(self, status, body=None, headers=(), stream=None):
+        self.status = status
+        self.body = b'' if body is None else main.app.json.dumps_bytes(body)
+        self.headers = list(headers)
+        # Async iterator of further body chunks, sent until the client disconnects
+        self.stream = stream
+        # The response cache entry the body came from, whose compressed bodies can be reused
+        self.cache_entry = None
+        if body is not None:
+            self.headers.append((b'content-type', b'application/json'))
+
+
+def error_response(status, message, details=None):
+    body = {"error": message}
+    if details is not None:
+        body["details"] = details
+    return Response(status, body)
+
+
+class AsyncDatabase:
+    """aiomysql pool on one host. The primary sits behind the same circuit
+    breaker as the sync pool; a replica that cannot be reached is taken out
+    of rotation instead."""
+
+    def __init__(self, size, host, replica=None):
+        self.size = size
+        self.host = host
+        self.replica = replica
+        self._pool = None
+        self._lock = asyncio.Lock()
+
+    async def _get_pool(self):
+        if self._pool is None:
+            async with self._lock:
+                if self._pool is None:
+                    self._pool = await aiomysql.create_pool(
+                        minsize=1,
+                        maxsize=self.size,
+                        host=self.host,
+                        user=creds.Creds.userName,
+                        password=creds.Creds.password,
+                        db=creds.Creds.dbName,
+                        autocommit=True,
+                        cursorclass=aiomysql.DictCursor,
+                        connect_timeout=10,
+                    )
+        return self._pool
+
+    async def fetch_all(self, query, params=None):
+        if self.replica is None:
+            main.circuit_breaker.before_call()
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(query, params)
+                    rows = await cursor.fetchall()
+        except pymysql.err.OperationalError as err:
+            if err.args and err.args[0] in resilience.CONNECTION_ERRORS:
+                if self.replica is None:
+                    main.circuit_breaker.record_failure()
+                else:
+                    main.replica_set.mark_down(self.replica)
+            raise
+        if self.replica is None:
+            main.circuit_breaker.record_success()
+        return list(rows)
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+
+db = AsyncDatabase(ASYNC_DB_POOL_SIZE, creds.Creds.conString)
+replica_dbs = {
+    replica.host: AsyncDatabase(ASYNC_DB_POOL_SIZE, replica.host, replica)
+    for replica in main.replica_set.replicas
+}
+
+
+def read_db(request):
+    """A healthy replica, unless the client wrote within the pin window (see
+    main.choose_replica); otherwise the primary."""
+    replica = None
+    if not request.reads_on_primary:
+        replica = main.replica_set.choose()
+    metrics.DB_READS.labels('primary' if replica is None else 'replica').inc()
+    return db if replica is None else replica_dbs[replica.host]
+
+
+class SelectFlight:
+    def __init__(self, task):
+        self.task = task
+        self.followers = 0
+
+select_flights = {}  # (query, params) -> SelectFlight
+
+async def fetch_all(request, database, query, params=None):
+    """database.fetch_all, except that identical SELECTs running at the same
+    time share one execution, as main.execute_select_query does. Reads of a
+    client pinned to the primary always run on their own."""
+    if request.reads_on_primary:
+        return await database.fetch_all(query, params)
+    key = (query, main.params_key(params))
+    flight = select_flights.get(key)
+    if flight is not None:
+        metrics.DB_COALESCED.labels('select').inc()
+        flight.followers += 1
+        # The rows are shaped on a thread, so every caller needs its own copies
+        return [dict(row) for row in await asyncio.shield(flight.task)]
+    flight = select_flights[key] = SelectFlight(asyncio.ensure_future(database.fetch_all(query, params)))
+    # Marks the error as retrieved should every caller have been cancelled
+    flight.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    try:
+        # Shielded so the query keeps running for the others if this request is cancelled
+        rows = await asyncio.shield(flight.task)
+    finally:
+        if select_flights.get(key) is flight:
+            del select_flights[key]
+    return [dict(row) for row in rows] if flight.followers else rows
+
+
+async def fetch_table_versions(request, database, tables):
+    rows = await fetch_all(
+        request, database,
+        f"SELECT table_name, version FROM frostedfabrics.table_versions WHERE table_name IN ({main.placeholders(tables)})",
+        tuple(tables)
+    )
+    versions = {table: 0 for table in tables}
+    versions.update({row['table_name']: row['version'] for row in rows})
+    return versions
+
+
+# ============== NATIVE ROUTES ============
+def shape_products(rows, versions):
+    dims = main.dimension_cache.get(pc_ids=[row['pc_id'] for row in rows], versions=versions)
+    return main.with_product_category_names(rows, dims)
+
+def shape_variations(rows, versions):
+    dims = main.dimension_cache.get(brand_ids=[row['brand_id'] for row in rows], versions=versions)
+    return list(main.iter_variations(rows, dims))
+
+def shape_materials(rows, versions):
+    dims = main.dimension_cache.get(brand_ids=[row['brand_id'] for row in rows], versions=versions)
+    return list(main.iter_material_labels(rows, dims))
+
+def native_get(view, build_query, shape, key, cursor_from_results=False):
+    """An async equivalent of a main.py GET view built from its query
+    builder and row shaping, with the same ETag handling and response cache
+    as conditional_get."""
+    async def handle(request, resourceid):
+        database = read_db(request)
+        try:
+            versions = await fetch_table_versions(request, database, view.etag_tables)
+        except pymysql.err.MySQLError as err:
+            main.logger.error(f"Could not read table versions for {view.__name__}: {err}")
+            versions = None
+        etag = None
+        if versions is not None:
+            etag = main.compute_etag(request.full_path, False, versions)
+            if_none_match = parse_etags(request.header('if-none-match'))
+            encoding = main.compressor.negotiate(request.header('accept-encoding'))
+            for tag in compression.etag_variants(etag, encoding):
+                if if_none_match.contains(tag):
+                    return Response(304, headers=etag_headers(tag))
+
+        cache_key = responsecache.cache_key(request.path, request.args)
+        use_cache = versions is not None and main.response_cache.enabled
+        if use_cache:
+            entry = await cache_call(main.response_cache.get, cache_key, versions)
+            if entry is not None:
+                return entry_response(entry, etag)
+
+        try:
+            query, params, limit = build_query(resourceid, request.args)
+        except ValueError as e:
+            return error_response(400, str(e))
+        try:
+            rows = await fetch_all(request, database, query, params)
+            # The dimension cache may need to reload, which is blocking I/O
+            results = await asyncio.to_thread(shape, rows, versions)
+        except main.SHED_ERRORS:
+            raise
+        except Exception as e:
+            main.logger.error(f"Error in {view.__name__} (async): {str(e)}")
+            return error_response(500, "Internal Server Error", str(e))
+
+        if resourceid is not None:
+            if not results:
+                return error_response(404, "Resource not found")
+            response = Response(200, results[0])
+        else:
+            response = Response(200, results)
+            cursor = main.next_cursor(results if cursor_from_results else rows, limit, lambda row: [row[key]])
+            if cursor:
+                response.headers.append((b'x-next-cursor', cursor.encode()))
+        if use_cache:
+            headers = [('X-Next-Cursor', value.decode()) for name, value in response.headers if name == b'x-next-cursor']
+            response.cache_entry = responsecache.Entry(response.body, 'application/json', headers, versions)
+            await cache_call(main.response_cache.put, cache_key, response.cache_entry)
+        if etag is not None:
+            response.headers.extend(etag_headers(etag))
+        return response
+    return handle
+
+async def cache_call(method, *args):
+    """Call a response cache method, on a thread if it may read or write
+    the shared directory."""
+    if main.response_cache.shared is None:
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+def entry_response(entry, etag):
+    response = Response(200, headers=[(b'content-type', entry.content_type.encode())])
+    response.body = entry.body
+    response.cache_entry = entry
+    response.headers.extend((name.lower().encode(), value.encode()) for name, value in entry.headers)
+    response.headers.extend(etag_headers(etag))
+    return response
+
+def etag_headers(etag):
+    return [(b'etag', f'"{etag}"'.encode()), (b'cache-control', b'no-cache')]
+
+async def compress_response(request, response):
+    """The async equivalent of main.compress_response, for complete
+    bodies; event streams are never compressed."""
+    headers = dict(response.headers)
+    mimetype = headers.get(b'content-type', b'').decode().partition(';')[0].strip()
+    if not main.compressor.enabled or not compression.is_compressible(mimetype):
+        return
+    response.headers.append((b'vary', b'Accept-Encoding'))
+    if response.status != 200 or response.stream is not None or len(response.body) < main.compressor.min_size:
+        return
+    encoding = main.compressor.negotiate(request.header('accept-encoding'))
+    if encoding is None:
+        return
+    if response.cache_entry is not None:
+        compress = functools.partial(main.response_cache.encoded, response.cache_entry, encoding, main.compressor.compress)
+    else:
+        compress = functools.partial(main.compressor.compress, response.body, encoding)
+    # Large bodies take milliseconds to compress, which would stall the event loop
+    response.body = await asyncio.to_thread(compress)
+    for i, (name, value) in enumerate(response.headers):
+        if name == b'etag':
+            etag = compression.encoded_etag(value.decode().strip('"'), encoding)
+            response.headers[i] = (name, f'"{etag}"'.encode())
+    response.headers.append((b'content-encoding', encoding.encode()))
+
+
+# ============== EVENT STREAM ============
+EVENT_STREAM_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+class AsyncSubscription(events.Subscription):
+    """Subscription that wakes a coroutine on the event loop when an event
+    is delivered from another thread."""
+
+    def __init__(self, hub, topics, max_queued):
+        super().__init__(hub, topics, max_queued)
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+
+    def deliver(self, topic, payload):
+        if not super().deliver(topic, payload):
+            return False
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The event loop has shut down
+            pass
+        return True
+
+    async def next(self, timeout):
+        event = self.get(0)
+        if event is None:
+            self._ready.clear()
+            # Something may have been delivered before the clear
+            event = self.get(0)
+        if event is None:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+            event = self.get(0)
+        return event
+
+async def event_stream(request, resourceid=None):
+    """/api/events with the same events as main.eventsGet."""
+    if resourceid is not None:
+        return error_response(404, "Resource not found")
+    try:
+        topics = main.get_topics_arg(request.args)
+    except ValueError as e:
+        return error_response(400, str(e))
+
+    async def chunks():
+        subscription = main.event_hub.subscribe(topics, AsyncSubscription)
+        try:
+            yield f"retry: {main.EVENT_RETRY}\n\n".encode()
+            while True:
+                event = await subscription.next(main.EVENT_HEARTBEAT_INTERVAL)
+                yield main.format_event(event).encode()
+        finally:
+            subscription.close()
+    return Response(200, headers=EVENT_STREAM_HEADERS, stream=chunks())
+
+async def send_stream(chunks, receive, send):
+    """Send chunks as body parts until they run out or the client disconnects."""
+    async def pump():
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    async def disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await chunks.aclose()
+
+
+# ============== BATCH ============
+async def batch(request, resourceid=None):
+    """/api/batch with the same request and response format as main.batchGet,
+    except that sub-requests only wait for the sub-requests they reference."""
+    try:
+        request_data = json.loads(request.body) if request.body else None
+    except ValueError:
+        request_data = None
+    sub_requests = request_data.get('requests') if isinstance(request_data, dict) else request_data
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return error_response(400, "Request body must contain a non-empty requests array")
+    if len(sub_requests) > main.MAX_BATCH_REQUESTS:
+        return error_response(400, f"At most {main.MAX_BATCH_REQUESTS} requests can be batched")
+
+    tasks = {}
+    ordered = []
+    for index, sub_request in enumerate(sub_requests):
+        if isinstance(sub_request, str):
+            sub_request = {"path": sub_request}
+        name = sub_request.get('id', str(index)) if isinstance(sub_request, dict) else str(index)
+        # Only requests listed earlier can be referenced, as in the sync batch
+        task = asyncio.ensure_future(run_sub_request(name, sub_request, dict(tasks), request.client_key))
+        tasks[name] = task
+        ordered.append(task)
+    responses = await asyncio.gather(*ordered)
+    return Response(200, {"responses": [response for response, _ in responses]})
+
+async def run_sub_request(name, sub_request, earlier, client_key):
+    path = sub_request.get('path') if isinstance(sub_request, dict) else None
+    if not isinstance(path, str) or not path.startswith('/api/') or path.startswith(main.UNBATCHABLE_PATHS):
+        return {"id": name, "status": 400, "body": {"error": "path must be an /api/ GET route"}}, None
+
+    references = {}
+    for ref_name, _ in main.BATCH_REFERENCE.findall(path):
+        if ref_name in earlier:
+            references[ref_name] = (await earlier[ref_name])[1]
+    try:
+        path = main.resolve_batch_path(path, references)
+    except ValueError as e:
+        return {"id": name, "status": 424, "body": {"error": str(e)}}, None
+
+    # Sub-requests read from where the batch's client would
+    headers = [(b'x-client-id', client_key.encode())]
+    if sub_request.get('if_none_match'):
+        headers.append((b'if-none-match', sub_request['if_none_match'].encode()))
+    status, response_headers, raw_body = await call_in_process(path, headers)
+    body = None
+    if status != 304:
+        try:
+            body = json.loads(raw_body)
+        except ValueError:
+            body = raw_body.decode('utf-8', 'replace')
+    return {
+        "id": name,
+        "status": status,
+        "etag": response_headers.get('etag'),
+        "body": body
+    }, body
+
+async def call_in_process(path_with_query, headers):
+    """Run a GET through this ASGI app without a network round trip."""
+    path, _, query_string = path_with_query.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query_string.encode(), 'root_path': '', 'headers': headers,
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+    }
+    received = False
+    async def receive():
+        nonlocal received
+        if received:
+            # Nothing more will arrive; wait like a server would
+            await asyncio.Event().wait()
+        received = True
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+    status = None
+    response_headers = {}
+    chunks = []
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            response_headers.update((k.decode().lower(), v.decode()) for k, v in message.get('headers', []))
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+    await app(scope, receive, send)
+    return status, response_headers, b''.join(chunks)
+
+
+# ============== ROUTING ============
+# (method, rule, handler); GET rules also match rule/<id>
+ROUTES = [
+    ('GET', '/api/products', native_get(main.productsGet, main.products_query, shape_products, 'prod_id')),
+    ('GET', '/api/productvariations',
+     native_get(main.productvariationsGet, main.productvariations_query, shape_variations, 'var_id', cursor_from_results=True)),
+    ('GET', '/api/materials', native_get(main.materialsGet, main.materials_query, shape_materials, 'mat_id')),
+    ('POST', '/api/batch', batch),
+    ('GET', '/api/events', event_stream),
+]
+
+@functools.lru_cache(maxsize=None)
+def route_pattern(rule):
+    return re.compile(re.escape(rule) + r'(?:/(\d+))?')
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        query_string = scope.get('query_string', b'').decode('latin-1')
+        self.full_path = f"{self.path}?{query_string}"
+        self.args = MultiDict(parse_qsl(query_string, keep_blank_values=True))
+        self._headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        self.body = body
+        # Same key as main.client_key, which sees the address as remote_addr
+        self.client_key = self.header('x-client-id') or (scope.get('client') or ('',))[0]
+        # Pins are only recorded when there are replicas (see main.get_db_connection)
+        self.reads_on_primary = bool(replica_dbs) and main.primary_pins.is_pinned(self.client_key)
+
+    def header(self, name):
+        return self._headers.get(name)
+
+    def wants_ndjson(self):
+        return self.args.get('format') == 'ndjson' or 'application/x-ndjson' in (self.header('accept') or '')
+
+
+def match_route(scope):
+    """Return (handler, resourceid, rule) for a natively served route, or
+    (None, None, None). rule is the Flask rule, used as the metrics label."""
+    for method, rule, handler in ROUTES:
+        if scope['method'] == method:
+            match = route_pattern(rule).fullmatch(scope['path'])
+            if match:
+                resourceid = match.group(1) if match.groups() else None
+                if resourceid is None:
+                    return handler, None, rule
+                return handler, int(resourceid), f"{rule}/<int:resourceid>"
+    return None, None, None
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+wsgi_fallback = WSGIMiddleware(main.app, workers=ASYNC_WSGI_THREADS)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                main.start_background_tasks()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await db.close()
+                for replica_db in replica_dbs.values():
+                    await replica_db.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    handler, resourceid, rule = match_route(scope) if scope['type'] == 'http' else (None, None, None)
+    if handler is None:
+        return await wsgi_fallback(scope, receive, send)
+
+    request = Request(scope, await read_body(receive))
+    if request.wants_ndjson():
+        # Streamed NDJSON is only implemented by the sync views
+        async def replay():
+            return {'type': 'http.request', 'body': request.body, 'more_body': False}
+        return await wsgi_fallback(scope, replay, send)
+
+    request_id = request.header('x-request-id') or uuid.uuid4().hex
+    logpipeline.current_request_id.set(request_id)
+    started_at = time.perf_counter()
+    try:
+        try:
+            response = await handler(request, resourceid)
+        except main.SHED_ERRORS as e:
+            response = Response(503, {"error": "Service Unavailable", "details": "The server is busy, try again shortly"},
+                                [(b'retry-after', str(max(1, int(round(e.retry_after)))).encode())])
+        await compress_response(request, response)
+    except Exception as e:
+        # Answer like the sync views do, so the client still gets the CORS
+        # headers and request id rather than the ASGI server's bare 500
+        main.logger.error(f"Error in {request.method} {rule} (async): {str(e)}")
+        response = error_response(500, "Internal Server Error", str(e))
+
+    await send({
+        'type': 'http.response.start',
+        'status': response.status,
+        'headers': response.headers + CORS_HEADERS + [(b'x-request-id', request_id.encode())],
+    })
+    await send({'type': 'http.response.body', 'body': response.body, 'more_body': response.stream is not None})
+    if response.stream is not None:
+        await send_stream(response.stream, receive, send)
+
+    metrics.REQUEST_COUNT.labels(rule, request.method, str(response.status)).inc()
+    metrics.REQUEST_LATENCY.labels(rule, request.method).observe(time.perf_counter() - started_at)
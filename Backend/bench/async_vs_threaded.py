@@ -0,0 +1,147 @@
+"""Compare the threaded (gunicorn gthread) and async (uvicorn) entry points.
+
+Starts both servers against the database configured in .env, with the same
+number of worker processes, then drives each at increasing concurrency and
+prints throughput and latency percentiles. The last line reports the lowest
+concurrency at which the async mode served more requests per second.
+
+    python bench/async_vs_threaded.py --workers 2 --threads 10 \
+        --concurrency 1,4,16,64,128,256 --duration 10
+
+Run it from the Backend directory.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+# A product page: one batched read with a dependent variation lookup, plus
+# the list endpoints the catalog pages hit
+DEFAULT_REQUESTS = [
+    ('GET', '/api/products', None),
+    ('GET', '/api/materials', None),
+    ('GET', '/api/productvariations?prod_id=1', None),
+    ('POST', '/api/batch', {"requests": [
+        {"id": "product", "path": "/api/products/1"},
+        {"id": "variations", "path": "/api/productvariations?prod_id={product.prod_id}"},
+        {"id": "materials", "path": "/api/materials"},
+        {"id": "categories", "path": "/api/productcategories"},
+    ]}),
+]
+
+
+def start_servers(workers, threads, threaded_port, async_port):
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, DB_POOL_SIZE=str(threads))
+    threaded = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{threaded_port}',
+         '--workers', str(workers), '--threads', str(threads), '--worker-class', 'gthread', 'main:app'],
+        cwd=backend, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    async_server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1', '--port', str(async_port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=backend, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return [threaded, async_server]
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url + '/api/test', timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def run_load(base_url, concurrency, duration, requests):
+    """Keep `concurrency` requests in flight for `duration` seconds. Returns
+    (latencies of successful requests, error count)."""
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def worker(offset):
+            nonlocal errors
+            index = offset
+            while time.monotonic() < deadline:
+                method, path, body = requests[index % len(requests)]
+                index += 1
+                started_at = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body)
+                    if response.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started_at)
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2, help='worker processes per server')
+    parser.add_argument('--threads', type=int, default=10, help='gthread threads (and sync pool size) per worker')
+    parser.add_argument('--concurrency', default='1,4,16,64,128,256', help='comma separated client concurrency levels')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per concurrency level')
+    parser.add_argument('--threaded-url', help='use an already running threaded server instead of starting one')
+    parser.add_argument('--async-url', help='use an already running async server instead of starting one')
+    args = parser.parse_args()
+
+    processes = []
+    threaded_url = args.threaded_url
+    async_url = args.async_url
+    if not threaded_url or not async_url:
+        processes = start_servers(args.workers, args.threads, 5101, 5102)
+        threaded_url = threaded_url or 'http://127.0.0.1:5101'
+        async_url = async_url or 'http://127.0.0.1:5102'
+    try:
+        wait_until_ready(threaded_url)
+        wait_until_ready(async_url)
+
+        print(f"{'concurrency':>11} {'mode':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        crossover = None
+        for concurrency in [int(value) for value in args.concurrency.split(',')]:
+            throughput = {}
+            for mode, url in (('threaded', threaded_url), ('async', async_url)):
+                latencies, errors = asyncio.run(run_load(url, concurrency, args.duration, DEFAULT_REQUESTS))
+                throughput[mode] = len(latencies) / args.duration
+                print(f"{concurrency:>11} {mode:>8} {throughput[mode]:>9.1f} "
+                      f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} {errors:>7}")
+            if crossover is None and throughput['async'] > throughput['threaded']:
+                crossover = concurrency
+
+        if crossover is None:
+            print("async mode did not beat threaded mode at any tested concurrency")
+        else:
+            print(f"async mode beats threaded mode from concurrency {crossover}")
+    finally:
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+        for process in processes:
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+"""Load test the API with the frontend's page loads and compare to a baseline.
+
+Seed a database first (bench/seed.py). The run then has two scenarios:
+
+- pages: virtual users load pages in a weighted mix. Each page issues the
+  same requests, in the same order and with the same parallelism, as the
+  frontend page it is named after.
+- produce: concurrent POST /produce calls against a few variations that share
+  materials. Afterwards the script checks through the API that no material
+  went negative and that every stock change matches the productions that
+  succeeded.
+
+Throughput and p50/p95/p99 latency are reported per route. With --baseline
+(default bench/baseline.json) the script exits 1 if any route got slower or
+served fewer requests per second than the tolerance allows, if any request
+failed, or if the produce check failed; a missing baseline is an error.
+--save-baseline records the run as the new baseline instead, and
+--no-compare only checks for failed requests and the produce invariants.
+
+    python bench/run.py --standin /tmp/frostedfabrics.db
+    python bench/run.py                      # MySQL from .env
+    python bench/run.py --url http://127.0.0.1:5000 --save-baseline
+
+Run it from the Backend directory. Nothing here needs network access beyond
+the loopback interface.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import quote
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# Slack added to every latency limit, so routes that take a millisecond or two
+# don't fail on scheduler noise
+LATENCY_SLACK = 0.002  # seconds
+
+
+class Recorder:
+    """Latencies and failures per route, ignoring the warmup period."""
+
+    def __init__(self, record_from):
+        self.record_from = record_from
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, route, method, path, body=None):
+        """Send a request and return the response, or None if it failed."""
+        started_at = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+        except httpx.HTTPError:
+            response = None
+        elapsed = time.perf_counter() - started_at
+        failed = response is None or response.status_code >= 500
+        if time.monotonic() >= self.record_from:
+            if failed:
+                self.errors[route] += 1
+            else:
+                self.latencies[route].append(elapsed)
+        return None if failed else response
+
+
+# ============== PAGES ============
+# Each function loads one frontend page (Frontend/app/(routes)/...)
+async def dashboard(client, recorder, catalog, rng):
+    await asyncio.gather(
+        recorder.request(client, 'GET /api/productvariations', 'GET', '/api/productvariations'),
+        recorder.request(client, 'GET /api/products', 'GET', '/api/products'),
+        recorder.request(client, 'GET /api/materials', 'GET', '/api/materials'),
+        recorder.request(client, 'GET /api/calendarcategories', 'GET', '/api/calendarcategories'),
+        recorder.request(client, 'GET /api/calendarevents', 'GET', '/api/calendarevents'),
+    )
+
+
+async def products_index(client, recorder, catalog, rng):
+    await recorder.request(client, 'GET /api/productcategories', 'GET', '/api/productcategories')
+
+
+async def product_category(client, recorder, catalog, rng):
+    await recorder.request(client, 'GET /api/productcategories', 'GET', '/api/productcategories')
+    pc_id = rng.choice(catalog['pc_ids'])
+    response = await recorder.request(client, 'GET /api/products?pc_id', 'GET', f'/api/products?pc_id={pc_id}')
+    if response is None or response.status_code != 200:
+        return
+    prod_ids = [str(product['prod_id']) for product in response.json()]
+    if prod_ids:
+        await recorder.request(client, 'GET /api/productvariations?prod_id', 'GET',
+                               f"/api/productvariations?prod_id={','.join(prod_ids)}")
+
+
+def product_batch(prod_id):
+    return {"requests": [
+        {"id": "product", "path": f"/api/products/{prod_id}"},
+        {"id": "variations", "path": f"/api/productvariations?product={prod_id}"},
+        {"id": "category", "path": "/api/productcategories/{product.pc_id}"},
+    ]}
+
+
+async def product(client, recorder, catalog, rng):
+    await recorder.request(client, 'POST /api/batch', 'POST', '/api/batch', product_batch(rng.choice(catalog['prod_ids'])))
+
+
+async def product_save(client, recorder, catalog, rng):
+    """Open a product and save it unchanged, as the edit form does."""
+    prod_id = rng.choice(catalog['prod_ids'])
+    response = await recorder.request(client, 'POST /api/batch', 'POST', '/api/batch', product_batch(prod_id))
+    if response is None or response.status_code != 200:
+        return
+    variations = response.json()['responses'][1]['body']
+    if not isinstance(variations, list) or not variations:
+        return
+    payload = [
+        {key: variation[key] for key in ('var_id', 'var_name', 'var_inv', 'var_goal')}
+        for variation in variations
+    ]
+    await recorder.request(client, 'PATCH /api/productvariations/bulk', 'PATCH', '/api/productvariations/bulk', payload)
+
+
+async def materials_index(client, recorder, catalog, rng):
+    await recorder.request(client, 'GET /api/materialcategories', 'GET', '/api/materialcategories')
+
+
+async def material_category(client, recorder, catalog, rng):
+    mc_id, mc_name = rng.choice(catalog['material_categories'])
+    await asyncio.gather(
+        recorder.request(client, 'GET /api/materials?category', 'GET', f"/api/materials?category={quote(mc_name)}"),
+        recorder.request(client, 'GET /api/materialbrands?mc_id', 'GET', f'/api/materialbrands?mc_id={mc_id}'),
+    )
+
+
+PAGES = {
+    'dashboard': dashboard,
+    'products': products_index,
+    'product_category': product_category,
+    'product': product,
+    'product_save': product_save,
+    'materials': materials_index,
+    'material_category': material_category,
+}
+DEFAULT_MIX = 'dashboard=1,products=2,product_category=4,product=6,product_save=1,materials=2,material_category=4'
+
+
+async def load_catalog(client):
+    """Ids the pages pick from."""
+    product_categories = (await client.get('/api/productcategories')).json()
+    material_categories = (await client.get('/api/materialcategories')).json()
+    products = (await client.get('/api/products')).json()
+    if not product_categories or not material_categories or not products:
+        raise RuntimeError("The database is empty, run bench/seed.py first")
+    return {
+        'pc_ids': [row['pc_id'] for row in product_categories],
+        'material_categories': [(row['mc_id'], row['mc_name']) for row in material_categories],
+        'prod_ids': [row['prod_id'] for row in products],
+    }
+
+
+async def run_pages(client, args, mix, recorder, catalog):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    deadline = time.monotonic() + args.warmup + args.duration
+    pages_loaded = defaultdict(int)
+
+    async def user(index):
+        rng = random.Random(args.seed * 1000 + index)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            await PAGES[name](client, recorder, catalog, rng)
+            if time.monotonic() >= recorder.record_from:
+                pages_loaded[name] += 1
+
+    await asyncio.gather(*(user(i) for i in range(args.concurrency)))
+    return dict(pages_loaded)
+
+
+# ============== PRODUCE ============
+async def run_produce(client, args, recorder):
+    """Produce concurrently, then check stock against the successful calls.
+    Returns a list of problems (empty when consistent)."""
+    rng = random.Random(args.seed)
+    variations = (await client.get('/api/productvariations?limit=1000')).json()
+    # Prefer variations that share materials, so productions contend for rows
+    by_material = defaultdict(list)
+    for variation in variations:
+        for material in variation['materials']:
+            by_material[material['mat_id']].append(variation)
+    shared = [variation for group in by_material.values() if len(group) > 1 for variation in group]
+    candidates = {variation['var_id']: variation for variation in shared or variations if variation['materials']}
+    chosen = rng.sample(sorted(candidates), min(args.produce_variations, len(candidates)))
+    bom = {var_id: {m['mat_id']: m['mat_amount'] for m in candidates[var_id]['materials']} for var_id in chosen}
+    mat_ids = sorted({mat_id for materials in bom.values() for mat_id in materials})
+
+    async def snapshot():
+        variations = await asyncio.gather(*(client.get(f'/api/productvariations/{var_id}') for var_id in chosen))
+        materials = await asyncio.gather(*(client.get(f'/api/materials/{mat_id}') for mat_id in mat_ids))
+        return ({v.json()['var_id']: v.json()['var_inv'] for v in variations},
+                {m.json()['mat_id']: m.json()['mat_inv'] for m in materials})
+
+    var_before, mat_before = await snapshot()
+    produced = defaultdict(int)
+    outcomes = defaultdict(int)
+    deadline = time.monotonic() + args.warmup + args.duration
+
+    async def worker(index):
+        worker_rng = random.Random(args.seed * 1000 + index)
+        while time.monotonic() < deadline:
+            var_id = worker_rng.choice(chosen)
+            quantity = worker_rng.randint(1, 5)
+            response = await recorder.request(client, 'POST /api/productvariations/<id>/produce', 'POST',
+                                              f'/api/productvariations/{var_id}/produce', {'quantity': quantity})
+            if response is None:
+                outcomes['failed'] += 1
+            elif response.status_code == 200:
+                produced[var_id] += quantity
+                outcomes['produced'] += 1
+            elif response.status_code == 400:
+                outcomes['insufficient'] += 1
+            else:
+                outcomes[f'status {response.status_code}'] += 1
+
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    var_after, mat_after = await snapshot()
+
+    problems = []
+    for var_id in chosen:
+        if var_after[var_id] - var_before[var_id] != produced[var_id]:
+            problems.append(f"variation {var_id}: var_inv changed by {var_after[var_id] - var_before[var_id]}, "
+                            f"{produced[var_id]} units were produced")
+    for mat_id in mat_ids:
+        used = sum(produced[var_id] * materials.get(mat_id, 0) for var_id, materials in bom.items())
+        if mat_before[mat_id] - mat_after[mat_id] != used:
+            problems.append(f"material {mat_id}: mat_inv dropped by {mat_before[mat_id] - mat_after[mat_id]}, "
+                            f"successful productions used {used}")
+        if mat_after[mat_id] < 0:
+            problems.append(f"material {mat_id}: mat_inv is negative ({mat_after[mat_id]})")
+    print(f"produce: {dict(outcomes)} across {len(chosen)} variations and {len(mat_ids)} materials")
+    return problems
+
+
+# ============== REPORT ============
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(recorder, duration):
+    routes = {}
+    for route in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = recorder.latencies[route]
+        routes[route] = {
+            'requests': len(latencies),
+            'errors': recorder.errors[route],
+            'throughput': len(latencies) / duration,
+            'p50': percentile(latencies, 0.50) if latencies else None,
+            'p95': percentile(latencies, 0.95) if latencies else None,
+            'p99': percentile(latencies, 0.99) if latencies else None,
+        }
+    return routes
+
+
+def print_routes(routes):
+    print(f"{'route':<42} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for route, stats in routes.items():
+        ms = [f"{stats[key] * 1000:>8.1f}" if stats[key] is not None else f"{'-':>8}" for key in ('p50', 'p95', 'p99')]
+        print(f"{route:<42} {stats['throughput']:>8.1f} {' '.join(ms)} {stats['errors']:>7}")
+
+
+def compare(result, baseline, tolerance):
+    """Return the regressions of result against baseline."""
+    regressions = []
+    for route, expected in baseline['routes'].items():
+        actual = result['routes'].get(route)
+        if actual is None or not actual['requests']:
+            regressions.append(f"{route}: no successful requests (baseline {expected['throughput']:.1f} req/s)")
+            continue
+        if actual['throughput'] < expected['throughput'] * (1 - tolerance):
+            regressions.append(f"{route}: {actual['throughput']:.1f} req/s, baseline {expected['throughput']:.1f}")
+        for key in ('p95', 'p99'):
+            limit = expected[key] * (1 + tolerance) + LATENCY_SLACK
+            if actual[key] > limit:
+                regressions.append(f"{route}: {key} {actual[key] * 1000:.1f} ms, "
+                                   f"baseline {expected[key] * 1000:.1f} ms (limit {limit * 1000:.1f})")
+    return regressions
+
+
+# ============== SERVER ============
+def start_server(args, port):
+    env = dict(os.environ, DB_POOL_SIZE=str(args.threads))
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(args.workers), '--threads', str(args.threads), '--worker-class', 'gthread']
+    if args.standin:
+        env['STANDIN_DB'] = os.path.abspath(args.standin)
+        command += ['--pythonpath', BENCH_DIR, 'standin_app:app']
+    else:
+        command.append('main:app')
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url + '/api/test', timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def parse_mix(raw):
+    mix = {}
+    for part in raw.split(','):
+        name, _, weight = part.partition('=')
+        if name not in PAGES:
+            raise SystemExit(f"Unknown page {name!r}, expected one of {', '.join(PAGES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def run(args, url, mix):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        catalog = await load_catalog(client)
+        result = {
+            'scale': {name: len(values) for name, values in catalog.items()},
+            'pages': {},
+            'produce_problems': [],
+        }
+        recorder = Recorder(float('inf'))
+        if 'pages' in args.scenarios:
+            recorder.record_from = time.monotonic() + args.warmup
+            result['pages'] = await run_pages(client, args, mix, recorder, catalog)
+        if 'produce' in args.scenarios:
+            recorder.record_from = time.monotonic() + args.warmup
+            result['produce_problems'] = await run_produce(client, args, recorder)
+        # Every route belongs to one scenario, so its rate is over one duration
+        result['routes'] = summarize(recorder, args.duration)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--standin', metavar='PATH', help='serve from this SQLite stand-in (see seed.py --standin)')
+    parser.add_argument('--url', help='load an already running server instead of starting gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='gthread threads (and pool size) per worker')
+    parser.add_argument('--concurrency', type=int, default=16, help='virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before each scenario')
+    parser.add_argument('--scenarios', default='pages,produce', help='comma separated: pages, produce')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='page=weight pairs for the pages scenario')
+    parser.add_argument('--produce-variations', type=int, default=8, help='variations the produce scenario contends on')
+    parser.add_argument('--seed', type=int, default=4375)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed fractional slowdown per route')
+    parser.add_argument('--save-baseline', action='store_true', help='write this run to --baseline instead of comparing')
+    parser.add_argument('--no-compare', action='store_true', help='only check for failures, without a baseline')
+    parser.add_argument('--output', help='also write the results as JSON here')
+    args = parser.parse_args()
+    args.scenarios = [name for name in args.scenarios.split(',') if name]
+    mix = parse_mix(args.mix)
+
+    settings = {
+        'mode': 'url' if args.url else ('standin' if args.standin else 'mysql'),
+        'workers': args.workers, 'threads': args.threads, 'concurrency': args.concurrency,
+        'scenarios': args.scenarios, 'mix': mix, 'produce_variations': args.produce_variations,
+        'seed': args.seed,
+    }
+
+    process = None
+    url = args.url
+    if not url:
+        process = start_server(args, 5103)
+        url = 'http://127.0.0.1:5103'
+    try:
+        wait_until_ready(url)
+        result = asyncio.run(run(args, url, mix))
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+    result['settings'] = settings
+    result['machine'] = {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()}
+    print_routes(result['routes'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    failures = [f"produce: {problem}" for problem in result['produce_problems']]
+    failures += [f"{route}: {stats['errors']} failed requests"
+                 for route, stats in result['routes'].items() if stats['errors']]
+
+    if args.save_baseline:
+        if failures:
+            print("\n".join(["NOT saving the baseline, the run had failures:"] + failures))
+            sys.exit(1)
+        with open(args.baseline, 'w') as f:
+            json.dump({key: result[key] for key in ('settings', 'scale', 'machine', 'routes')},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"baseline written to {args.baseline}")
+        return
+
+    if not args.no_compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; record one with --save-baseline, or pass --no-compare")
+            sys.exit(2)
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ('settings', 'scale'):
+            if baseline[key] != json.loads(json.dumps(result[key])):
+                print(f"{args.baseline} was recorded with different {key}: {baseline[key]}")
+                sys.exit(2)
+        failures += compare(result, baseline, args.tolerance)
+
+    if failures:
+        print("\n".join(["REGRESSION"] + failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
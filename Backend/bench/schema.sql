@@ -0,0 +1,104 @@
+-- Schema of the frostedfabrics database, for seeding a local benchmark copy
+-- (bench/seed.py). Column types follow what main.py reads and writes; the
+-- indexes are the ones the production database has plus those added by
+-- migrations/.
+CREATE DATABASE IF NOT EXISTS frostedfabrics;
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.product_categories (
+    pc_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    pc_name VARCHAR(255) NOT NULL,
+    img_id INT
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.products (
+    prod_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    pc_id INT NOT NULL,
+    prod_name VARCHAR(255) NOT NULL,
+    prod_cost DECIMAL(10, 2),
+    prod_msrp DECIMAL(10, 2),
+    prod_time VARCHAR(64),
+    img_id INT,
+    KEY idx_products_pc_id (pc_id)
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.product_variations (
+    var_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    prod_id INT NOT NULL,
+    var_name VARCHAR(255) NOT NULL,
+    var_inv INT NOT NULL DEFAULT 0,
+    var_goal INT NOT NULL DEFAULT 0,
+    img_id INT,
+    KEY idx_product_variations_prod_id (prod_id)
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.material_measurements (
+    meas_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    meas_unit VARCHAR(64) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.material_categories (
+    mc_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    meas_id INT NOT NULL,
+    mc_name VARCHAR(255) NOT NULL,
+    img_id INT
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.material_brands (
+    brand_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    mc_id INT NOT NULL,
+    brand_name VARCHAR(255) NOT NULL,
+    brand_price DECIMAL(10, 2),
+    img_id INT,
+    KEY idx_material_brands_mc_id (mc_id)
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.materials (
+    mat_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    brand_id INT NOT NULL,
+    mat_name VARCHAR(255) NOT NULL,
+    mat_sku VARCHAR(64),
+    mat_inv INT NOT NULL DEFAULT 0,
+    mat_alert INT NOT NULL DEFAULT 0,
+    img_id INT,
+    KEY idx_materials_brand_id (brand_id)
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.variation_materials (
+    var_id INT NOT NULL,
+    mat_id INT NOT NULL,
+    mat_amount INT NOT NULL,
+    PRIMARY KEY (var_id, mat_id),
+    KEY idx_variation_materials_mat_id (mat_id)
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.calendar_categories (
+    cc_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    cc_name VARCHAR(255) NOT NULL,
+    cc_hex VARCHAR(7)
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.calendar_events (
+    event_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    cc_id INT NOT NULL,
+    event_title VARCHAR(255) NOT NULL,
+    event_subtitle VARCHAR(255),
+    event_notes TEXT,
+    event_link VARCHAR(255),
+    event_timestamp DATETIME NOT NULL,
+    KEY idx_calendar_events_timestamp (event_timestamp, event_id),
+    KEY idx_calendar_events_category_timestamp (cc_id, event_timestamp)
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.table_versions (
+    table_name VARCHAR(64) NOT NULL PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS frostedfabrics.change_log (
+    change_id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    table_name VARCHAR(64) NOT NULL,
+    op VARCHAR(6) NOT NULL,
+    row_key JSON NOT NULL,
+    changed_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    KEY idx_change_log_changed_at (changed_at)
+);
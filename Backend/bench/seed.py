@@ -0,0 +1,189 @@
+"""Seed a synthetic frostedfabrics database for benchmarking.
+
+The data is generated from a fixed random seed, so the same arguments always
+produce the same database. Sizes default to a shop well past today's
+catalog; everything not given is derived from --materials and --variations.
+
+Load into the MySQL server configured in .env (set dbhost=127.0.0.1 for a
+local one, e.g. the `db` service in docker-compose.yml). Existing rows in
+the frostedfabrics tables are deleted first:
+
+    python bench/seed.py --materials 100000 --variations 50000
+
+or into a SQLite file for the stand-in (see bench/standin.py):
+
+    python bench/seed.py --materials 100000 --variations 50000 --standin /tmp/frostedfabrics.db
+
+Run it from the Backend directory.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+TABLES = [
+    'calendar_categories', 'calendar_events', 'material_brands', 'material_categories',
+    'material_measurements', 'materials', 'product_categories', 'product_variations',
+    'products', 'variation_materials',
+]
+BATCH_SIZE = 5000
+UNITS = ['yd', 'm', 'g', 'oz', 'skein', 'pcs', 'spool', 'sheet']
+COLORS = ['Red', 'Blue', 'Green', 'Ivory', 'Black', 'Rose', 'Sage', 'Mustard', 'Navy', 'Plum', 'Teal', 'Coral']
+MATERIALS = ['Cotton', 'Linen', 'Wool', 'Felt', 'Ribbon', 'Thread', 'Zipper', 'Button', 'Lace', 'Denim', 'Velvet', 'Fleece']
+PRODUCTS = ['Tote', 'Beanie', 'Scarf', 'Pouch', 'Apron', 'Quilt', 'Pillow', 'Mitten', 'Headband', 'Blanket']
+SIZES = ['Small', 'Medium', 'Large', 'XL']
+
+
+def generate(args):
+    """Yield (table, columns, rows) in foreign key order."""
+    rng = random.Random(args.seed)
+    products = args.products or max(1, args.variations // 5)
+    brands = args.brands or max(1, args.materials // 250)
+    material_categories = args.material_categories or max(1, min(200, brands // 10))
+    product_categories = args.product_categories or max(1, min(100, products // 500))
+
+    yield 'material_measurements', ['meas_id', 'meas_unit'], [(i + 1, unit) for i, unit in enumerate(UNITS)]
+    yield 'material_categories', ['mc_id', 'meas_id', 'mc_name', 'img_id'], [
+        (mc_id, rng.randint(1, len(UNITS)), f"{rng.choice(MATERIALS)} {mc_id}", None)
+        for mc_id in range(1, material_categories + 1)
+    ]
+    yield 'material_brands', ['brand_id', 'mc_id', 'brand_name', 'brand_price', 'img_id'], [
+        (brand_id, rng.randint(1, material_categories), f"Brand {brand_id}",
+         Decimal(rng.randint(50, 5000)) / 100, None)
+        for brand_id in range(1, brands + 1)
+    ]
+    # A few percent of materials start below their alert level
+    yield 'materials', ['mat_id', 'brand_id', 'mat_name', 'mat_sku', 'mat_inv', 'mat_alert', 'img_id'], (
+        (mat_id, rng.randint(1, brands), f"{rng.choice(COLORS)} {rng.choice(MATERIALS)} {mat_id}",
+         f"SKU-{mat_id:07d}", rng.randint(0, 2000), rng.randint(10, 110), None)
+        for mat_id in range(1, args.materials + 1)
+    )
+    yield 'product_categories', ['pc_id', 'pc_name', 'img_id'], [
+        (pc_id, f"{rng.choice(PRODUCTS)}s {pc_id}", None) for pc_id in range(1, product_categories + 1)
+    ]
+    yield 'products', ['prod_id', 'pc_id', 'prod_name', 'prod_cost', 'prod_msrp', 'prod_time', 'img_id'], (
+        (prod_id, rng.randint(1, product_categories), f"{rng.choice(COLORS)} {rng.choice(PRODUCTS)} {prod_id}",
+         Decimal(rng.randint(200, 3000)) / 100, Decimal(rng.randint(3000, 9000)) / 100,
+         f"{rng.randint(1, 8)}h", None)
+        for prod_id in range(1, products + 1)
+    )
+    yield 'product_variations', ['var_id', 'prod_id', 'var_name', 'var_inv', 'var_goal', 'img_id'], (
+        (var_id, rng.randint(1, products), f"{rng.choice(COLORS)} {rng.choice(SIZES)}",
+         rng.randint(0, 40), rng.randint(0, 60), None)
+        for var_id in range(1, args.variations + 1)
+    )
+    yield 'variation_materials', ['var_id', 'mat_id', 'mat_amount'], (
+        (var_id, mat_id, rng.randint(1, 10))
+        for var_id in range(1, args.variations + 1)
+        for mat_id in sorted(rng.sample(range(1, args.materials + 1), min(args.materials, rng.randint(1, 6))))
+    )
+    yield 'calendar_categories', ['cc_id', 'cc_name', 'cc_hex'], [
+        (cc_id, f"Category {cc_id}", f"#{rng.randint(0, 0xFFFFFF):06x}") for cc_id in range(1, 9)
+    ]
+    start = datetime(2024, 1, 1)
+    yield 'calendar_events', ['event_id', 'cc_id', 'event_title', 'event_subtitle', 'event_notes', 'event_link', 'event_timestamp'], (
+        (event_id, rng.randint(1, 8), f"Event {event_id}", None, None, None,
+         start + timedelta(minutes=15 * rng.randint(0, 4 * 24 * 730)))
+        for event_id in range(1, args.events + 1)
+    )
+    yield 'table_versions', ['table_name', 'version'], [(table, 0) for table in TABLES]
+
+
+def batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed_mysql(args):
+    import mysql.connector
+    import creds
+
+    with open(os.path.join(BENCH_DIR, 'schema.sql')) as f:
+        schema = f.read()
+    conn = mysql.connector.connect(host=creds.Creds.conString, user=creds.Creds.userName,
+                                   password=creds.Creds.password)
+    cursor = conn.cursor()
+    for statement in schema.split(';'):
+        if statement.strip():
+            cursor.execute(statement)
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+    for table in TABLES + ['table_versions', 'change_log']:
+        cursor.execute(f"TRUNCATE TABLE frostedfabrics.{table}")
+    for table, columns, rows in generate(args):
+        query = f"INSERT INTO frostedfabrics.{table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        count = insert_batches(cursor, conn, query, rows)
+        print(f"{table}: {count} rows")
+    cursor.close()
+    conn.close()
+
+
+def seed_standin(args):
+    import standin
+
+    if os.path.exists(args.standin):
+        os.remove(args.standin)
+    with open(os.path.join(BENCH_DIR, 'schema.sql')) as f:
+        schema = f.read()
+    conn = sqlite3.connect(args.standin, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    for statement in standin.schema_statements(schema):
+        conn.execute(statement)
+    cursor = conn.cursor()
+    for table, columns, rows in generate(args):
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+        rows = ([str(value) if isinstance(value, (Decimal, datetime)) else value for value in row] for row in rows)
+        cursor.execute('BEGIN')
+        count = insert_batches(cursor, None, query, rows)
+        cursor.execute('COMMIT')
+        print(f"{table}: {count} rows")
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def insert_batches(cursor, conn, query, rows):
+    count = 0
+    for batch in batches(rows):
+        cursor.executemany(query, batch)
+        if conn is not None:
+            conn.commit()
+        count += len(batch)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--materials', type=int, default=100000)
+    parser.add_argument('--variations', type=int, default=50000)
+    parser.add_argument('--products', type=int, help='default: variations / 5')
+    parser.add_argument('--brands', type=int, help='default: materials / 250')
+    parser.add_argument('--material-categories', type=int, help='default: brands / 10, at most 200')
+    parser.add_argument('--product-categories', type=int, help='default: products / 500, at most 100')
+    parser.add_argument('--events', type=int, default=20000, help='calendar events over two years')
+    parser.add_argument('--seed', type=int, default=4375)
+    parser.add_argument('--standin', metavar='PATH', help='write a SQLite file for bench/standin.py instead of loading MySQL')
+    args = parser.parse_args()
+
+    started_at = time.monotonic()
+    if args.standin:
+        seed_standin(args)
+    else:
+        seed_mysql(args)
+    print(f"seeded in {time.monotonic() - started_at:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Compare the JSON providers (JSON_PROVIDER) on large list payloads.
+
+Encodes synthetic rows shaped like the API's responses, without a database:
+a materials list (50,000 rows by default) as jsonify and as a streamed
+array, and product and calendar event lists, whose Decimal and DATETIME
+columns go through the provider's fallback encoder. Prints the best time of
+--repeat runs per payload and provider, and the speedup of 'fast'.
+
+    python bench/serialization.py --rows 50000 --repeat 5
+
+Run it from the Backend directory.
+"""
+
+import argparse
+import decimal
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as backend  # noqa: E402
+
+
+def materials(count):
+    return [{
+        'mat_id': i,
+        'brand_id': i % 40 + 1,
+        'mat_name': f"Material {i}",
+        'mat_sku': f"SKU-{i:06d}",
+        'mat_inv': i % 500,
+        'mat_alert': 25,
+        'img_id': None,
+        'brand_name': f"Brand {i % 40 + 1}",
+        'mc_name': "Fabric",
+        'meas_unit': "yd",
+    } for i in range(count)]
+
+
+def products(count):
+    return [{
+        'prod_id': i,
+        'pc_id': i % 12 + 1,
+        'prod_name': f"Product {i}",
+        'prod_cost': decimal.Decimal(f"{i % 90 + 10}.25"),
+        'prod_msrp': decimal.Decimal(f"{i % 90 + 30}.99"),
+        'prod_time': "2 hours",
+        'img_id': None,
+        'pc_name': "Bags",
+    } for i in range(count)]
+
+
+def calendar_events(count):
+    start = datetime(2026, 1, 1, 9, 0)
+    return [{
+        'event_id': i,
+        'cc_id': i % 6 + 1,
+        'event_title': f"Event {i}",
+        'event_desc': "Market stall",
+        'event_timestamp': start + timedelta(minutes=37 * i),
+        'cc_name': "Markets",
+    } for i in range(count)]
+
+
+def jsonify_body(rows):
+    with backend.app.app_context():
+        return backend.app.json.response(rows).get_data()
+
+
+def streamed_body(rows):
+    return b''.join(backend.stream_response(iter(rows), lambda: None).response)
+
+
+def best_time(fn, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        fn(rows)
+        elapsed = time.perf_counter() - started_at
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000, help='rows per payload')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per payload; the fastest counts')
+    args = parser.parse_args()
+
+    payloads = [
+        ('materials jsonify', jsonify_body, materials(args.rows)),
+        ('materials streamed', streamed_body, materials(args.rows)),
+        ('products jsonify', jsonify_body, products(args.rows)),
+        ('calendarevents jsonify', jsonify_body, calendar_events(args.rows)),
+    ]
+    providers = {name: provider(backend.app) for name, provider in backend.JSON_PROVIDERS.items()}
+
+    print(f"{'payload':<26}" + ''.join(f"{name + ' ms':>12}" for name in providers) + f"{'speedup':>10}")
+    for label, fn, rows in payloads:
+        times = {}
+        for name, provider in providers.items():
+            backend.app.json = provider
+            times[name] = best_time(fn, rows, args.repeat)
+        speedup = times['default'] / times['fast']
+        print(f"{label:<26}" + ''.join(f"{times[name] * 1000:>12.1f}" for name in providers) + f"{speedup:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
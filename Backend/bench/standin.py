@@ -0,0 +1,241 @@
+"""A SQLite stand-in for MySQL, for benchmarking without a database server.
+
+install(path) replaces mysql.connector.connect with a function that opens
+the SQLite file written by `seed.py --standin`. Every statement main.py
+issues for the benchmarked routes is translated to SQLite:
+
+- %s placeholders, GREATEST and DIV;
+- TIMESTAMPDIFF(MICROSECOND, column, NOW(6)) and NOW() - INTERVAL n SECOND,
+  for the change log;
+- ON DUPLICATE KEY UPDATE (as an upsert);
+- UPDATE ... JOIN ... SET (as UPDATE ... FROM);
+- SELECT ... FOR UPDATE, by running the transaction as BEGIN IMMEDIATE.
+
+SQLite allows one writer at a time, so writes are serialized across all
+workers. Row locks only ever make writes wait for each other, so the
+invariants of the concurrent produce scenario still hold. Timings measure
+the application side (pool, shaping, serialization, HTTP), not InnoDB.
+Use a real MySQL for anything that depends on the database itself.
+"""
+
+import functools
+import itertools
+import re
+import sqlite3
+from datetime import date, datetime
+from decimal import Decimal
+
+import mysql.connector
+from mysql.connector import errorcode
+
+SCHEMA_PREFIX = re.compile(r'\bfrostedfabrics\.')
+LOCKING = re.compile(r'\bFOR UPDATE(\s+OF\s+\w+)?', re.IGNORECASE)
+WRITES = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+JOINED_UPDATE = re.compile(
+    r'^\s*UPDATE\s+(\w+)\s+(\w+)\s+(?:INNER\s+)?JOIN\s+(\w+)\s+(\w+)\s+ON\s+(.+?)\s+SET\s+(.+?)\s+WHERE\s+(.+?)\s*$',
+    re.IGNORECASE | re.DOTALL)
+UPSERT = re.compile(r'\bON DUPLICATE KEY UPDATE\b(.*)$', re.IGNORECASE | re.DOTALL)
+
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('DECIMAL', lambda raw: Decimal(raw.decode()))
+sqlite3.register_converter('DATETIME', lambda raw: datetime.fromisoformat(raw.decode()))
+
+_connection_ids = itertools.count(1)
+
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql):
+    """Return (sqlite_sql, locks) for a MySQL statement. locks is True when
+    the statement writes or takes row locks."""
+    sql = SCHEMA_PREFIX.sub('', sql)
+    locks = bool(WRITES.match(sql) or LOCKING.search(sql))
+    sql = LOCKING.sub('', sql)
+
+    joined = JOINED_UPDATE.match(sql)
+    if joined:
+        table, alias, other, other_alias, on, assignments, where = joined.groups()
+        # SQLite does not allow a qualified column on the left of SET
+        assignments = re.sub(rf'\b{alias}\.(\w+)\s*=', r'\1 =', assignments)
+        sql = f"UPDATE {table} AS {alias} SET {assignments} FROM {other} AS {other_alias} WHERE ({on}) AND ({where})"
+
+    upsert = UPSERT.search(sql)
+    if upsert:
+        assignments = re.sub(r'\bVALUES\((\w+)\)', r'excluded.\1', upsert.group(1))
+        sql = sql[:upsert.start()] + 'ON CONFLICT DO UPDATE SET' + assignments
+
+    sql = sql.replace('%s', '?')
+    sql = re.sub(r'\bGREATEST\(', 'MAX(', sql)
+    sql = re.sub(r'\bLEAST\(', 'MIN(', sql)
+    sql = re.sub(r'\sDIV\s', ' / ', sql)
+    sql = re.sub(r'@@(SESSION\.)?auto_increment_increment', '1', sql)
+    sql = re.sub(r'\bTIMESTAMPDIFF\(MICROSECOND,\s*(\w+),\s*NOW\(6\)\)',
+                 r"((julianday('now') - julianday(\1)) * 86400000000)", sql)
+    # CURRENT_TIMESTAMP columns hold 'YYYY-MM-DD HH:MM:SS', as datetime() returns
+    sql = re.sub(r'\bNOW\(\)\s*-\s*INTERVAL\s+\?\s+SECOND\b', "datetime('now', '-' || ? || ' seconds')", sql)
+    return sql, locks
+
+
+def schema_statements(schema_sql):
+    """Translate the CREATE TABLE statements of bench/schema.sql."""
+    statements = []
+    for statement in schema_sql.split(';'):
+        statement = '\n'.join(line for line in statement.splitlines() if not line.strip().startswith('--')).strip()
+        if not statement.upper().startswith('CREATE TABLE'):
+            continue
+        statement = SCHEMA_PREFIX.sub('', statement)
+        table = re.search(r'CREATE TABLE IF NOT EXISTS (\w+)', statement).group(1)
+        indexes = re.findall(r',\s*KEY (\w+) \(([^)]*)\)', statement)
+        statement = re.sub(r',\s*KEY \w+ \([^)]*\)', '', statement)
+        statement = statement.replace('BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY', 'INTEGER PRIMARY KEY')
+        statement = statement.replace('INT NOT NULL AUTO_INCREMENT PRIMARY KEY', 'INTEGER PRIMARY KEY')
+        statement = statement.replace('CURRENT_TIMESTAMP(6)', 'CURRENT_TIMESTAMP')
+        statement = statement.replace('BIGINT UNSIGNED', 'BIGINT')
+        statements.append(statement)
+        statements.extend(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})" for name, columns in indexes)
+    return statements
+
+
+def as_mysql_error(err):
+    message = str(err)
+    if isinstance(err, sqlite3.IntegrityError):
+        return mysql.connector.errors.IntegrityError(msg=message, errno=errorcode.ER_DUP_ENTRY)
+    if 'locked' in message or 'busy' in message:
+        return mysql.connector.errors.DatabaseError(msg=message, errno=errorcode.ER_LOCK_WAIT_TIMEOUT)
+    return mysql.connector.errors.ProgrammingError(msg=message, errno=errorcode.ER_PARSE_ERROR)
+
+
+class StandinCursor:
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection.sqlite.cursor()
+        self._dictionary = dictionary
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, sql, params=None):
+        if sql.strip().upper() == 'START TRANSACTION':
+            self._connection.commit()
+            return
+        translated, locks = translate(sql)
+        self._connection.begin(locks)
+        try:
+            self._cursor.execute(translated, tuple(params or ()))
+        except sqlite3.Error as err:
+            raise as_mysql_error(err) from err
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+
+    def executemany(self, sql, seq_params):
+        rows = [tuple(params) for params in seq_params]
+        translated, locks = translate(sql)
+        self._connection.begin(locks)
+        try:
+            if sql.lstrip().upper().startswith('INSERT') and not UPSERT.search(sql):
+                # Like a multi-row MySQL INSERT, report the first generated id
+                first_id = None
+                for params in rows:
+                    self._cursor.execute(translated, params)
+                    first_id = first_id or self._cursor.lastrowid
+                self.lastrowid = first_id
+                self.rowcount = len(rows)
+            else:
+                self._cursor.executemany(translated, rows)
+                self.rowcount = self._cursor.rowcount
+        except sqlite3.Error as err:
+            raise as_mysql_error(err) from err
+
+    def _shape(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    def fetchone(self):
+        return self._shape(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._shape(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._shape(row) for row in self._cursor.fetchall()]
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self._cursor.description or ())
+
+    def close(self):
+        self._cursor.close()
+
+
+class StandinConnection:
+    """The subset of MySQLConnection that main.py and pool.py use. Like a
+    MySQL session with autocommit off, the first statement opens a
+    transaction that lasts until commit() or rollback()."""
+
+    def __init__(self, path):
+        self.sqlite = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                      check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.sqlite.execute('PRAGMA busy_timeout = 60000')
+        self.connection_id = next(_connection_ids)
+        self._writing = False
+
+    def begin(self, locks):
+        if self.sqlite.in_transaction:
+            if not locks or self._writing:
+                return
+            # SQLite cannot upgrade a read snapshot to a writer reliably, so
+            # the reads so far are committed and a write transaction started
+            self.sqlite.execute('COMMIT')
+        try:
+            self.sqlite.execute('BEGIN IMMEDIATE' if locks else 'BEGIN')
+        except sqlite3.Error as err:
+            raise as_mysql_error(err) from err
+        self._writing = locks
+
+    @property
+    def in_transaction(self):
+        return self.sqlite.in_transaction
+
+    def cursor(self, dictionary=False, buffered=None, prepared=None):
+        return StandinCursor(self, dictionary)
+
+    def commit(self):
+        if self.sqlite.in_transaction:
+            try:
+                self.sqlite.execute('COMMIT')
+            except sqlite3.Error as err:
+                raise as_mysql_error(err) from err
+        self._writing = False
+
+    def rollback(self):
+        if self.sqlite.in_transaction:
+            self.sqlite.execute('ROLLBACK')
+        self._writing = False
+
+    def consume_results(self):
+        pass
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self.rollback()
+        self.sqlite.close()
+
+
+def connect(path, **connect_args):
+    return StandinConnection(path)
+
+
+def install(path):
+    """Route every new mysql.connector connection to the stand-in at path.
+    Call before importing main."""
+    mysql.connector.connect = functools.partial(connect, path)
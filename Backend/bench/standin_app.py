@@ -0,0 +1,13 @@
+"""WSGI entry point that serves main:app on the SQLite stand-in named by
+$STANDIN_DB (see standin.py). bench/run.py starts it with
+
+    gunicorn -c gunicorn.conf.py --pythonpath bench standin_app:app
+"""
+
+import os
+
+import standin
+
+standin.install(os.environ['STANDIN_DB'])
+
+from main import app  # only after install(), main connects on import
@@ -0,0 +1,149 @@
+"""Compare the API with and without the prepared statement cache.
+
+Starts two gunicorn servers against the database configured in .env, one
+with the default DB_STATEMENT_CACHE_SIZE and one with
+DB_STATEMENT_CACHE_SIZE=0 (plain text queries), and drives both with the
+single-row lookups the cache is meant for. The response cache is turned off
+on both, so every request reaches MySQL. Each round loads the servers one
+after the other, alternating which goes first; the last line reports the
+cached server's throughput relative to the uncached one.
+
+    python bench/statements.py --concurrency 16 --duration 10 --rounds 3
+
+Run it from the Backend directory, after bench/seed.py.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+# Single-row lookups, each one primary key query plus its dimension names
+LOOKUPS = ['/api/products/{prod_id}', '/api/productvariations/{var_id}', '/api/materials/{mat_id}']
+
+
+def start_server(args, port, statement_cache_size):
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, DB_POOL_SIZE=str(args.threads), RESPONSE_CACHE_MAX_BYTES='0')
+    if statement_cache_size is not None:
+        env['DB_STATEMENT_CACHE_SIZE'] = str(statement_cache_size)
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(args.workers), '--threads', str(args.threads), '--worker-class', 'gthread', 'main:app'],
+        cwd=backend, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url + '/api/test', timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def load_ids(url):
+    ids = {}
+    for key, path in (('prod_id', '/api/products'), ('var_id', '/api/productvariations'), ('mat_id', '/api/materials')):
+        rows = httpx.get(url + path, timeout=60).json()
+        if not rows:
+            raise RuntimeError("The database is empty, run bench/seed.py first")
+        ids[key] = [row[key] for row in rows]
+    return ids
+
+
+async def run_load(base_url, concurrency, duration, ids, seed):
+    """Keep `concurrency` lookups in flight for `duration` seconds. Returns
+    (latencies of successful requests, error count)."""
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def worker(index):
+            nonlocal errors
+            rng = random.Random(seed + index)
+            while time.monotonic() < deadline:
+                path = rng.choice(LOOKUPS).format(**{key: rng.choice(values) for key, values in ids.items()})
+                started_at = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    if response.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started_at)
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2, help='worker processes per server')
+    parser.add_argument('--threads', type=int, default=8, help='gthread threads (and pool size) per worker')
+    parser.add_argument('--concurrency', type=int, default=16, help='client concurrency')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per server and round')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds per server before the first round')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--cache-size', type=int, help='DB_STATEMENT_CACHE_SIZE of the cached server (default: its own default)')
+    parser.add_argument('--seed', type=int, default=4375)
+    args = parser.parse_args()
+
+    servers = {'cached': 'http://127.0.0.1:5104', 'uncached': 'http://127.0.0.1:5105'}
+    processes = [start_server(args, 5104, args.cache_size), start_server(args, 5105, 0)]
+    try:
+        for url in servers.values():
+            wait_until_ready(url)
+        ids = load_ids(servers['cached'])
+        for url in servers.values():
+            asyncio.run(run_load(url, args.concurrency, args.warmup, ids, args.seed))
+
+        latencies = {mode: [] for mode in servers}
+        errors = dict.fromkeys(servers, 0)
+        order = list(servers)
+        for round_index in range(args.rounds):
+            for mode in order:
+                measured, failed = asyncio.run(run_load(servers[mode], args.concurrency, args.duration, ids,
+                                                        args.seed + round_index))
+                latencies[mode] += measured
+                errors[mode] += failed
+            order.reverse()
+
+        print(f"{'mode':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        throughput = {}
+        for mode in servers:
+            throughput[mode] = len(latencies[mode]) / (args.duration * args.rounds)
+            print(f"{mode:>8} {throughput[mode]:>9.1f} {percentile(latencies[mode], 0.5) * 1000:>8.2f} "
+                  f"{percentile(latencies[mode], 0.95) * 1000:>8.2f} {percentile(latencies[mode], 0.99) * 1000:>8.2f} "
+                  f"{errors[mode]:>7}")
+        if throughput['uncached']:
+            print(f"statement cache: {throughput['cached'] / throughput['uncached']:.2f}x the uncached throughput")
+    finally:
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+        for process in processes:
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""gzip/deflate response compression negotiated with Accept-Encoding.
+
+Used by both entry points. Bodies smaller than min_size are sent as they
+are; streamed bodies are compressed chunk by chunk as they are sent. A
+compressed representation is a different entity, so its strong ETag gets the
+encoding appended ("<etag>-gzip"), as Apache does; etag_variants lets an
+If-None-Match check accept either form.
+"""
+
+import zlib
+
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+ENCODINGS = ('gzip', 'deflate')
+# zlib window bits: 16 + 15 adds the gzip header; plain 15 is the zlib
+# format that HTTP calls deflate
+WBITS = {'gzip': 31, 'deflate': 15}
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/plain')
+
+
+class Compressor:
+    def __init__(self, level, min_size):
+        self.level = level
+        self.min_size = min_size
+
+    @property
+    def enabled(self):
+        return self.level > 0
+
+    def negotiate(self, accept_encoding):
+        """The encoding to use for a client sending this Accept-Encoding
+        header, or None."""
+        if not self.enabled or not accept_encoding:
+            return None
+        return parse_accept_header(accept_encoding, Accept).best_match(ENCODINGS)
+
+    def compress(self, body, encoding):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS[encoding])
+        return compressor.compress(body) + compressor.flush()
+
+    def iter_compressed(self, chunks, encoding):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS[encoding])
+        try:
+            for chunk in chunks:
+                data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+                if data:
+                    yield data
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        yield compressor.flush()
+
+
+def is_compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+def encoded_etag(etag, encoding):
+    return f"{etag}-{encoding}"
+
+
+def etag_variants(etag, encoding):
+    """The ETags a client may hold for this entity: the identity one, and
+    the one of the encoding it would be sent with."""
+    return (etag,) if encoding is None else (etag, encoded_etag(etag, encoding))
@@ -4,7 +4,9 @@ import os
 load_dotenv()
 
 class Creds:
-    conString = 'frosted-fabrics.ctesqau4gr0e.us-east-1.rds.amazonaws.com'
+    conString = os.getenv('dbhost', 'frosted-fabrics.ctesqau4gr0e.us-east-1.rds.amazonaws.com')
     userName = os.getenv('dbusername')
     password = os.getenv('dbpassword')
     dbName = 'frostedfabrics'
+    # Read replicas, e.g. dbreplicas=replica-1.example.com,replica-2.example.com
+    replicaHosts = [host.strip() for host in os.getenv('dbreplicas', '').split(',') if host.strip()]
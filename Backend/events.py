@@ -0,0 +1,266 @@
+"""Change events pushed to /api/events subscribers.
+
+Write handlers publish an event per changed row to the EventHub of their
+worker process, which hands it to every subscription of that process. Each
+subscription has a bounded queue; a client too slow to drain it gets a
+`resync` event in place of the events it missed and should reload its data.
+
+Under gunicorn each worker only sees its own writes, so the hub can also be
+connected to a broker: a small relay listening on a Unix socket that forwards
+every event a worker sends to all the other workers. gunicorn.conf.py runs
+the broker in the master process. Without gunicorn it can be started on its
+own with `python events.py <socket path>`. While a worker is cut off from the
+broker its subscribers get `resync` once the connection is back, since events
+from other workers may have been missed in between.
+"""
+
+import logging
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Sent to every subscription, whatever its topics, when events were lost
+RESYNC = 'resync'
+
+BROKER_RECONNECT_DELAY = 1  # second
+BROKER_SEND_TIMEOUT = 5  # seconds a worker may block the broker before it is dropped
+
+
+def set_send_timeout(sock):
+    # Only sends time out; reads block for as long as the other side is idle
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack('ll', BROKER_SEND_TIMEOUT, 0))
+
+
+def encode(topic, payload):
+    # payload is JSON, which never contains a raw newline
+    return f"{topic}\t{payload}\n".encode()
+
+
+def decode(line):
+    topic, _, payload = line.decode().rstrip('\n').partition('\t')
+    return topic, payload
+
+
+class Subscription:
+    def __init__(self, hub, topics, max_queued):
+        self.hub = hub
+        self.topics = topics  # None for every topic
+        self._queue = queue.Queue(max_queued)
+        self._overflowed = False
+
+    def deliver(self, topic, payload):
+        """Called by the hub, on whichever thread published the event.
+        Returns False if the subscription does not want the topic."""
+        if self.topics is not None and topic not in self.topics and topic != RESYNC:
+            return False
+        try:
+            self._queue.put_nowait((topic, payload))
+        except queue.Full:
+            if not self._overflowed:
+                metrics.EVENTS_DROPPED.inc()
+            self._overflowed = True
+        return True
+
+    def get(self, timeout=None):
+        """The next (topic, payload), or None if nothing arrives within
+        timeout seconds. timeout=0 only returns what is already queued."""
+        if self._overflowed:
+            # Anything still queued is older than what was dropped
+            self._overflowed = False
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            return RESYNC, '{}'
+        try:
+            return self._queue.get(block=timeout != 0, timeout=timeout or None)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    def __init__(self, max_queued, broker_path=None):
+        self.max_queued = max_queued
+        self.broker_path = broker_path
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._missed_sends = False
+        self._thread = None
+
+    def subscribe(self, topics=None, subscription_class=Subscription):
+        subscription = subscription_class(self, topics, self.max_queued)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        metrics.EVENT_SUBSCRIBERS.inc()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription not in self._subscriptions:
+                return
+            self._subscriptions.discard(subscription)
+        metrics.EVENT_SUBSCRIBERS.dec()
+
+    def _deliver(self, topic, payload):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.deliver(topic, payload)
+
+    def publish(self, topic, payload):
+        """Send payload (a JSON string) to the subscribers of topic in this
+        process and, through the broker, in every other worker."""
+        metrics.EVENTS_PUBLISHED.labels(topic).inc()
+        self._deliver(topic, payload)
+        if self.broker_path:
+            self._send(encode(topic, payload))
+
+    def _send(self, line):
+        with self._send_lock:
+            if self._sock is None:
+                self._missed_sends = True
+                return
+            try:
+                self._sock.sendall(line)
+            except OSError as e:
+                logger.error(f"Lost the connection to the event broker: {str(e)}")
+                self._missed_sends = True
+                self._disconnect()
+
+    def _disconnect(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.broker_path)
+        except OSError:
+            sock.close()
+            raise
+        set_send_timeout(sock)
+        with self._send_lock:
+            self._sock = sock
+            missed, self._missed_sends = self._missed_sends, False
+            if missed:
+                # Tell the other workers that some of this worker's events never reached them
+                try:
+                    sock.sendall(encode(RESYNC, '{}'))
+                except OSError:
+                    pass
+        return sock
+
+    def _run(self):
+        connected_before = False
+        reported = False
+        while True:
+            try:
+                sock = self._connect()
+            except OSError as e:
+                if not reported:
+                    logger.error(f"Could not connect to the event broker at {self.broker_path}: {str(e)}")
+                    reported = True
+                time.sleep(BROKER_RECONNECT_DELAY)
+                continue
+            if connected_before:
+                self._deliver(RESYNC, '{}')
+            connected_before = True
+            reported = False
+            try:
+                for line in sock.makefile('rb'):
+                    self._deliver(*decode(line))
+            except OSError:
+                pass
+            with self._send_lock:
+                if self._sock is sock:
+                    self._disconnect()
+            logger.warning("Disconnected from the event broker, reconnecting")
+            time.sleep(BROKER_RECONNECT_DELAY)
+
+    def start(self):
+        """Connect to the broker in the background, if one is configured."""
+        if not self.broker_path or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="event-broker-client", daemon=True)
+        self._thread.start()
+
+
+class Broker:
+    """Relays every line a worker sends to all the other connected workers."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._peers = {}  # socket -> lock held while writing to it
+
+    def _drop(self, peer):
+        with self._lock:
+            if self._peers.pop(peer, None) is None:
+                return
+        try:
+            # shutdown, not just close: forked workers may hold copies of the socket
+            peer.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        peer.close()
+
+    def _relay(self, sender, line):
+        with self._lock:
+            peers = [(peer, lock) for peer, lock in self._peers.items() if peer is not sender]
+        for peer, lock in peers:
+            try:
+                with lock:
+                    peer.sendall(line)
+            except OSError:
+                # The worker reconnects and tells its subscribers to resync
+                self._drop(peer)
+
+    def _serve(self, peer):
+        try:
+            for line in peer.makefile('rb'):
+                self._relay(peer, line)
+        except OSError:
+            pass
+        finally:
+            self._drop(peer)
+
+    def serve_forever(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen()
+        while True:
+            peer, _ = server.accept()
+            set_send_timeout(peer)
+            with self._lock:
+                self._peers[peer] = threading.Lock()
+            threading.Thread(target=self._serve, args=(peer,), name="event-broker-peer", daemon=True).start()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="event-broker", daemon=True).start()
+
+
+if __name__ == '__main__':
+    Broker(sys.argv[1]).serve_forever()
@@ -0,0 +1,92 @@
+"""orjson-backed JSON provider for the Flask app.
+
+FastJSONProvider is a drop-in replacement for Flask's DefaultJSONProvider
+that encodes in C instead of through the json module. The output means the
+same as before: keys are sorted, Decimal columns (prod_cost, brand_price)
+are strings, and DATETIME/DATE columns are HTTP dates, which the frontend
+parses as UTC. bytes, which DefaultJSONProvider refused, are written as
+UTF-8 text, or base64 when they are not valid UTF-8. Non-ASCII text is
+written as UTF-8 rather than \\u escapes.
+
+The value types a database row can hold are looked up in ENCODERS by exact
+type, so a row full of Decimals does not walk the isinstance chain of
+DefaultJSONProvider.default once per value.
+"""
+
+import base64
+import datetime
+import decimal
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+import metrics
+
+# datetimes and dates go through ENCODERS too, as orjson would write ISO 8601
+OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+INDENTED_OPTIONS = OPTIONS | orjson.OPT_INDENT_2
+
+
+# English names whatever the locale, as HTTP dates require
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = (None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def encode_datetime(value):
+    """werkzeug.http.http_date, without its detour through email.utils.
+    Naive datetimes are taken to be UTC, as there."""
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return (f"{WEEKDAYS[value.weekday()]}, {value.day:02d} {MONTHS[value.month]} {value.year:04d} "
+            f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT")
+
+
+def encode_date(value):
+    return f"{WEEKDAYS[value.weekday()]}, {value.day:02d} {MONTHS[value.month]} {value.year:04d} 00:00:00 GMT"
+
+
+def encode_bytes(value):
+    try:
+        return bytes(value).decode()
+    except UnicodeDecodeError:
+        return base64.b64encode(value).decode()
+
+
+ENCODERS = {
+    decimal.Decimal: str,
+    datetime.datetime: encode_datetime,
+    datetime.date: encode_date,
+    bytes: encode_bytes,
+    bytearray: encode_bytes,
+}
+
+
+def default(value):
+    encode = ENCODERS.get(type(value))
+    if encode is None:
+        # UUIDs, dataclasses, subclasses of the types above
+        return DefaultJSONProvider.default(value)
+    return encode(value)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps_bytes(self, obj, indent=False):
+        """obj encoded as compact (or indented) UTF-8 JSON."""
+        with metrics.timed('serialization'):
+            return orjson.dumps(obj, default=default, option=INDENTED_OPTIONS if indent else OPTIONS)
+
+    def dumps(self, obj, **kwargs):
+        # response() passes one of these; anything else needs the json module
+        if set(kwargs) - {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj, bool(kwargs.get('indent'))).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumps_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
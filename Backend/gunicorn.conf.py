@@ -0,0 +1,36 @@
+# gunicorn settings for production: gunicorn -c gunicorn.conf.py main:app
+import os
+import shutil
+
+# The same address as `python main.py` (BIND_HOST, see README)
+bind = f"{os.getenv('BIND_HOST', '127.0.0.1')}:5000"
+
+# Workers write their metrics here so /metrics can add them up (see metrics.py).
+# This must be set before the workers import prometheus_client.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/frostedfabrics-metrics')
+
+# Read-your-writes pins shared by the workers (see replicas.py)
+pin_dir = os.environ.setdefault('DB_PIN_DIR', '/tmp/frostedfabrics-pins')
+
+# Relays /api/events change events between the workers (see events.py)
+event_broker_socket = os.environ.setdefault('EVENT_BROKER_SOCKET', '/tmp/frostedfabrics-events.sock')
+
+def on_starting(server):
+    # Samples left over from a previous run would be counted again
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    shutil.rmtree(pin_dir, ignore_errors=True)
+    os.makedirs(pin_dir)
+    # Runs in the master, which outlives any worker
+    import events
+    events.Broker(event_broker_socket).start()
+
+def post_worker_init(worker):
+    # Background threads belong in the workers: started in the master they
+    # would not survive the fork (see start_background_tasks in main.py)
+    import main
+    main.start_background_tasks()
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,163 @@
+"""Logging that stays off the request path.
+
+Request threads only put records on a bounded queue. A background
+QueueListener thread formats them as one JSON object per line and writes
+them to stdout. When the queue is full, records are dropped and counted
+rather than blocking the request.
+
+- Records are tagged with the current request id.
+- Per-query debug logs (the "queries" logger) are sampled at
+  LOG_QUERY_SAMPLE_RATE.
+- Repeats of the same error are limited to LOG_ERROR_BURST per
+  LOG_ERROR_WINDOW seconds. The next record that gets through reports how
+  many were suppressed.
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import flask
+
+import metrics
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_QUERY_SAMPLE_RATE = float(os.getenv('LOG_QUERY_SAMPLE_RATE', '0.01'))  # fraction of queries logged
+LOG_ERROR_BURST = int(os.getenv('LOG_ERROR_BURST', '5'))  # identical errors logged per window
+LOG_ERROR_WINDOW = float(os.getenv('LOG_ERROR_WINDOW', '60'))  # seconds
+
+QUERY_LOGGER = 'queries'
+
+# Request id for code that runs outside a Flask request (asgi_app.py)
+current_request_id = contextvars.ContextVar('request_id', default=None)
+
+
+class RequestIdFilter(logging.Filter):
+    """Tag records with the id of the request that logged them."""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            if flask.has_request_context():
+                record.request_id = flask.g.get('request_id')
+            else:
+                record.request_id = current_request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class ErrorRateLimitFilter(logging.Filter):
+    """Let through at most `burst` identical ERROR records (same logger, call
+    site and message) per `window` seconds."""
+
+    def __init__(self, burst, window):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        self._seen = {}  # key -> [window_started_at, count, suppressed]
+
+    def filter(self, record):
+        if record.levelno < logging.ERROR:
+            return True
+        key = (record.name, record.pathname, record.lineno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                if len(self._seen) > 10000:
+                    self._seen.clear()
+                suppressed = entry[2] if entry is not None else 0
+                self._seen[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            entry[1] += 1
+            if entry[1] <= self.burst:
+                return True
+            entry[2] += 1
+            return False
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'thread': record.threadName,
+        }
+        if getattr(record, 'suppressed', None):
+            entry['suppressed_repeats'] = record.suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener and drops records
+    instead of blocking when the queue is full."""
+
+    def prepare(self, record):
+        # The stock prepare() formats the message and traceback here, on the
+        # request thread; the listener's formatter does it instead
+        return copy.copy(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+
+_listener = None
+
+
+def configure():
+    """Route all logging through the background queue. Safe to call more
+    than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(ErrorRateLimitFilter(LOG_ERROR_BURST, LOG_ERROR_WINDOW))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JSONFormatter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    query_logger = logging.getLogger(QUERY_LOGGER)
+    query_logger.setLevel(logging.DEBUG if LOG_QUERY_SAMPLE_RATE > 0 else logging.WARNING)
+    query_logger.addFilter(SamplingFilter(LOG_QUERY_SAMPLE_RATE))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -1,77 +1,1179 @@
 __authors__ = "John Tran, Kevin Tojin, Elian Gutierrez"
 
 import mysql.connector
-from mysql.connector import pooling
 from contextlib import contextmanager
 import logging
+import uuid
 import flask
-from flask import jsonify, request, make_response
+from flask import jsonify, request, make_response, g
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.serving import is_running_from_reloader
+import compression
 import creds
-import traceback
-from urllib.parse import unquote
+import events
+import fastjson
+import logpipeline
+import metrics
+import pool
+import replicas
+import resilience
+import responsecache
+import search
+from urllib.parse import unquote, quote
 import time
-
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+import os
+import re
+import threading
+import base64
+import json
+import hashlib
+import functools
+import contextvars
+from datetime import datetime, timedelta
+
+# Logging goes through a background thread once start_background_tasks runs
+# (see logpipeline.py)
 logger = logging.getLogger(__name__)
+query_logger = logging.getLogger(logpipeline.QUERY_LOGGER)
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Counts jsonify and streamed-row encoding as serialization time."""
+    def dumps(self, obj, **kwargs):
+        with metrics.timed('serialization'):
+            return super().dumps(obj, **kwargs)
+
+    def dumps_bytes(self, obj, indent=False):
+        return self.dumps(obj, indent=2 if indent else None).encode()
+
+# JSON_PROVIDER picks the encoder behind jsonify and the streamed lists:
+# 'fast' (orjson, see fastjson.py) or 'default' (Flask's, on the json module)
+JSON_PROVIDERS = {'fast': fastjson.FastJSONProvider, 'default': TimedJSONProvider}
+JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'fast')
 
 # Setting up the Flask application
 app = flask.Flask(__name__)
+app.json = JSON_PROVIDERS[JSON_PROVIDER](app)
 app.config["DEBUG"] = True
 
-# Create a connection pool with an adjusted size
-connection_pool = mysql.connector.pooling.MySQLConnectionPool(
-    pool_name="mypool",
-    pool_size=10,  # Increased pool size to handle more concurrent requests
-    pool_reset_session=True,
-    host=creds.Creds.conString,
-    user=creds.Creds.userName,
-    password=creds.Creds.password,
-    database=creds.Creds.dbName,
-    connection_timeout=300,  # Timeout in seconds
+# Connection pools, sized per worker process. When every connection is in use
+# up to DB_POOL_MAX_WAITERS requests queue for DB_POOL_WAIT_TIMEOUT seconds;
+# anything beyond that is answered with 503 + Retry-After.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_REPLICA_POOL_SIZE = int(os.getenv('DB_REPLICA_POOL_SIZE', str(DB_POOL_SIZE)))
+
+def create_pool(name, host, size):
+    return pool.ConnectionPool(
+        name=name,
+        size=size,
+        max_waiters=int(os.getenv('DB_POOL_MAX_WAITERS', str(size * 2))),
+        wait_timeout=float(os.getenv('DB_POOL_WAIT_TIMEOUT', '5')),  # seconds
+        health_check_after=float(os.getenv('DB_POOL_HEALTH_CHECK_AFTER', '30')),  # seconds idle before a ping
+        statement_cache_size=int(os.getenv('DB_STATEMENT_CACHE_SIZE', '64')),  # prepared statements per connection
+        host=host,
+        user=creds.Creds.userName,
+        password=creds.Creds.password,
+        database=creds.Creds.dbName,
+        connection_timeout=300,  # Timeout in seconds
+    )
+
+connection_pool = create_pool('primary', creds.Creds.conString, DB_POOL_SIZE)
+
+# Reads go to a replica unless the request writes or its client wrote within
+# DB_PRIMARY_PIN_WINDOW seconds (see replicas.py)
+replica_set = replicas.ReplicaSet(
+    [replicas.Replica(host, create_pool(host, host, DB_REPLICA_POOL_SIZE)) for host in creds.Creds.replicaHosts],
+    max_lag=float(os.getenv('DB_REPLICA_MAX_LAG', '3')),  # seconds behind before a replica is skipped
+    check_interval=float(os.getenv('DB_REPLICA_CHECK_INTERVAL', '2')),  # seconds between lag checks
+)
+primary_pins = replicas.PrimaryPins(
+    window=float(os.getenv('DB_PRIMARY_PIN_WINDOW', '5')),  # seconds
+    shared_dir=os.getenv('DB_PIN_DIR'),
+)
+
+# Retries only transient errors, with jittered exponential backoff and a
+# per-process retry budget; the breaker fails calls fast while the database
+# is unreachable (see resilience.py)
+circuit_breaker = resilience.CircuitBreaker(
+    failure_threshold=int(os.getenv('DB_BREAKER_THRESHOLD', '5')),  # consecutive connection errors
+    cooldown=float(os.getenv('DB_BREAKER_COOLDOWN', '10')),  # seconds before a probe is let through
+)
+db_policy = resilience.RetryPolicy(
+    circuit_breaker,
+    resilience.RetryBudget(ratio=float(os.getenv('DB_RETRY_BUDGET_RATIO', '0.1')), max_tokens=10),
+    max_attempts=3,
+    base_delay=0.05,  # seconds
+    max_delay=1,  # seconds
 )
 
+# Raised instead of waiting on the database; answered with 503 + Retry-After
+SHED_ERRORS = (pool.PoolExhausted, resilience.CircuitOpen)
+
+def checkout_connection(replica=None):
+    if replica is not None:
+        with metrics.timed('pool_wait'):
+            try:
+                connection = replica.pool.get_connection()
+            except pool.PoolExhausted as e:
+                if flask.has_request_context():
+                    g.shed_retry_after = e.retry_after
+                raise
+            except mysql.connector.Error as err:
+                replica_set.report_error(replica, err)
+                raise
+        return metrics.TimedConnection(connection)
+
+    probe = False
+    with metrics.timed('pool_wait'):
+        try:
+            probe = circuit_breaker.before_call()
+            connection = connection_pool.get_connection()
+            if probe:
+                try:
+                    connection.ping(reconnect=True, attempts=1)
+                except Exception:
+                    connection.close()
+                    raise
+                circuit_breaker.record_success()
+        except SHED_ERRORS as e:
+            if probe:
+                # Let the next caller probe after another cooldown
+                circuit_breaker.record_failure()
+            # Handlers turn unexpected errors into 500s; remember why so
+            # shed_overloaded_response can answer 503 instead
+            if flask.has_request_context():
+                g.shed_retry_after = e.retry_after
+            raise
+        except mysql.connector.Error as err:
+            circuit_breaker.record_error(err)
+            if probe and not resilience.is_connection_error(err):
+                circuit_breaker.record_failure()
+            raise
+    return metrics.TimedConnection(connection)
+
+def overloaded_response(retry_after):
+    response = make_response(jsonify({"error": "Service Unavailable", "details": "The server is busy, try again shortly"}), 503)
+    response.headers['Retry-After'] = str(max(1, int(round(retry_after))))
+    return response
+
+# ============== READ COALESCING ============
+# Identical SELECTs that run at the same time share one execution: the first
+# caller runs the query and the others wait for its result instead of taking
+# connections of their own, so a burst of the same request (every dashboard
+# opening at once) costs one query. Only reads that may be served by a
+# replica are shared; reads that must see the caller's own writes always run
+# on their own.
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> Flight
+
+    def run(self, key, fn):
+        """Return fn(), or the result of the call with the same key that is
+        already running. Rows are copied for every caller when the result is
+        shared, since callers modify the rows they get."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            metrics.DB_COALESCED.labels('select').inc()
+            flight.done.wait()
+            if flight.error is not None:
+                if isinstance(flight.error, SHED_ERRORS) and flask.has_request_context():
+                    g.shed_retry_after = flight.error.retry_after
+                raise flight.error
+            return [dict(row) for row in flight.result]
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                shared = flight.followers > 0
+            flight.done.set()
+        return [dict(row) for row in flight.result] if shared else flight.result
+
+select_flights = SingleFlight()
+
+def can_coalesce():
+    pinned = g.get('pinned_connection') if flask.has_app_context() else None
+    return pinned is None and not reads_on_primary()
+
+def params_key(params):
+    return tuple(params) if isinstance(params, (list, tuple)) else params
+
+# ============== READ/WRITE SPLITTING ============
+def client_key():
+    """Who a read-your-writes pin belongs to: the X-Client-ID header, or the
+    client address."""
+    return request.headers.get('X-Client-ID') or request.remote_addr or ''
+
+def is_read_request():
+    # /api/batch is a POST, but only ever runs GET routes
+    return request.method in ('GET', 'HEAD') or request.endpoint == 'batchGet'
+
+# Set by background jobs that read the change log and then the rows it
+# names, which a lagging replica may not have yet
+primary_reads_only = contextvars.ContextVar('primary_reads_only', default=False)
+
+def reads_on_primary():
+    if primary_reads_only.get():
+        return True
+    if not flask.has_request_context():
+        return False
+    # Decided once per request: the pin lookup may stat a file
+    on_primary = g.get('reads_on_primary')
+    if on_primary is None:
+        on_primary = g.reads_on_primary = not is_read_request() or primary_pins.is_pinned(client_key())
+    return on_primary
+
+def choose_replica():
+    """The replica to run the current read on, or None for the primary."""
+    replica = None
+    if replica_set.replicas and not reads_on_primary():
+        replica = replica_set.choose()
+    metrics.DB_READS.labels('primary' if replica is None else 'replica').inc()
+    return replica
+
 @contextmanager
-def get_db_connection():
-    connection = connection_pool.get_connection()
+def get_db_connection(read_only=False):
+    """Check out a pooled connection. read_only connections may come from a
+    replica; all others come from the primary, and using one in a write
+    request pins the client to the primary for its next reads."""
+    # /api/batch pins one pooled connection for all of its sub-requests
+    pinned = g.get('pinned_connection') if flask.has_app_context() else None
+    if pinned is not None:
+        yield pinned
+        return
+    replica = choose_replica() if read_only else None
+    connection = checkout_connection(replica)
     try:
         yield connection
+    except mysql.connector.Error as err:
+        if replica is not None:
+            replica_set.report_error(replica, err)
+        raise
     finally:
         connection.close()
+        if replica_set.replicas and not read_only and flask.has_request_context() and not is_read_request():
+            primary_pins.pin(client_key())
 
+# The helpers below run their statement through the connection's prepared
+# statement cache, so repeated queries skip parsing on the server
 def execute_select_query(query, params=None):
-    max_retries = 3
-    retry_delay = 1  # second
-
-    for attempt in range(max_retries):
+    def run():
+        with get_db_connection(read_only=True) as conn:
+            with metrics.timed('db_execute'):
+                cursor = conn.statements.execute(query, params)
+                return cursor.fetchall()
+    if not can_coalesce():
+        return db_policy.run(run, log=logger.error)
+    return select_flights.run((query, params_key(params)), lambda: db_policy.run(run, log=logger.error))
+
+def execute_write_query(query, params=None, touches=(), changes=()):
+    """Run one write statement and commit. touches names the tables whose
+    versions to bump; changes lists (table, op, keys) for the change log.
+    Both are skipped when the statement matched no rows."""
+    def run():
+        with get_db_connection() as conn:
+            with metrics.timed('db_execute'):
+                rowcount = conn.statements.execute(query, params).rowcount
+            if rowcount:
+                cursor = conn.cursor()
+                for table, op, keys in changes:
+                    log_changes(cursor, table, op, keys)
+                bump_table_versions(cursor, touches)
+            conn.commit()
+            return rowcount
+    # A write that lost its connection may have committed; only retry
+    # errors where MySQL is known to have rolled it back
+    return db_policy.run(run, idempotent=False, log=logger.error)
+
+def execute_insert_query(query, params=None, touches=(), table=None):
+    """Like execute_write_query, but returns the generated auto-increment id.
+    When table is given, the new row is logged as an insert into it."""
+    def run():
+        with get_db_connection() as conn:
+            with metrics.timed('db_execute'):
+                new_id = conn.statements.execute(query, params).lastrowid
+            cursor = conn.cursor()
+            if table is not None:
+                log_changes(cursor, table, 'insert', [(new_id,)])
+            bump_table_versions(cursor, touches)
+            conn.commit()
+            return new_id
+    return db_policy.run(run, idempotent=False, log=logger.error)
+
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', '500'))  # rows per fetchmany
+
+class StreamFlight:
+    """One streamed SELECT whose rows any number of StreamedSelects can read
+    at the same time. The query is executed eagerly (by start) so that
+    errors still surface before a response is started. Rows are fetched in
+    chunks by whichever reader is furthest ahead, and a chunk is dropped once
+    every reader has passed it. The pooled connection is released as soon as
+    the rows are exhausted or the last reader leaves (werkzeug closes the
+    response iterable when the client finishes or disconnects)."""
+
+    def __init__(self, chunk_size, flights=None, key=None):
+        self.chunk_size = chunk_size
+        self.columns = None
+        self._flights = flights
+        self._key = key
+        self._lock = threading.Lock()
+        self._started = threading.Event()
+        self._conn = None
+        self._cursor = None
+        self._chunks = {}  # chunk index -> list of row tuples
+        self._fetched = 0
+        self._dropped = 0  # chunks below this index have been dropped
+        self._exhausted = False
+        self._closed = False
+        self._error = None
+        self._positions = {}  # reader -> index of the next chunk it reads
+
+    def start(self, query, params):
+        pinned = g.get('pinned_connection') if flask.has_app_context() else None
+        self._owns_connection = pinned is None
+        replica = choose_replica() if pinned is None else None
         try:
-            with get_db_connection() as conn:
-                cursor = conn.cursor(dictionary=True)
+            conn = checkout_connection(replica) if pinned is None else pinned
+            try:
+                # Tuples rather than dicts: readers each build their own
+                # dicts, which the row shaping code is free to modify
+                cursor = conn.cursor()
                 cursor.execute(query, params)
-                result = cursor.fetchall()
-                return result
+            except Exception as err:
+                if replica is not None and isinstance(err, mysql.connector.Error):
+                    replica_set.report_error(replica, err)
+                if self._owns_connection:
+                    conn.close()
+                raise
+        except Exception as err:
+            self._error = err
+            self._started.set()
+            raise
+        self._conn, self._cursor = conn, cursor
+        self.columns = cursor.column_names
+        self._started.set()
+
+    def wait_started(self):
+        self._started.wait()
+        if self.columns is None:
+            raise self._error
+
+    def join(self, reader):
+        """Add a reader, unless rows it would need are gone already."""
+        with self._lock:
+            if self._dropped or self._closed or self._error is not None:
+                return False
+            self._positions[reader] = 0
+            return True
+
+    def next_chunk(self, reader):
+        """The reader's next list of row tuples, or None after the last."""
+        with self._lock:
+            index = self._positions[reader]
+            if index == self._fetched and not self._exhausted:
+                if self._error is not None:
+                    raise self._error
+                try:
+                    rows = self._cursor.fetchmany(self.chunk_size)
+                except Exception as err:
+                    self._error = err
+                    raise
+                if rows:
+                    self._chunks[index] = rows
+                    self._fetched += 1
+                else:
+                    self._exhausted = True
+                    self._release()
+            rows = self._chunks.get(index)
+            if rows is None:
+                return None
+            self._positions[reader] = index + 1
+            lowest = min(self._positions.values())
+            while self._dropped < lowest:
+                self._chunks.pop(self._dropped, None)
+                self._dropped += 1
+            return rows
+
+    def leave(self, reader):
+        with self._lock:
+            self._positions.pop(reader, None)
+            if self._positions:
+                return
+            self._closed = True
+            self._release()
+        if self._flights is not None:
+            self._flights.discard(self._key, self)
+
+    def _release(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        cursor, self._cursor = self._cursor, None
+        try:
+            if not self._exhausted:
+                # Unread rows must be drained before the connection can be reused
+                conn.consume_results()
+            cursor.close()
         except mysql.connector.Error as err:
-            logger.error(f"Database error on attempt {attempt + 1}: {err}")
-            if attempt == max_retries - 1:
+            logger.error(f"Error closing streamed cursor: {err}")
+        finally:
+            if self._owns_connection:
+                conn.close()
+
+class StreamFlights:
+    """Streamed SELECTs in progress that an identical one may still join."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # (query, params) -> StreamFlight
+
+    def open(self, reader, query, params, chunk_size):
+        """Join a running flight of query, or start one."""
+        if not can_coalesce():
+            flight = StreamFlight(chunk_size)
+            flight.join(reader)
+            flight.start(query, params)
+            return flight
+        key = (query, params_key(params))
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None or not flight.join(reader)
+            if leader:
+                flight = self._flights[key] = StreamFlight(chunk_size, self, key)
+                flight.join(reader)
+        if not leader:
+            metrics.DB_COALESCED.labels('stream').inc()
+            try:
+                flight.wait_started()
+            except Exception as e:
+                flight.leave(reader)
+                if isinstance(e, SHED_ERRORS) and flask.has_request_context():
+                    g.shed_retry_after = e.retry_after
                 raise
-            time.sleep(retry_delay)
+            return flight
+        try:
+            flight.start(query, params)
+        except Exception:
+            self.discard(key, flight)
+            raise
+        return flight
+
+    def discard(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+stream_flights = StreamFlights()
 
-def execute_write_query(query, params=None):
-    max_retries = 3
-    retry_delay = 1  # second
+class StreamedSelect:
+    """Runs a SELECT and yields its rows in fetchmany-sized chunks instead of
+    materialising the whole result. Identical streamed SELECTs running at the
+    same time share one execution (see StreamFlight)."""
 
-    for attempt in range(max_retries):
+    def __init__(self, query, params=None, chunk_size=STREAM_CHUNK_SIZE):
+        self._flight = stream_flights.open(self, query, params, chunk_size)
+
+    def __iter__(self):
         try:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(query, params)
-                conn.commit()
-                return cursor.rowcount
-        except mysql.connector.Error as err:
-            logger.error(f"Database error on attempt {attempt + 1}: {err}")
-            if attempt == max_retries - 1:
-                raise
-            time.sleep(retry_delay)
+            columns = self._flight.columns
+            while True:
+                rows = self._flight.next_chunk(self)
+                if rows is None:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            self.close()
+
+    def close(self):
+        flight, self._flight = self._flight, None
+        if flight is not None:
+            flight.leave(self)
+
+# ============== TABLE VERSIONS ============
+# frostedfabrics.table_versions holds one counter per table (see
+# migrations/001_table_versions.sql). Write handlers bump the counters of the
+# tables they touch inside their own transaction, so every worker sees the
+# same versions and a GET can tell whether its data changed with one lookup.
+def bump_table_versions(cursor, tables):
+    if not tables:
+        return
+    # Cached responses are also checked against the versions, which covers
+    # entries stored before this transaction commits
+    response_cache.evict(tables)
+    cursor.executemany("""
+        INSERT INTO frostedfabrics.table_versions (table_name, version)
+        VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, [(table,) for table in sorted(set(tables))])
+
+def get_table_versions(tables):
+    rows = execute_select_query(
+        f"SELECT table_name, version FROM frostedfabrics.table_versions WHERE table_name IN ({', '.join(['%s'] * len(tables))})",
+        tuple(tables)
+    )
+    versions = {table: 0 for table in tables}
+    versions.update({row['table_name']: row['version'] for row in rows})
+    return versions
+
+# ============== CHANGE LOG ============
+# frostedfabrics.change_log (migrations/003_change_log.sql) records the key of
+# every row the write handlers insert, update or delete, for /api/changes. The
+# entries are written in the handler's own transaction, like the version
+# bumps, so they commit or roll back together with the change.
+TABLE_KEYS = {
+    'products': ('prod_id',),
+    'product_variations': ('var_id',),
+    'product_categories': ('pc_id',),
+    'material_categories': ('mc_id',),
+    'material_brands': ('brand_id',),
+    'material_measurements': ('meas_id',),
+    'materials': ('mat_id',),
+    'variation_materials': ('var_id', 'mat_id'),
+    'calendar_categories': ('cc_id',),
+    'calendar_events': ('event_id',),
+}
+
+def log_changes(cursor, table, op, keys):
+    """Append one entry per key, a tuple of the values of TABLE_KEYS[table]."""
+    if not keys:
+        return
+    columns = TABLE_KEYS[table]
+    cursor.executemany(
+        "INSERT INTO frostedfabrics.change_log (table_name, op, row_key) VALUES (%s, %s, %s)",
+        [(table, op, json.dumps(dict(zip(columns, key)))) for key in keys]
+    )
+    if (table in EVENT_TOPICS or table in SEARCH_TABLES) and flask.has_request_context():
+        # Published and indexed if the request succeeds (see apply_committed_changes)
+        pending = g.setdefault('pending_changes', {})
+        for key in keys:
+            row_key = (table, tuple(key))
+            pending.pop(row_key, None)
+            pending[row_key] = (op, dict(zip(columns, key)))
+
+def log_deletes(cursor, table, query, params):
+    """Log a delete for each row that query (a SELECT of the key columns of
+    `table`, matching what the caller is about to DELETE) returns. The rows
+    are locked so nothing can slip in between the SELECT and the DELETE."""
+    cursor.execute(query + " FOR UPDATE", params)
+    log_changes(cursor, table, 'delete', cursor.fetchall())
+
+@app.after_request
+def apply_committed_changes(response):
+    """Hand the rows a write changed to /api/events and the search index."""
+    pending = g.pop('pending_changes', None)
+    # Handlers roll back before answering with an error
+    if not pending or response.status_code >= 400:
+        return response
+    try:
+        changes = current_changes(pending)
+    except Exception as e:
+        logger.error(f"Could not read back the changed rows: {str(e)}")
+        return response
+    try:
+        publish_change_events(changes)
+    except Exception as e:
+        logger.error(f"Could not publish change events: {str(e)}")
+    try:
+        search_sync.apply(changes)
+    except Exception as e:
+        logger.error(f"Could not update the search index: {str(e)}")
+    return response
+
+# ============== DIMENSION CACHE ============
+# The brand/category/measurement tables are tiny and rarely change, so the list
+# endpoints resolve their display names from this in-process copy instead of
+# joining them on every request. Writes invalidate the local copy immediately;
+# the TTL bounds how long other gunicorn workers can serve stale names.
+DIMENSION_CACHE_TTL = float(os.getenv('DIMENSION_CACHE_TTL', '60'))  # seconds
+DIMENSION_CACHE_MISS_RELOAD_INTERVAL = 1  # second
+
+DIMENSION_TABLES = ('material_brands', 'material_categories', 'material_measurements', 'product_categories')
+
+class DimensionSnapshot:
+    def __init__(self, brands, categories, measurements, product_categories, versions):
+        self.brands = brands
+        self.categories = categories
+        self.measurements = measurements
+        self.product_categories = product_categories
+        self.versions = versions
+        self.loaded_at = time.monotonic()
+
+    def is_behind(self, versions):
+        return any(versions.get(table, version) != version for table, version in self.versions.items())
+
+    def material_labels(self, brand_id):
+        # Mirrors the old LEFT JOIN chain materials -> brands -> categories -> measurements
+        brand = self.brands.get(brand_id)
+        category = self.categories.get(brand['mc_id']) if brand else None
+        measurement = self.measurements.get(category['meas_id']) if category else None
+        return {
+            'brand_name': brand['brand_name'] if brand else None,
+            'mc_name': category['mc_name'] if category else None,
+            'meas_unit': measurement['meas_unit'] if measurement else None
+        }
+
+    def has_material_category(self, brand_id):
+        # Equivalent of the inner JOINs on material_brands and material_categories
+        brand = self.brands.get(brand_id)
+        return brand is not None and brand['mc_id'] in self.categories
+
+class DimensionCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def _load(self):
+        # Versions are read first so a write racing the load makes the snapshot
+        # look old rather than new
+        versions = get_table_versions(DIMENSION_TABLES)
+        brands = execute_select_query("SELECT brand_id, mc_id, brand_name FROM frostedfabrics.material_brands")
+        categories = execute_select_query("SELECT mc_id, meas_id, mc_name FROM frostedfabrics.material_categories")
+        measurements = execute_select_query("SELECT meas_id, meas_unit FROM frostedfabrics.material_measurements")
+        product_categories = execute_select_query("SELECT pc_id, pc_name FROM frostedfabrics.product_categories")
+        return DimensionSnapshot(
+            {row['brand_id']: row for row in brands},
+            {row['mc_id']: row for row in categories},
+            {row['meas_id']: row for row in measurements},
+            {row['pc_id']: row for row in product_categories},
+            versions
+        )
+
+    def get(self, brand_ids=(), pc_ids=(), versions=None):
+        """Return the current snapshot, reloading it when expired, when the
+        table versions read for this request are newer, or when it is missing
+        an id that another worker may have just created."""
+        request_versions = versions
+        if request_versions is None and flask.has_request_context():
+            request_versions = g.get('table_versions')
+        with self._lock:
+            snapshot = self._snapshot
+            now = time.monotonic()
+            if snapshot is not None and request_versions and snapshot.is_behind(request_versions):
+                snapshot = None
+            if snapshot is not None:
+                age = now - snapshot.loaded_at
+                missing = (any(b is not None and b not in snapshot.brands for b in brand_ids)
+                           or any(p is not None and p not in snapshot.product_categories for p in pc_ids))
+                if age < self.ttl and not (missing and age >= DIMENSION_CACHE_MISS_RELOAD_INTERVAL):
+                    return snapshot
+            self._snapshot = self._load()
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+dimension_cache = DimensionCache(DIMENSION_CACHE_TTL)
+
+def iter_material_labels(rows, dims, keep_brand_id=True):
+    """Attach brand_name/mc_name/meas_unit to material rows, dropping rows whose
+    brand or category no longer exists (as the old inner JOINs did)."""
+    for row in rows:
+        if not dims.has_material_category(row['brand_id']):
+            continue
+        row.update(dims.material_labels(row['brand_id']))
+        if not keep_brand_id:
+            del row['brand_id']
+        yield row
+
+def with_material_labels(rows, keep_brand_id=True):
+    dims = dimension_cache.get(brand_ids=[row['brand_id'] for row in rows])
+    return list(iter_material_labels(rows, dims, keep_brand_id))
+
+# ============== PAGINATION AND FILTER HELPERS ============
+# List endpoints return everything unless the client passes `limit` and/or
+# `after`. Pages are keyset based: `after` is the opaque cursor returned in the
+# X-Next-Cursor header of the previous page, so every page is an index range
+# scan no matter how deep the client has paged.
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+def get_page_args(cursor_length=1, args=None):
+    """Return (limit, after) for the current request (or the given query
+    args), or (None, None) when the client did not ask for a page."""
+    args = request.args if args is None else args
+    raw_limit = args.get('limit')
+    raw_after = args.get('after')
+    if raw_limit is None and raw_after is None:
+        return None, None
+    try:
+        limit = int(raw_limit) if raw_limit is not None else DEFAULT_PAGE_LIMIT
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    limit = min(max(limit, 1), MAX_PAGE_LIMIT)
+    after = decode_cursor(raw_after) if raw_after else None
+    if after is not None and len(after) != cursor_length:
+        raise ValueError("Invalid cursor")
+    return limit, after
+
+def get_id_list_arg(name, args=None):
+    """Read an id filter given as ?name=1,2,3 and/or ?name=1&name=2."""
+    args = request.args if args is None else args
+    ids = []
+    for raw in args.getlist(name):
+        for value in raw.split(','):
+            if value.strip():
+                try:
+                    ids.append(int(value))
+                except ValueError:
+                    raise ValueError(f"{name} must be a list of integers")
+    return ids
+
+def get_datetime_arg(name):
+    """Read an ISO 8601 date or datetime from the query string."""
+    raw = request.args.get(name)
+    if not raw:
+        return None
+    try:
+        return datetime.fromisoformat(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+
+def next_cursor(rows, limit, key):
+    # A full page means there may be more; the cursor is taken from the raw DB
+    # rows so that rows dropped while shaping the response don't end paging early.
+    if limit is None or len(rows) < limit:
+        return None
+    return encode_cursor(key(rows[-1]))
+
+def paged_response(results, cursor):
+    response = make_response(jsonify(results), 200)
+    if cursor:
+        response.headers['X-Next-Cursor'] = cursor
+    return response
+
+def where_clause(conditions):
+    return (" WHERE " + " AND ".join(conditions)) if conditions else ""
+
+def placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+# ============== STREAMING HELPERS ============
+# Large unfiltered lists are written out as they are read from the database.
+# The default is a JSON array (or object, for grouped results) sent in chunks;
+# clients can ask for NDJSON with ?format=ndjson or Accept: application/x-ndjson.
+def wants_ndjson():
+    return (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best == 'application/x-ndjson')
+
+def iter_groups(rows, key):
+    """Group consecutive rows sharing the same key (rows must be ordered by it)."""
+    current_key = None
+    group = []
+    for row in rows:
+        if group and row[key] != current_key:
+            yield current_key, group
+            group = []
+        current_key = row[key]
+        group.append(row)
+    if group:
+        yield current_key, group
+
+def iter_encoded_chunks(items, encode_batch, open_token, close_token, separator, batch_size=STREAM_CHUNK_SIZE):
+    """encode_batch(batch) returns the items of a batch encoded and joined
+    by separator."""
+    yield open_token
+    prefix = b''
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield prefix + encode_batch(batch)
+            prefix = separator
+            batch = []
+    if batch:
+        yield prefix + encode_batch(batch)
+    yield close_token
+
+def encode_array_items(batch):
+    # One encoder call per batch: the array's text without its brackets
+    return app.json.dumps_bytes(batch)[1:-1]
+
+def encode_ndjson_lines(batch):
+    return b''.join(app.json.dumps_bytes(item) + b'\n' for item in batch)
+
+def encode_object_members(batch):
+    # Members are kept in stream order, so they are encoded one by one
+    return b','.join(app.json.dumps_bytes(str(key)) + b':' + app.json.dumps_bytes(value) for key, value in batch)
+
+def stream_response(items, on_close, ndjson=False, as_object=False):
+    """Stream items as a JSON array, a JSON object of (key, value) pairs, or
+    NDJSON lines. on_close releases whatever is feeding the stream."""
+    if ndjson:
+        body = iter_encoded_chunks(items, encode_ndjson_lines, b'', b'', b'')
+        mimetype = 'application/x-ndjson'
+    elif as_object:
+        body = iter_encoded_chunks(items, encode_object_members, b'{', b'}', b',')
+        mimetype = 'application/json'
+    else:
+        body = iter_encoded_chunks(items, encode_array_items, b'[', b']', b',')
+        mimetype = 'application/json'
+    response = flask.Response(body, status=200, mimetype=mimetype)
+    response.call_on_close(on_close)
+    return response
+
+def iter_variations(rows, dims):
+    """Shape joined variation/material rows (ordered by var_id) into one dict
+    per variation with its materials nested."""
+    for var_id, group in iter_groups(rows, 'var_id'):
+        row = group[0]
+        variation = {
+            'var_id': var_id,
+            'prod_id': row['prod_id'],
+            'var_name': row['var_name'],
+            'var_inv': row['var_inv'],
+            'var_goal': row['var_goal'],
+            'img_id': row['img_id'],
+            'materials': []
+        }
+        for row in group:
+            if row['mat_id']:
+                material = {
+                    'mat_id': row['mat_id'],
+                    'mat_name': row['mat_name'],
+                    'mat_sku': row['mat_sku'],
+                    'mat_inv': row['mat_inv'],
+                    'mat_amount': row['mat_amount']
+                }
+                material.update(dims.material_labels(row['brand_id']))
+                variation['materials'].append(material)
+        yield variation
+
+# ============== RESPONSE CACHE ============
+# GET routes under conditional_get keep their encoded responses in memory,
+# keyed by path and sorted query parameters and tagged with the versions of
+# the tables they read (see responsecache.py). A hit skips the queries, row
+# shaping and serialization; writes evict the entries of the tables they
+# touch. RESPONSE_CACHE_DIR adds a directory of entries shared by all workers.
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))  # per worker; 0 turns the cache off
+RESPONSE_CACHE_DIR = os.getenv('RESPONSE_CACHE_DIR')
+RESPONSE_CACHE_SHARED_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_SHARED_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Response headers stored with a cached body
+CACHED_HEADERS = ('X-Next-Cursor',)
+
+response_cache = responsecache.ResponseCache(
+    RESPONSE_CACHE_MAX_BYTES,
+    shared=responsecache.SharedDirectory(RESPONSE_CACHE_DIR, RESPONSE_CACHE_SHARED_MAX_BYTES) if RESPONSE_CACHE_DIR and RESPONSE_CACHE_MAX_BYTES > 0 else None,
+)
+
+def cached_response(entry):
+    response = flask.Response(entry.body, status=200, content_type=entry.content_type)
+    for name, value in entry.headers:
+        response.headers[name] = value
+    # compress_response reuses the entry's compressed bodies
+    response.cache_entry = entry
+    return response
+
+def iter_teed(chunks, max_bytes, on_complete):
+    """Pass chunks through, then call on_complete with all of them joined,
+    unless they added up to more than max_bytes or the client went away."""
+    parts = []
+    size = 0
+    try:
+        for chunk in chunks:
+            if parts is not None:
+                data = chunk.encode() if isinstance(chunk, str) else chunk
+                size += len(data)
+                if size > max_bytes:
+                    parts = None
+                else:
+                    parts.append(data)
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    if parts is not None:
+        on_complete(b''.join(parts))
+
+def cache_response(key, versions, response):
+    """Store a 200 response built from versions. A streamed body is stored
+    once it has been sent in full."""
+    headers = [(name, response.headers[name]) for name in CACHED_HEADERS if name in response.headers]
+    def store(body):
+        entry = responsecache.Entry(body, response.content_type, headers, versions)
+        try:
+            response_cache.put(key, entry)
+        except Exception as e:
+            logger.error(f"Could not cache the response for {key}: {str(e)}")
+        return entry
+    if response.is_streamed:
+        response.response = iter_teed(response.response, response_cache.max_entry_bytes, store)
+    else:
+        response.cache_entry = store(response.get_data())
+
+# ============== CONDITIONAL GET ============
+def compute_etag(full_path, ndjson, versions):
+    fingerprint = json.dumps([full_path, ndjson, sorted(versions.items())])
+    return hashlib.sha1(fingerprint.encode()).hexdigest()
+
+def conditional_get(*tables):
+    """Give a GET route a strong ETag derived from the versions of the tables
+    it reads, and answer If-None-Match with 304 without running the view.
+    200 responses are served from the response cache while those versions
+    are current."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Write handlers that finish by returning a GET view skip this
+            if not tables or request.method != 'GET':
+                return view(*args, **kwargs)
+            try:
+                versions = get_table_versions(tables)
+            except mysql.connector.Error as err:
+                logger.error(f"Could not read table versions for {view.__name__}: {err}")
+                return view(*args, **kwargs)
+            g.table_versions = versions
+            etag = compute_etag(request.full_path, wants_ndjson(), versions)
+            # The client may hold the ETag of the compressed representation
+            encoding = compressor.negotiate(request.headers.get('Accept-Encoding'))
+            matched = [tag for tag in compression.etag_variants(etag, encoding) if request.if_none_match.contains(tag)]
+            if matched:
+                response = flask.Response(status=304)
+                etag = matched[0]
+            else:
+                key = responsecache.cache_key(request.path, request.args, wants_ndjson())
+                entry = response_cache.get(key, versions) if response_cache.enabled else None
+                if entry is not None:
+                    response = cached_response(entry)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if response_cache.enabled:
+                        cache_response(key, versions, response)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        wrapper.etag_tables = tables
+        return wrapper
+    return decorator
+
+# ============== COMPRESSION ============
+# JSON and text responses of at least COMPRESS_MIN_SIZE bytes are compressed
+# with gzip or deflate when the client accepts either (see compression.py).
+# Streamed lists are compressed as they are sent. Responses served from the
+# response cache reuse the compressed body stored with the cache entry.
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))  # zlib level 1-9; 0 turns compression off
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))  # bytes
+
+compressor = compression.Compressor(COMPRESS_LEVEL, COMPRESS_MIN_SIZE)
+
+@app.after_request
+def compress_response(response):
+    if not compressor.enabled or not compression.is_compressible(response.mimetype):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    encoding = compressor.negotiate(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compressor.iter_compressed(response.response, encoding)
+    else:
+        body = response.get_data()
+        if len(body) < compressor.min_size:
+            return response
+        entry = getattr(response, 'cache_entry', None)
+        with metrics.timed('serialization'):
+            if entry is not None:
+                body = response_cache.encoded(entry, encoding, compressor.compress)
+            else:
+                body = compressor.compress(body, encoding)
+        response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(compression.encoded_etag(etag, encoding), weak)
+    return response
+
+# ============== INVENTORY HELPERS ============
+def consume_variation_materials(conn, var_id, quantity):
+    """Deduct the materials needed to build `quantity` units of a variation,
+    inside the caller's transaction.
+
+    The caller must already hold the variation row's lock. Material rows are
+    then locked in mat_id order (variation_materials is read through its
+    (var_id, mat_id) key), so concurrent productions always acquire locks in
+    the same order and cannot deadlock each other. Stock is checked on the
+    locked rows and deducted with one UPDATE.
+
+    Returns (shortages, max_quantity, stock_levels). When shortages is
+    non-empty nothing was deducted and the caller must roll back; otherwise
+    stock_levels maps each deducted mat_id to its new (mat_inv, mat_alert)
+    for the low-stock index once the caller has committed."""
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT m.mat_id, m.mat_name, m.mat_inv, m.mat_alert, vm.mat_amount
+        FROM frostedfabrics.variation_materials vm
+        JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
+        WHERE vm.var_id = %s
+        ORDER BY vm.mat_id
+        FOR UPDATE OF m
+    """, (var_id,))
+    materials = cursor.fetchall()
+
+    shortages = []
+    max_quantity = None
+    for material in materials:
+        required = material['mat_amount'] * quantity
+        if material['mat_amount'] > 0:
+            buildable = max(material['mat_inv'], 0) // material['mat_amount']
+            max_quantity = buildable if max_quantity is None else min(max_quantity, buildable)
+        if material['mat_inv'] < required:
+            shortages.append({
+                "mat_id": material['mat_id'],
+                "mat_name": material['mat_name'],
+                "required": required,
+                "available": material['mat_inv']
+            })
+
+    stock_levels = {}
+    if materials and not shortages:
+        cursor.execute("""
+            UPDATE frostedfabrics.materials m
+            JOIN frostedfabrics.variation_materials vm ON vm.mat_id = m.mat_id
+            SET m.mat_inv = m.mat_inv - vm.mat_amount * %s
+            WHERE vm.var_id = %s
+        """, (quantity, var_id))
+        stock_levels = {
+            material['mat_id']: (material['mat_inv'] - material['mat_amount'] * quantity, material['mat_alert'])
+            for material in materials
+        }
+    return shortages, max_quantity, stock_levels
+
+def insufficient_inventory_response(shortages, max_quantity, **extra):
+    return make_response(jsonify({
+        "error": "Insufficient material inventory",
+        "material_id": shortages[0]['mat_id'],
+        "limiting_materials": shortages,
+        "max_quantity": max_quantity,
+        **extra
+    }), 400)
+
+# ============== LOW STOCK INDEX ============
+# The set of materials whose mat_inv is below mat_alert, kept in memory so
+# "what is low right now" costs O(low-stock items). Built at startup, updated
+# by the handlers that change mat_inv/mat_alert, and reconciled against the
+# database every LOW_STOCK_RECONCILE_INTERVAL seconds, which also picks up
+# changes made through other gunicorn workers.
+LOW_STOCK_RECONCILE_INTERVAL = float(os.getenv('LOW_STOCK_RECONCILE_INTERVAL', '60'))  # seconds
+
+def is_low_stock(mat_inv, mat_alert):
+    return mat_inv is not None and mat_alert is not None and mat_inv < mat_alert
+
+class LowStockIndex:
+    def __init__(self, reconcile_interval):
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._low = {}  # mat_id -> (mat_inv, mat_alert)
+        self._reconciled_at = None
+        self._reconciling = False
+
+    def rebuild(self):
+        started_at = time.monotonic()
+        rows = execute_select_query("""
+            SELECT mat_id, mat_inv, mat_alert
+            FROM frostedfabrics.materials
+            WHERE mat_inv < mat_alert
+        """)
+        with self._lock:
+            self._low = {row['mat_id']: (row['mat_inv'], row['mat_alert']) for row in rows}
+            self._reconciled_at = started_at
+
+    def _reconcile_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.error(f"Low stock reconciliation failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._reconciling = False
+
+    def start(self):
+        """Kick off the initial build (or a due reconciliation) without blocking."""
+        with self._lock:
+            due = (self._reconciled_at is None
+                   or time.monotonic() - self._reconciled_at >= self.reconcile_interval)
+            if not due or self._reconciling:
+                return
+            self._reconciling = True
+        threading.Thread(target=self._reconcile_in_background, name="low-stock-reconcile", daemon=True).start()
+
+    def apply(self, stock_levels):
+        """Record new (mat_inv, mat_alert) values for the given mat_ids."""
+        if not stock_levels:
+            return
+        with self._lock:
+            for mat_id, (mat_inv, mat_alert) in stock_levels.items():
+                if is_low_stock(mat_inv, mat_alert):
+                    self._low[mat_id] = (mat_inv, mat_alert)
+                else:
+                    self._low.pop(mat_id, None)
+
+    def refresh(self, mat_ids):
+        """Re-read specific materials after a write that may have changed them."""
+        if not mat_ids:
+            return
+        rows = execute_select_query(
+            f"SELECT mat_id, mat_inv, mat_alert FROM frostedfabrics.materials WHERE mat_id IN ({placeholders(mat_ids)})",
+            tuple(mat_ids)
+        )
+        found = {row['mat_id']: (row['mat_inv'], row['mat_alert']) for row in rows}
+        self.apply(found)
+        self.discard([mat_id for mat_id in mat_ids if mat_id not in found])
+
+    def discard(self, mat_ids):
+        with self._lock:
+            for mat_id in mat_ids:
+                self._low.pop(mat_id, None)
+
+    def invalidate(self):
+        """Force a full reconciliation, e.g. after a cascading delete."""
+        with self._lock:
+            self._reconciled_at = None
+        self.start()
+
+    def snapshot(self):
+        self.start()
+        with self._lock:
+            return dict(self._low), self._reconciled_at is not None
+
+low_stock_index = LowStockIndex(LOW_STOCK_RECONCILE_INTERVAL)
 
 # Enable CORS for all routes
 @app.after_request
@@ -79,6 +1181,55 @@ def add_cors_headers(response):
     response.headers.add("Access-Control-Allow-Origin", "*")
     response.headers.add("Access-Control-Allow-Headers", "*")
     response.headers.add("Access-Control-Allow-Methods", "*")
+    response.headers.add("Access-Control-Expose-Headers", "X-Next-Cursor, ETag, X-Request-ID")
+    return response
+
+# ============== REQUEST IDS ============
+# Every log record carries the id of the request that wrote it. Callers can
+# pass their own X-Request-ID to correlate logs across services.
+@app.before_request
+def assign_request_id():
+    if g.get('request_id') is None:
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+@app.after_request
+def add_request_id_header(response):
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
+# ============== METRICS ============
+@app.before_request
+def start_request_metrics():
+    # Batch sub-requests are counted as part of the /api/batch request
+    if not g.get('pinned_connection'):
+        metrics.start_request()
+        request.environ['metrics.timed'] = True
+
+@app.after_request
+def finish_request_metrics(response):
+    if request.environ.pop('metrics.timed', False):
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        # Recorded when the body has been sent so streamed rows are included
+        response.call_on_close(functools.partial(metrics.finish_request, route, request.method, response.status_code))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metricsGet():
+    body, content_type = metrics.render()
+    return make_response(body, 200, {'Content-Type': content_type})
+
+# ============== LOAD SHEDDING ============
+# Registered after the metrics hook so /metrics records the 503, not the 500
+@app.errorhandler(pool.PoolExhausted)
+@app.errorhandler(resilience.CircuitOpen)
+def handle_shed_error(e):
+    return overloaded_response(e.retry_after)
+
+@app.after_request
+def shed_overloaded_response(response):
+    retry_after = g.pop('shed_retry_after', None)
+    if response.status_code == 500 and retry_after is not None:
+        return overloaded_response(retry_after)
     return response
 
 # ============== EXAMPLE METHODS ============
@@ -87,42 +1238,77 @@ def test():
     return make_response(jsonify("SUCCESS"), 200)
 
 # ============== PRODUCTS METHODS ============
+def products_query(resourceid, args):
+    """Return (query, params, limit) for productsGet. Shared with the async
+    entry point in asgi_app.py."""
+    limit = None
+    if resourceid is not None:
+        query = """
+            SELECT p.*
+            FROM frostedfabrics.products p
+            WHERE p.prod_id = %s
+        """
+        params = (resourceid,)
+    else:
+        category = unquote(args.get('category', ''))
+        pc_ids = get_id_list_arg('pc_id', args)
+        limit, after = get_page_args(args=args)
+        conditions = []
+        params = []
+        if category:
+            conditions.append("p.pc_id IN (SELECT pc_id FROM frostedfabrics.product_categories WHERE pc_name = %s)")
+            params.append(category)
+        if pc_ids:
+            conditions.append(f"p.pc_id IN ({placeholders(pc_ids)})")
+            params.extend(pc_ids)
+        if after:
+            conditions.append("p.prod_id > %s")
+            params.append(after[0])
+        query = """
+            SELECT p.*
+            FROM frostedfabrics.products p
+        """ + where_clause(conditions) + " ORDER BY p.prod_id"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        params = tuple(params) or None
+    return query, params, limit
+
+def with_product_category_names(rows, dims):
+    """Resolve pc_name from the dimension cache (inner join semantics)."""
+    query_results = []
+    for row in rows:
+        product_category = dims.product_categories.get(row['pc_id'])
+        if product_category is None:
+            continue
+        row['pc_name'] = product_category['pc_name']
+        query_results.append(row)
+    return query_results
+
 @app.route('/api/products', methods=['GET'])
 @app.route('/api/products/<int:resourceid>', methods=['GET'])
+@conditional_get('products', 'product_categories')
 def productsGet(resourceid=None):
     try:
-        if resourceid is not None:
-            query = """
-                SELECT p.*, pc.pc_name
-                FROM frostedfabrics.products p
-                JOIN frostedfabrics.product_categories pc ON p.pc_id = pc.pc_id
-                WHERE p.prod_id = %s
-            """
-            params = (resourceid,)
-        else:
-            category = unquote(request.args.get('category', ''))
-            query = """
-                SELECT p.*, pc.pc_name
-                FROM frostedfabrics.products p
-                JOIN frostedfabrics.product_categories pc ON p.pc_id = pc.pc_id
-            """
-            params = None
-            if category:
-                query += " WHERE pc.pc_name = %s"
-                params = (category,)
+        query, params, limit = products_query(resourceid, request.args)
 
-        logger.info(f"Executing query: {query} with params: {params}")
-        query_results = execute_select_query(query, params)
+        query_logger.debug("Executing query: %s with params: %s", query, params)
+        rows = execute_select_query(query, params)
+        cursor = next_cursor(rows, limit, lambda row: [row['prod_id']]) if resourceid is None else None
+
+        dims = dimension_cache.get(pc_ids=[row['pc_id'] for row in rows])
+        query_results = with_product_category_names(rows, dims)
         
-        logger.info(f"Query results count: {len(query_results)}")
+        query_logger.debug("Query results count: %d", len(query_results))
         
         if resourceid is not None:
             return make_response(jsonify(query_results[0] if query_results else {"error": "Resource not found"}), 200 if query_results else 404)
         else:
-            return make_response(jsonify(query_results), 200)
+            return paged_response(query_results, cursor)
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
     except Exception as e:
-        logger.error(f"Error in productsGet: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.error(f"Error in productsGet: {str(e)}", exc_info=True)
         return make_response(jsonify({"error": "Internal server error", "details": str(e)}), 500)
 
 @app.route('/api/products', methods=['POST'])
@@ -141,7 +1327,7 @@ def productsPost():
             request_data['prod_time'],
             request_data['img_id']
         )
-        execute_write_query(query, params)
+        execute_insert_query(query, params, touches=('products',), table='products')
         return make_response("", 201)
     except Exception as e:
         logger.error(f"Error in productsPost: {str(e)}")
@@ -158,7 +1344,7 @@ def productsEdit(resourceid=None):
         params = [request_data[field] for field in update_fields if field in request_data]
         query += " WHERE prod_id = %s"
         params.append(resourceid)
-        execute_write_query(query, tuple(params))
+        execute_write_query(query, tuple(params), touches=('products',), changes=[('products', 'update', [(resourceid,)])])
         return make_response("", 200)
     except Exception as e:
         logger.error(f"Error in productsEdit: {str(e)}")
@@ -167,107 +1353,109 @@ def productsEdit(resourceid=None):
 @app.route('/api/products/<int:resourceid>', methods=['DELETE'])
 def productsDelete(resourceid=None):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
+        def delete():
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
             
-            # Start a transaction
-            cursor.execute("START TRANSACTION")
+                # Start a transaction
+                cursor.execute("START TRANSACTION")
             
-            try:
-                # First, delete associated variation materials
-                cursor.execute("DELETE vm FROM frostedfabrics.variation_materials vm INNER JOIN frostedfabrics.product_variations pv ON vm.var_id = pv.var_id WHERE pv.prod_id = %s", (resourceid,))
+                try:
+                    log_deletes(cursor, 'variation_materials', "SELECT vm.var_id, vm.mat_id FROM frostedfabrics.variation_materials vm INNER JOIN frostedfabrics.product_variations pv ON vm.var_id = pv.var_id WHERE pv.prod_id = %s", (resourceid,))
+                    log_deletes(cursor, 'product_variations', "SELECT var_id FROM frostedfabrics.product_variations WHERE prod_id = %s", (resourceid,))
+                    log_changes(cursor, 'products', 'delete', [(resourceid,)])
+
+                    # First, delete associated variation materials
+                    cursor.execute("DELETE vm FROM frostedfabrics.variation_materials vm INNER JOIN frostedfabrics.product_variations pv ON vm.var_id = pv.var_id WHERE pv.prod_id = %s", (resourceid,))
                 
-                # Then, delete associated variations
-                cursor.execute("DELETE FROM frostedfabrics.product_variations WHERE prod_id = %s", (resourceid,))
+                    # Then, delete associated variations
+                    cursor.execute("DELETE FROM frostedfabrics.product_variations WHERE prod_id = %s", (resourceid,))
                 
-                # Finally, delete the product
-                cursor.execute("DELETE FROM frostedfabrics.products WHERE prod_id = %s", (resourceid,))
+                    # Finally, delete the product
+                    cursor.execute("DELETE FROM frostedfabrics.products WHERE prod_id = %s", (resourceid,))
                 
-                # Commit the transaction
-                conn.commit()
+                    # Commit the transaction
+                    bump_table_versions(cursor, ['variation_materials', 'product_variations', 'products'])
+                    conn.commit()
                 
-                return make_response(jsonify({"message": "Product, variations, and materials deleted successfully"}), 200)
-            except Exception as e:
-                # Rollback in case of error
-                conn.rollback()
-                raise e
+                    return make_response(jsonify({"message": "Product, variations, and materials deleted successfully"}), 200)
+                except Exception as e:
+                    # Rollback in case of error
+                    conn.rollback()
+                    raise e
+        return db_policy.run(delete, idempotent=False, log=logger.error)
     except Exception as e:
         logger.error(f"Error in productsDelete: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
 
 # ============== PRODUCT VARIATIONS METHODS ============
+def productvariations_query(resourceid, args):
+    """Return (query, params, limit) for productvariationsGet. Shared with
+    the async entry point in asgi_app.py."""
+    base_query = """
+        SELECT 
+            pv.*,
+            m.mat_id,
+            m.mat_name,
+            m.mat_sku,
+            m.mat_inv,
+            m.brand_id,
+            vm.mat_amount
+        FROM {variations} pv
+        LEFT JOIN frostedfabrics.variation_materials vm ON pv.var_id = vm.var_id
+        LEFT JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
+    """
+    limit = None
+
+    if resourceid is not None:
+        query = base_query.format(variations="frostedfabrics.product_variations") + " WHERE pv.var_id = %s"
+        params = (resourceid,)
+    else:
+        prod_ids = get_id_list_arg('prod_id', args) + get_id_list_arg('product', args)
+        limit, after = get_page_args(args=args)
+        conditions = []
+        params = []
+        if prod_ids:
+            conditions.append(f"prod_id IN ({placeholders(prod_ids)})")
+            params.extend(prod_ids)
+        if after:
+            conditions.append("var_id > %s")
+            params.append(after[0])
+        # Filter and page the variations first, then attach their materials
+        variations_source = "(SELECT * FROM frostedfabrics.product_variations" + where_clause(conditions)
+        if limit is not None:
+            variations_source += " ORDER BY var_id LIMIT %s"
+            params.append(limit)
+        variations_source += ")"
+        query = base_query.format(variations=variations_source) + " ORDER BY pv.var_id"
+        params = tuple(params) or None
+    return query, params, limit
+
 @app.route('/api/productvariations', methods=['GET'])
 @app.route('/api/productvariations/<int:resourceid>', methods=['GET'])
+@conditional_get('product_variations', 'variation_materials', 'materials', 'material_brands', 'material_categories', 'material_measurements')
 def productvariationsGet(resourceid=None):
     try:
-        base_query = """
-            SELECT 
-                pv.*,
-                m.mat_id,
-                m.mat_name,
-                m.mat_sku,
-                m.mat_inv,
-                vm.mat_amount,
-                mb.brand_name,
-                mc.mc_name,
-                mm.meas_unit
-            FROM frostedfabrics.product_variations pv
-            LEFT JOIN frostedfabrics.variation_materials vm ON pv.var_id = vm.var_id
-            LEFT JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
-            LEFT JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
-            LEFT JOIN frostedfabrics.material_categories mc ON mb.mc_id = mc.mc_id
-            LEFT JOIN frostedfabrics.material_measurements mm ON mc.meas_id = mm.meas_id
-        """
-        
-        if resourceid is not None:
-            query = base_query + " WHERE pv.var_id = %s"
-            params = (resourceid,)
-        else:
-            product = request.args.get('product')
-            if product:
-                query = base_query + " WHERE pv.prod_id = %s"
-                params = (product,)
-            else:
-                query = base_query
-                params = None
+        query, params, limit = productvariations_query(resourceid, request.args)
 
-        query_results = execute_select_query(query, params)
+        if resourceid is None and params is None:
+            # Unfiltered: stream variations out as they are read
+            dims = dimension_cache.get()
+            rows = StreamedSelect(query)
+            return stream_response(iter_variations(rows, dims), rows.close, ndjson=wants_ndjson())
 
-        variations = {}
-        for row in query_results:
-            var_id = row['var_id']
-            if var_id not in variations:
-                variation = {
-                    'var_id': var_id,
-                    'prod_id': row['prod_id'],
-                    'var_name': row['var_name'],
-                    'var_inv': row['var_inv'],
-                    'var_goal': row['var_goal'],
-                    'img_id': row['img_id'],
-                    'materials': []
-                }
-                variations[var_id] = variation
-            if row['mat_id']:
-                material = {
-                    'mat_id': row['mat_id'],
-                    'mat_name': row['mat_name'],
-                    'mat_sku': row['mat_sku'],
-                    'mat_inv': row['mat_inv'],
-                    'mat_amount': row['mat_amount'],
-                    'brand_name': row['brand_name'],
-                    'mc_name': row['mc_name'],
-                    'meas_unit': row['meas_unit']
-                }
-                variations[var_id]['materials'].append(material)
-        
-        variation_list = list(variations.values())
+        query_results = execute_select_query(query, params)
+        dims = dimension_cache.get(brand_ids=[row['brand_id'] for row in query_results])
+        variation_list = list(iter_variations(query_results, dims))
         if resourceid is not None:
             if not variation_list:
                 return make_response(jsonify({"error": "Resource not found"}), 404)
             return make_response(jsonify(variation_list[0]), 200)
         else:
-            return make_response(jsonify(variation_list), 200)
+            return paged_response(variation_list, next_cursor(variation_list, limit, lambda row: [row['var_id']]))
         
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
     except Exception as e:
         logger.error(f"Error in productvariationsGet: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
@@ -287,7 +1475,7 @@ def productvariationsPost():
             request_data['var_goal'],
             request_data['img_id']
         )
-        execute_write_query(query, params)
+        execute_insert_query(query, params, touches=('product_variations',), table='product_variations')
         return make_response("", 201)
     except Exception as e:
         logger.error(f"Error in productvariationsPost: {str(e)}")
@@ -298,55 +1486,49 @@ def productvariationsPost():
 def productvariationsEdit(resourceid=None):
     request_data = request.get_json()
     try:
-        # Perform database operations
-        with get_db_connection() as conn:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT var_inv FROM frostedfabrics.product_variations WHERE var_id = %s", (resourceid,))
-            current_variation = cursor.fetchone()
-            if not current_variation:
-                return make_response(jsonify({"error": "Variation not found"}), 404)
-
-            current_inv = current_variation['var_inv']
-            new_inv = request_data.get('var_inv', current_inv)
-            inv_difference = new_inv - current_inv
-
-            # Update the variation
-            update_fields = ['var_name', 'var_inv', 'var_goal', 'img_id']
-            update_data = {k: request_data.get(k) for k in update_fields if k in request_data}
-            if update_data:
-                update_query = "UPDATE frostedfabrics.product_variations SET "
-                update_query += ", ".join(f"{k} = %s" for k in update_data.keys())
-                update_query += " WHERE var_id = %s"
-                cursor.execute(update_query, list(update_data.values()) + [resourceid])
-
-            # Handle material inventory updates if inventory is increased
-            if inv_difference > 0:
-                material_query = """
-                    SELECT vm.mat_id, vm.mat_amount, m.mat_inv
-                    FROM frostedfabrics.variation_materials vm
-                    JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
-                    WHERE vm.var_id = %s
-                """
-                cursor.execute(material_query, (resourceid,))
-                materials = cursor.fetchall()
-
-                material_updates = []
-                for material in materials:
-                    new_mat_inv = material['mat_inv'] - (material['mat_amount'] * inv_difference)
-                    if new_mat_inv < 0:
-                        return make_response(jsonify({
-                            "error": "Insufficient material inventory",
-                            "material_id": material['mat_id']
-                        }), 400)
-                    material_updates.append((new_mat_inv, material['mat_id']))
-
-                if material_updates:
-                    cursor.executemany(
-                        "UPDATE frostedfabrics.materials SET mat_inv = %s WHERE mat_id = %s",
-                        material_updates
-                    )
+        def edit():
+            with get_db_connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                # Lock the variation first, then its materials (see consume_variation_materials)
+                cursor.execute("SELECT var_inv FROM frostedfabrics.product_variations WHERE var_id = %s FOR UPDATE", (resourceid,))
+                current_variation = cursor.fetchone()
+                if not current_variation:
+                    conn.rollback()
+                    return make_response(jsonify({"error": "Variation not found"}), 404)
+
+                current_inv = current_variation['var_inv']
+                new_inv = request_data.get('var_inv', current_inv)
+                inv_difference = new_inv - current_inv
+
+                # Update the variation
+                update_fields = ['var_name', 'var_inv', 'var_goal', 'img_id']
+                update_data = {k: request_data.get(k) for k in update_fields if k in request_data}
+                touched = []
+                if update_data:
+                    update_query = "UPDATE frostedfabrics.product_variations SET "
+                    update_query += ", ".join(f"{k} = %s" for k in update_data.keys())
+                    update_query += " WHERE var_id = %s"
+                    cursor.execute(update_query, list(update_data.values()) + [resourceid])
+                    log_changes(cursor, 'product_variations', 'update', [(resourceid,)])
+                    touched.append('product_variations')
+
+                # Handle material inventory updates if inventory is increased
+                stock_levels = {}
+                if inv_difference > 0:
+                    shortages, max_quantity, stock_levels = consume_variation_materials(conn, resourceid, inv_difference)
+                    if shortages:
+                        conn.rollback()
+                        return insufficient_inventory_response(shortages, max_quantity)
+                    log_changes(cursor, 'materials', 'update', [(mat_id,) for mat_id in stock_levels])
+                    touched.append('materials')
+
+                bump_table_versions(cursor, touched)
+                conn.commit()
+                low_stock_index.apply(stock_levels)
 
-            conn.commit()
+        error = db_policy.run(edit, idempotent=False, log=logger.error)
+        if error is not None:
+            return error
         # Connection is now closed; safe to call productvariationsGet
         return productvariationsGet(resourceid=resourceid)
 
@@ -355,38 +1537,181 @@ def productvariationsEdit(resourceid=None):
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
 
 
+@app.route('/api/productvariations/<int:resourceid>/produce', methods=['POST'])
+def productvariationsProduce(resourceid=None):
+    request_data = request.get_json()
+    try:
+        quantity = request_data.get('quantity')
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            return make_response(jsonify({"error": "quantity must be a positive integer"}), 400)
+
+        # MySQL rolls back the whole transaction on a deadlock or lock wait
+        # timeout, so db_policy retries it from the start
+        def produce():
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    # Updating the variation first locks it, so productions of the
+                    # same variation queue up here instead of racing on materials
+                    cursor.execute(
+                        "UPDATE frostedfabrics.product_variations SET var_inv = var_inv + %s WHERE var_id = %s",
+                        (quantity, resourceid)
+                    )
+                    if cursor.rowcount == 0:
+                        conn.rollback()
+                        return make_response(jsonify({"error": "Variation not found"}), 404)
+
+                    shortages, max_quantity, stock_levels = consume_variation_materials(conn, resourceid, quantity)
+                    if shortages:
+                        conn.rollback()
+                        return insufficient_inventory_response(shortages, max_quantity)
+
+                    log_changes(cursor, 'product_variations', 'update', [(resourceid,)])
+                    log_changes(cursor, 'materials', 'update', [(mat_id,) for mat_id in stock_levels])
+                    bump_table_versions(cursor, ['product_variations', 'materials'])
+                    conn.commit()
+                    low_stock_index.apply(stock_levels)
+                except Exception as e:
+                    conn.rollback()
+                    raise e
+
+        error = db_policy.run(produce, idempotent=False, log=logger.error)
+        if error is not None:
+            return error
+        return productvariationsGet(resourceid=resourceid)
+
+    except Exception as e:
+        logger.error(f"Error in productvariationsProduce: {str(e)}")
+        return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
+
 @app.route('/api/productvariations/<int:resourceid>', methods=['DELETE'])
 def productvariationsDelete(resourceid=None):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
+        def delete():
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
             
-            # Start a transaction
-            cursor.execute("START TRANSACTION")
+                # Start a transaction
+                cursor.execute("START TRANSACTION")
             
-            try:
-                # First, delete associated variation materials
-                cursor.execute("DELETE FROM frostedfabrics.variation_materials WHERE var_id = %s", (resourceid,))
+                try:
+                    log_deletes(cursor, 'variation_materials', "SELECT var_id, mat_id FROM frostedfabrics.variation_materials WHERE var_id = %s", (resourceid,))
+                    log_changes(cursor, 'product_variations', 'delete', [(resourceid,)])
+
+                    # First, delete associated variation materials
+                    cursor.execute("DELETE FROM frostedfabrics.variation_materials WHERE var_id = %s", (resourceid,))
                 
-                # Then, delete the variation
-                cursor.execute("DELETE FROM frostedfabrics.product_variations WHERE var_id = %s", (resourceid,))
+                    # Then, delete the variation
+                    cursor.execute("DELETE FROM frostedfabrics.product_variations WHERE var_id = %s", (resourceid,))
                 
-                # Commit the transaction
-                conn.commit()
+                    # Commit the transaction
+                    bump_table_versions(cursor, ['variation_materials', 'product_variations'])
+                    conn.commit()
                 
-                return make_response(jsonify({"message": "Variation and associated materials deleted successfully"}), 200)
-            except Exception as e:
-                # Rollback in case of error
-                conn.rollback()
-                raise e
+                    return make_response(jsonify({"message": "Variation and associated materials deleted successfully"}), 200)
+                except Exception as e:
+                    # Rollback in case of error
+                    conn.rollback()
+                    raise e
+        return db_policy.run(delete, idempotent=False, log=logger.error)
     except Exception as e:
         logger.error(f"Error in productvariationsDelete: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
     
 
+# ============== PRODUCTION CAPACITY METHODS ============
+@app.route('/api/capacity', methods=['GET'])
+@conditional_get('products', 'product_variations', 'variation_materials', 'materials')
+def capacityGet():
+    """For every variation: how many units the current material stock can
+    build, which material runs out first, and how far it is from var_goal.
+    Computed in one aggregate query over the bill of materials."""
+    try:
+        prod_ids = get_id_list_arg('prod_id')
+        pc_ids = get_id_list_arg('pc_id')
+        conditions = []
+        params = []
+        if prod_ids:
+            conditions.append(f"pv.prod_id IN ({placeholders(prod_ids)})")
+            params.extend(prod_ids)
+        if pc_ids:
+            conditions.append(f"pv.prod_id IN (SELECT prod_id FROM frostedfabrics.products WHERE pc_id IN ({placeholders(pc_ids)}))")
+            params.extend(pc_ids)
+
+        # Rank each variation's materials by how many units they allow; rank 1
+        # is the bottleneck and its count is the variation's capacity
+        query = """
+            SELECT
+                pv.var_id,
+                pv.prod_id,
+                pv.var_name,
+                pv.var_inv,
+                pv.var_goal,
+                bom.buildable AS max_buildable,
+                bom.mat_id AS bottleneck_mat_id,
+                bom.mat_name AS bottleneck_mat_name,
+                bom.mat_inv AS bottleneck_mat_inv,
+                bom.mat_amount AS bottleneck_mat_amount
+            FROM frostedfabrics.product_variations pv
+            LEFT JOIN (
+                SELECT
+                    vm.var_id,
+                    m.mat_id,
+                    m.mat_name,
+                    m.mat_inv,
+                    vm.mat_amount,
+                    GREATEST(m.mat_inv, 0) DIV vm.mat_amount AS buildable,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY vm.var_id
+                        ORDER BY GREATEST(m.mat_inv, 0) DIV vm.mat_amount, m.mat_id
+                    ) AS bottleneck_rank
+                FROM frostedfabrics.variation_materials vm
+                JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
+                WHERE vm.mat_amount > 0 {bom_filter}
+            ) bom ON bom.var_id = pv.var_id AND bom.bottleneck_rank = 1
+        """.format(bom_filter=(
+            "AND vm.var_id IN (SELECT pv.var_id FROM frostedfabrics.product_variations pv" + where_clause(conditions) + ")"
+            if conditions else ""
+        ))
+        query += where_clause(conditions) + " ORDER BY pv.var_id"
+        params = tuple(params * 2) or None
+
+        capacity = []
+        for row in execute_select_query(query, params):
+            shortfall = max(row['var_goal'] - row['var_inv'], 0)
+            max_buildable = row['max_buildable']
+            # A variation without materials is not limited by stock
+            buildable_toward_goal = shortfall if max_buildable is None else min(shortfall, max_buildable)
+            capacity.append({
+                'var_id': row['var_id'],
+                'prod_id': row['prod_id'],
+                'var_name': row['var_name'],
+                'var_inv': row['var_inv'],
+                'var_goal': row['var_goal'],
+                'max_buildable': max_buildable,
+                'bottleneck': None if row['bottleneck_mat_id'] is None else {
+                    'mat_id': row['bottleneck_mat_id'],
+                    'mat_name': row['bottleneck_mat_name'],
+                    'mat_inv': row['bottleneck_mat_inv'],
+                    'mat_amount': row['bottleneck_mat_amount']
+                },
+                'shortfall': shortfall,
+                'buildable_toward_goal': buildable_toward_goal,
+                'unmet_after_build': shortfall - buildable_toward_goal
+            })
+
+        return make_response(jsonify(capacity), 200)
+
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
+    except Exception as e:
+        logger.error(f"Error in capacityGet: {str(e)}")
+        return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
+
 # ============== PRODUCT CATEGORIES METHODS ============
 @app.route('/api/productcategories', methods=['GET'])
 @app.route('/api/productcategories/<int:resourceid>', methods=['GET'])
+@conditional_get('product_categories')
 def productcategoriesGet(resourceid=None):
     try:
         if resourceid is not None:
@@ -418,7 +1743,8 @@ def productcategoriesPost():
         VALUES (%s, %s)
         """
         params = (request_data['pc_name'], request_data['img_id'])
-        execute_write_query(query, params)
+        execute_insert_query(query, params, touches=('product_categories',), table='product_categories')
+        dimension_cache.invalidate()
         return make_response("", 201)
     except Exception as e:
         logger.error(f"Error in productcategoriesPost: {str(e)}")
@@ -435,7 +1761,8 @@ def productcategoriesEdit(resourceid=None):
         params = [request_data[field] for field in update_fields if field in request_data]
         query += " WHERE pc_id = %s"
         params.append(resourceid)
-        execute_write_query(query, tuple(params))
+        execute_write_query(query, tuple(params), touches=('product_categories',), changes=[('product_categories', 'update', [(resourceid,)])])
+        dimension_cache.invalidate()
         return make_response("", 200)
     except Exception as e:
         logger.error(f"Error in productcategoriesEdit: {str(e)}")
@@ -444,42 +1771,60 @@ def productcategoriesEdit(resourceid=None):
 @app.route('/api/productcategories/<int:resourceid>', methods=['DELETE'])
 def productcategoriesDelete(resourceid=None):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
+        def delete():
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
             
-            # Start a transaction
-            cursor.execute("START TRANSACTION")
+                # Start a transaction
+                cursor.execute("START TRANSACTION")
             
-            try:
-                # First, delete associated variation materials
-                cursor.execute("""
-                    DELETE vm FROM frostedfabrics.variation_materials vm
-                    INNER JOIN frostedfabrics.product_variations pv ON vm.var_id = pv.var_id
-                    INNER JOIN frostedfabrics.products p ON pv.prod_id = p.prod_id
-                    WHERE p.pc_id = %s
-                """, (resourceid,))
+                try:
+                    log_deletes(cursor, 'variation_materials', """
+                        SELECT vm.var_id, vm.mat_id FROM frostedfabrics.variation_materials vm
+                        INNER JOIN frostedfabrics.product_variations pv ON vm.var_id = pv.var_id
+                        INNER JOIN frostedfabrics.products p ON pv.prod_id = p.prod_id
+                        WHERE p.pc_id = %s
+                    """, (resourceid,))
+                    log_deletes(cursor, 'product_variations', """
+                        SELECT pv.var_id FROM frostedfabrics.product_variations pv
+                        INNER JOIN frostedfabrics.products p ON pv.prod_id = p.prod_id
+                        WHERE p.pc_id = %s
+                    """, (resourceid,))
+                    log_deletes(cursor, 'products', "SELECT prod_id FROM frostedfabrics.products WHERE pc_id = %s", (resourceid,))
+                    log_changes(cursor, 'product_categories', 'delete', [(resourceid,)])
+
+                    # First, delete associated variation materials
+                    cursor.execute("""
+                        DELETE vm FROM frostedfabrics.variation_materials vm
+                        INNER JOIN frostedfabrics.product_variations pv ON vm.var_id = pv.var_id
+                        INNER JOIN frostedfabrics.products p ON pv.prod_id = p.prod_id
+                        WHERE p.pc_id = %s
+                    """, (resourceid,))
                 
-                # Then, delete associated product variations
-                cursor.execute("""
-                    DELETE pv FROM frostedfabrics.product_variations pv
-                    INNER JOIN frostedfabrics.products p ON pv.prod_id = p.prod_id
-                    WHERE p.pc_id = %s
-                """, (resourceid,))
+                    # Then, delete associated product variations
+                    cursor.execute("""
+                        DELETE pv FROM frostedfabrics.product_variations pv
+                        INNER JOIN frostedfabrics.products p ON pv.prod_id = p.prod_id
+                        WHERE p.pc_id = %s
+                    """, (resourceid,))
                 
-                # Delete products in the category
-                cursor.execute("DELETE FROM frostedfabrics.products WHERE pc_id = %s", (resourceid,))
+                    # Delete products in the category
+                    cursor.execute("DELETE FROM frostedfabrics.products WHERE pc_id = %s", (resourceid,))
                 
-                # Finally, delete the product category
-                cursor.execute("DELETE FROM frostedfabrics.product_categories WHERE pc_id = %s", (resourceid,))
+                    # Finally, delete the product category
+                    cursor.execute("DELETE FROM frostedfabrics.product_categories WHERE pc_id = %s", (resourceid,))
                 
-                # Commit the transaction
-                conn.commit()
+                    # Commit the transaction
+                    bump_table_versions(cursor, ['variation_materials', 'product_variations', 'products', 'product_categories'])
+                    conn.commit()
+                    dimension_cache.invalidate()
                 
-                return make_response(jsonify({"message": "Product category and all associated records deleted successfully"}), 200)
-            except Exception as e:
-                # Rollback in case of error
-                conn.rollback()
-                raise e
+                    return make_response(jsonify({"message": "Product category and all associated records deleted successfully"}), 200)
+                except Exception as e:
+                    # Rollback in case of error
+                    conn.rollback()
+                    raise e
+        return db_policy.run(delete, idempotent=False, log=logger.error)
     except Exception as e:
         logger.error(f"Error in productcategoriesDelete: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
@@ -489,6 +1834,7 @@ def productcategoriesDelete(resourceid=None):
 # ============== MATERIAL CATEGORIES METHODS ============
 @app.route('/api/materialcategories', methods=['GET'])
 @app.route('/api/materialcategories/<int:resourceid>', methods=['GET'])
+@conditional_get('material_categories', 'material_measurements')
 def materialcategoriesGet(resourceid=None):
     try:
         if resourceid is not None:
@@ -529,7 +1875,8 @@ def materialcategoriesPost():
         VALUES (%s, %s, %s)
         """
         params = (request_data['meas_id'], request_data['mc_name'], request_data['img_id'])
-        execute_write_query(query, params)
+        execute_insert_query(query, params, touches=('material_categories',), table='material_categories')
+        dimension_cache.invalidate()
         return make_response("", 201)
     except Exception as e:
         logger.error(f"Error in materialcategoriesPost: {str(e)}")
@@ -546,7 +1893,8 @@ def materialcategoriesEdit(resourceid=None):
         params = [request_data[field] for field in update_fields if field in request_data]
         query += " WHERE mc_id = %s"
         params.append(resourceid)
-        execute_write_query(query, tuple(params))
+        execute_write_query(query, tuple(params), touches=('material_categories',), changes=[('material_categories', 'update', [(resourceid,)])])
+        dimension_cache.invalidate()
         return make_response("", 200)
     except Exception as e:
         logger.error(f"Error in materialcategoriesEdit: {str(e)}")
@@ -555,42 +1903,61 @@ def materialcategoriesEdit(resourceid=None):
 @app.route('/api/materialcategories/<int:resourceid>', methods=['DELETE'])
 def materialcategoriesDelete(resourceid=None):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
+        def delete():
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
             
-            # Start a transaction
-            cursor.execute("START TRANSACTION")
+                # Start a transaction
+                cursor.execute("START TRANSACTION")
             
-            try:
-                # Delete associated variation materials
-                cursor.execute("""
-                    DELETE vm FROM frostedfabrics.variation_materials vm
-                    INNER JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
-                    INNER JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
-                    WHERE mb.mc_id = %s
-                """, (resourceid,))
+                try:
+                    log_deletes(cursor, 'variation_materials', """
+                        SELECT vm.var_id, vm.mat_id FROM frostedfabrics.variation_materials vm
+                        INNER JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
+                        INNER JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
+                        WHERE mb.mc_id = %s
+                    """, (resourceid,))
+                    log_deletes(cursor, 'materials', """
+                        SELECT m.mat_id FROM frostedfabrics.materials m
+                        INNER JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
+                        WHERE mb.mc_id = %s
+                    """, (resourceid,))
+                    log_deletes(cursor, 'material_brands', "SELECT brand_id FROM frostedfabrics.material_brands WHERE mc_id = %s", (resourceid,))
+                    log_changes(cursor, 'material_categories', 'delete', [(resourceid,)])
+
+                    # Delete associated variation materials
+                    cursor.execute("""
+                        DELETE vm FROM frostedfabrics.variation_materials vm
+                        INNER JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
+                        INNER JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
+                        WHERE mb.mc_id = %s
+                    """, (resourceid,))
                 
-                # Delete associated materials
-                cursor.execute("""
-                    DELETE m FROM frostedfabrics.materials m
-                    INNER JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
-                    WHERE mb.mc_id = %s
-                """, (resourceid,))
+                    # Delete associated materials
+                    cursor.execute("""
+                        DELETE m FROM frostedfabrics.materials m
+                        INNER JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
+                        WHERE mb.mc_id = %s
+                    """, (resourceid,))
                 
-                # Delete material brands in the category
-                cursor.execute("DELETE FROM frostedfabrics.material_brands WHERE mc_id = %s", (resourceid,))
+                    # Delete material brands in the category
+                    cursor.execute("DELETE FROM frostedfabrics.material_brands WHERE mc_id = %s", (resourceid,))
                 
-                # Finally, delete the material category
-                cursor.execute("DELETE FROM frostedfabrics.material_categories WHERE mc_id = %s", (resourceid,))
+                    # Finally, delete the material category
+                    cursor.execute("DELETE FROM frostedfabrics.material_categories WHERE mc_id = %s", (resourceid,))
                 
-                # Commit the transaction
-                conn.commit()
+                    # Commit the transaction
+                    bump_table_versions(cursor, ['variation_materials', 'materials', 'material_brands', 'material_categories'])
+                    conn.commit()
+                    dimension_cache.invalidate()
+                    low_stock_index.invalidate()
                 
-                return make_response(jsonify({"message": "Material category and all associated records deleted successfully"}), 200)
-            except Exception as e:
-                # Rollback in case of error
-                conn.rollback()
-                raise e
+                    return make_response(jsonify({"message": "Material category and all associated records deleted successfully"}), 200)
+                except Exception as e:
+                    # Rollback in case of error
+                    conn.rollback()
+                    raise e
+        return db_policy.run(delete, idempotent=False, log=logger.error)
     except Exception as e:
         logger.error(f"Error in materialcategoriesDelete: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
@@ -598,6 +1965,7 @@ def materialcategoriesDelete(resourceid=None):
 # ============== MATERIAL BRANDS METHODS ============
 @app.route('/api/materialbrands', methods=['GET'])
 @app.route('/api/materialbrands/<int:resourceid>', methods=['GET'])
+@conditional_get('material_brands', 'material_categories')
 def materialbrandsGet(resourceid=None):
     try:
         if resourceid is not None:
@@ -609,12 +1977,16 @@ def materialbrandsGet(resourceid=None):
             """
             params = (resourceid,)
         else:
+            mc_ids = get_id_list_arg('mc_id')
             query = """
                 SELECT mb.*, mc.mc_name
                 FROM frostedfabrics.material_brands mb
                 JOIN frostedfabrics.material_categories mc ON mb.mc_id = mc.mc_id
             """
             params = None
+            if mc_ids:
+                query += f" WHERE mb.mc_id IN ({placeholders(mc_ids)})"
+                params = tuple(mc_ids)
 
         query_results = execute_select_query(query, params)
 
@@ -625,6 +1997,8 @@ def materialbrandsGet(resourceid=None):
         else:
             return make_response(jsonify(query_results), 200)
 
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
     except Exception as e:
         logger.error(f"Error in materialbrandsGet: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
@@ -638,7 +2012,8 @@ def materialbrandsPost():
         VALUES (%s, %s, %s, %s)
         """
         params = (request_data['mc_id'], request_data['brand_name'], request_data['brand_price'], request_data['img_id'])
-        execute_write_query(query, params)
+        execute_insert_query(query, params, touches=('material_brands',), table='material_brands')
+        dimension_cache.invalidate()
         return make_response("", 201)
     except Exception as e:
         logger.error(f"Error in materialbrandsPost: {str(e)}")
@@ -655,7 +2030,8 @@ def materialbrandsEdit(resourceid=None):
         params = [request_data[field] for field in update_fields if field in request_data]
         query += " WHERE brand_id = %s"
         params.append(resourceid)
-        execute_write_query(query, tuple(params))
+        execute_write_query(query, tuple(params), touches=('material_brands',), changes=[('material_brands', 'update', [(resourceid,)])])
+        dimension_cache.invalidate()
         return make_response("", 200)
     except Exception as e:
         logger.error(f"Error in materialbrandsEdit: {str(e)}")
@@ -665,50 +2041,97 @@ def materialbrandsEdit(resourceid=None):
 def materialbrandsDelete(resourceid=None):
     try:
         query = "DELETE FROM frostedfabrics.material_brands WHERE brand_id = %s"
-        execute_write_query(query, (resourceid,))
+        execute_write_query(query, (resourceid,), touches=('material_brands',), changes=[('material_brands', 'delete', [(resourceid,)])])
+        dimension_cache.invalidate()
+        low_stock_index.invalidate()
         return make_response("", 200)
     except Exception as e:
         logger.error(f"Error in materialbrandsDelete: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
 
 # ============== MATERIALS METHODS ============
+@app.route('/api/materials/lowstock', methods=['GET'])
+def materialsLowStock():
+    try:
+        low, ready = low_stock_index.snapshot()
+        if not ready:
+            # First request after startup, before the background build finished
+            low_stock_index.rebuild()
+            low, ready = low_stock_index.snapshot()
+        mat_ids = sorted(low)
+        if not mat_ids:
+            return make_response(jsonify([]), 200)
+        rows = execute_select_query(
+            f"SELECT m.* FROM frostedfabrics.materials m WHERE m.mat_id IN ({placeholders(mat_ids)}) ORDER BY m.mat_id",
+            tuple(mat_ids)
+        )
+        # Drop anything that recovered since the index last saw it
+        rows = [row for row in rows if is_low_stock(row['mat_inv'], row['mat_alert'])]
+        low_stock_index.apply({row['mat_id']: (row['mat_inv'], row['mat_alert']) for row in rows})
+        low_stock_index.discard(set(mat_ids) - {row['mat_id'] for row in rows})
+        return make_response(jsonify(with_material_labels(rows)), 200)
+    except Exception as e:
+        logger.error(f"Error in materialsLowStock: {str(e)}")
+        return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
+
+def materials_query(resourceid, args):
+    """Return (query, params, limit) for materialsGet. Shared with the async
+    entry point in asgi_app.py."""
+    limit = None
+    if resourceid is not None:
+        query = """
+            SELECT m.*
+            FROM frostedfabrics.materials m
+            WHERE m.mat_id = %s
+        """
+        params = (resourceid,)
+    else:
+        category = unquote(args.get('category', ''))
+        limit, after = get_page_args(args=args)
+        conditions = []
+        params = []
+        if category:
+            conditions.append("""
+                m.brand_id IN (
+                    SELECT mb.brand_id
+                    FROM frostedfabrics.material_brands mb
+                    JOIN frostedfabrics.material_categories mc ON mb.mc_id = mc.mc_id
+                    WHERE mc.mc_name = %s
+                )
+            """)
+            params.append(category)
+        if after:
+            conditions.append("m.mat_id > %s")
+            params.append(after[0])
+        query = """
+            SELECT m.*
+            FROM frostedfabrics.materials m
+        """ + where_clause(conditions) + " ORDER BY m.mat_id"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        params = tuple(params) or None
+    return query, params, limit
+
 @app.route('/api/materials', methods=['GET'])
 @app.route('/api/materials/<int:resourceid>', methods=['GET'])
+@conditional_get('materials', 'material_brands', 'material_categories', 'material_measurements')
 def materialsGet(resourceid=None):
     try:
-        if resourceid is not None:
-            query = """
-                SELECT m.*, mb.brand_name, mc.mc_name, mm.meas_unit
-                FROM frostedfabrics.materials m
-                JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
-                JOIN frostedfabrics.material_categories mc ON mb.mc_id = mc.mc_id
-                LEFT JOIN frostedfabrics.material_measurements mm ON mc.meas_id = mm.meas_id
-                WHERE m.mat_id = %s
-            """
-            params = (resourceid,)
-        else:
-            category = unquote(request.args.get('category', ''))
-            query = """
-                SELECT m.*, mb.brand_name, mc.mc_name, mm.meas_unit
-                FROM frostedfabrics.materials m
-                JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
-                JOIN frostedfabrics.material_categories mc ON mb.mc_id = mc.mc_id
-                LEFT JOIN frostedfabrics.material_measurements mm ON mc.meas_id = mm.meas_id
-            """
-            params = None
-            if category:
-                query += " WHERE mc.mc_name = %s"
-                params = (category,)
+        query, params, limit = materials_query(resourceid, request.args)
 
-        query_results = execute_select_query(query, params)
+        rows = execute_select_query(query, params)
+        query_results = with_material_labels(rows)
 
         if resourceid is not None:
             if not query_results:
                 return make_response(jsonify({"error": "Resource not found"}), 404)
             return make_response(jsonify(query_results[0]), 200)
         else:
-            return make_response(jsonify(query_results), 200)
+            return paged_response(query_results, next_cursor(rows, limit, lambda row: [row['mat_id']]))
 
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
     except Exception as e:
         logger.error(f"Error in materialsGet: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
@@ -729,7 +2152,8 @@ def materialsPost():
             request_data['mat_alert'],
             request_data['img_id']
         )
-        execute_write_query(query, params)
+        mat_id = execute_insert_query(query, params, touches=('materials',), table='materials')
+        low_stock_index.apply({mat_id: (request_data['mat_inv'], request_data['mat_alert'])})
         return make_response("", 201)
     except Exception as e:
         logger.error(f"Error in materialsPost: {str(e)}")
@@ -746,7 +2170,9 @@ def materialsEdit(resourceid=None):
         params = [request_data[field] for field in update_fields if field in request_data]
         query += " WHERE mat_id = %s"
         params.append(resourceid)
-        execute_write_query(query, tuple(params))
+        execute_write_query(query, tuple(params), touches=('materials',), changes=[('materials', 'update', [(resourceid,)])])
+        if 'mat_inv' in request_data or 'mat_alert' in request_data:
+            low_stock_index.refresh([resourceid])
         return make_response("", 200)
     except Exception as e:
         logger.error(f"Error in materialsEdit: {str(e)}")
@@ -756,7 +2182,8 @@ def materialsEdit(resourceid=None):
 def materialsDelete(resourceid=None):
     try:
         query = "DELETE FROM frostedfabrics.materials WHERE mat_id = %s"
-        execute_write_query(query, (resourceid,))
+        execute_write_query(query, (resourceid,), touches=('materials',), changes=[('materials', 'delete', [(resourceid,)])])
+        low_stock_index.discard([resourceid])
         return make_response("", 200)
     except Exception as e:
         logger.error(f"Error in materialsDelete: {str(e)}")
@@ -765,6 +2192,7 @@ def materialsDelete(resourceid=None):
 # ============== VARIATION MATERIALS METHODS ============
 @app.route('/api/variationmaterials', methods=['GET'])
 @app.route('/api/variationmaterials/<int:resourceid>', methods=['GET'])
+@conditional_get('variation_materials', 'materials', 'material_brands', 'material_categories', 'material_measurements')
 def variationmaterialsGet(resourceid=None):
     try:
         if resourceid is not None:
@@ -776,14 +2204,9 @@ def variationmaterialsGet(resourceid=None):
                     m.mat_name,
                     m.mat_sku,
                     m.mat_inv,
-                    mb.brand_name,
-                    mc.mc_name,
-                    mm.meas_unit
+                    m.brand_id
                 FROM frostedfabrics.variation_materials vm
                 JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
-                JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
-                JOIN frostedfabrics.material_categories mc ON mb.mc_id = mc.mc_id
-                LEFT JOIN frostedfabrics.material_measurements mm ON mc.meas_id = mm.meas_id
                 WHERE vm.var_id = %s
                 ORDER BY m.mat_name
             """
@@ -797,34 +2220,23 @@ def variationmaterialsGet(resourceid=None):
                     m.mat_name,
                     m.mat_sku,
                     m.mat_inv,
-                    mb.brand_name,
-                    mc.mc_name,
-                    mm.meas_unit
+                    m.brand_id
                 FROM frostedfabrics.variation_materials vm
                 JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
-                JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
-                JOIN frostedfabrics.material_categories mc ON mb.mc_id = mc.mc_id
-                LEFT JOIN frostedfabrics.material_measurements mm ON mc.meas_id = mm.meas_id
                 ORDER BY vm.var_id, m.mat_name
             """
-            params = None
-
-        query_results = execute_select_query(query, params)
-
-        if resourceid is not None:
-            if not query_results:
-                return make_response(jsonify({"error": "No materials found for this variation"}), 404)
-            return make_response(jsonify(query_results), 200)
-        else:
-            # Group materials by variation ID
-            grouped_results = {}
-            for row in query_results:
-                var_id = row['var_id']
-                if var_id not in grouped_results:
-                    grouped_results[var_id] = []
-                grouped_results[var_id].append(row)
-
-            return make_response(jsonify(grouped_results), 200)
+            # Unfiltered: stream the grouped materials out as they are read
+            dims = dimension_cache.get()
+            rows = StreamedSelect(query)
+            labelled = iter_material_labels(rows, dims, keep_brand_id=False)
+            if wants_ndjson():
+                return stream_response(labelled, rows.close, ndjson=True)
+            return stream_response(iter_groups(labelled, 'var_id'), rows.close, as_object=True)
+
+        query_results = with_material_labels(execute_select_query(query, params), keep_brand_id=False)
+        if not query_results:
+            return make_response(jsonify({"error": "No materials found for this variation"}), 404)
+        return make_response(jsonify(query_results), 200)
 
     except Exception as e:
         logger.error(f"Error in variationmaterialsGet: {str(e)}")
@@ -854,7 +2266,8 @@ def variationmaterialsPost():
             request_data['var_id'],
             request_data['mat_id'],
             request_data['mat_amount']
-        ))
+        ), touches=('variation_materials',),
+           changes=[('variation_materials', 'update', [(request_data['var_id'], request_data['mat_id'])])])
 
         # Fetch and return updated variation materials
         return variationmaterialsGet(resourceid=request_data['var_id'])
@@ -872,7 +2285,8 @@ def variationmaterialsEdit(var_id, mat_id):
             SET mat_amount = %s
             WHERE var_id = %s AND mat_id = %s
         """
-        rowcount = execute_write_query(update_query, (request_data['mat_amount'], var_id, mat_id))
+        rowcount = execute_write_query(update_query, (request_data['mat_amount'], var_id, mat_id), touches=('variation_materials',),
+                                       changes=[('variation_materials', 'update', [(var_id, mat_id)])])
 
         if rowcount == 0:
             return make_response(jsonify({"error": "Material not found for this variation"}), 404)
@@ -891,7 +2305,8 @@ def variationmaterialsDelete(var_id, mat_id):
             DELETE FROM frostedfabrics.variation_materials
             WHERE var_id = %s AND mat_id = %s
         """
-        rowcount = execute_write_query(delete_query, (var_id, mat_id))
+        rowcount = execute_write_query(delete_query, (var_id, mat_id), touches=('variation_materials',),
+                                       changes=[('variation_materials', 'delete', [(var_id, mat_id)])])
 
         if rowcount == 0:
             return make_response(jsonify({"error": "Material not found for this variation"}), 404)
@@ -906,6 +2321,7 @@ def variationmaterialsDelete(var_id, mat_id):
 # ============== CALENDAR CATEGORIES METHODS ============
 @app.route('/api/calendarcategories', methods=['GET'])
 @app.route('/api/calendarcategories/<int:resourceid>', methods=['GET'])
+@conditional_get('calendar_categories')
 def calendarcategoriesGet(resourceid=None):
     try:
         if resourceid is not None:
@@ -937,7 +2353,7 @@ def calendarcategoriesPost():
         VALUES (%s, %s)
         """
         params = (request_data['cc_name'], request_data['cc_hex'])
-        execute_write_query(query, params)
+        execute_insert_query(query, params, touches=('calendar_categories',), table='calendar_categories')
         return make_response("", 201)
     except Exception as e:
         logger.error(f"Error in calendarcategoriesPost: {str(e)}")
@@ -954,7 +2370,7 @@ def calendarcategoriesEdit(resourceid=None):
         params = [request_data[field] for field in update_fields if field in request_data]
         query += " WHERE cc_id = %s"
         params.append(resourceid)
-        execute_write_query(query, tuple(params))
+        execute_write_query(query, tuple(params), touches=('calendar_categories',), changes=[('calendar_categories', 'update', [(resourceid,)])])
         return make_response("", 200)
     except Exception as e:
         logger.error(f"Error in calendarcategoriesEdit: {str(e)}")
@@ -963,27 +2379,33 @@ def calendarcategoriesEdit(resourceid=None):
 @app.route('/api/calendarcategories/<int:resourceid>', methods=['DELETE'])
 def calendarcategoriesDelete(resourceid=None):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
+        def delete():
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
             
-            # Start a transaction
-            cursor.execute("START TRANSACTION")
+                # Start a transaction
+                cursor.execute("START TRANSACTION")
             
-            try:
-                # First, delete all events associated with this category
-                cursor.execute("DELETE FROM frostedfabrics.calendar_events WHERE cc_id = %s", (resourceid,))
+                try:
+                    log_deletes(cursor, 'calendar_events', "SELECT event_id FROM frostedfabrics.calendar_events WHERE cc_id = %s", (resourceid,))
+                    log_changes(cursor, 'calendar_categories', 'delete', [(resourceid,)])
+
+                    # First, delete all events associated with this category
+                    cursor.execute("DELETE FROM frostedfabrics.calendar_events WHERE cc_id = %s", (resourceid,))
                 
-                # Then, delete the category itself
-                cursor.execute("DELETE FROM frostedfabrics.calendar_categories WHERE cc_id = %s", (resourceid,))
+                    # Then, delete the category itself
+                    cursor.execute("DELETE FROM frostedfabrics.calendar_categories WHERE cc_id = %s", (resourceid,))
                 
-                # Commit the transaction
-                conn.commit()
+                    # Commit the transaction
+                    bump_table_versions(cursor, ['calendar_events', 'calendar_categories'])
+                    conn.commit()
                 
-                return make_response(jsonify({"message": "Calendar category and all associated events deleted successfully"}), 200)
-            except Exception as e:
-                # Rollback in case of error
-                conn.rollback()
-                raise e
+                    return make_response(jsonify({"message": "Calendar category and all associated events deleted successfully"}), 200)
+                except Exception as e:
+                    # Rollback in case of error
+                    conn.rollback()
+                    raise e
+        return db_policy.run(delete, idempotent=False, log=logger.error)
     except Exception as e:
         logger.error(f"Error in calendarcategoriesDelete: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
@@ -991,6 +2413,7 @@ def calendarcategoriesDelete(resourceid=None):
 # ============== CALENDAR EVENTS METHODS ============
 @app.route('/api/calendarevents', methods=['GET'])
 @app.route('/api/calendarevents/<int:resourceid>', methods=['GET'])
+@conditional_get('calendar_events', 'calendar_categories')
 def calendareventsGet(resourceid=None):
     try:
         if resourceid is not None:
@@ -1002,13 +2425,34 @@ def calendareventsGet(resourceid=None):
             """
             params = (resourceid,)
         else:
+            limit, after = get_page_args(cursor_length=2)
+            start = get_datetime_arg('from')
+            end = get_datetime_arg('to')
+            cc_ids = get_id_list_arg('cc_id')
+            conditions = []
+            params = []
+            # `to` is exclusive so consecutive windows never overlap
+            if start:
+                conditions.append("e.event_timestamp >= %s")
+                params.append(start)
+            if end:
+                conditions.append("e.event_timestamp < %s")
+                params.append(end)
+            if cc_ids:
+                conditions.append(f"e.cc_id IN ({placeholders(cc_ids)})")
+                params.extend(cc_ids)
+            if after:
+                conditions.append("(e.event_timestamp > %s OR (e.event_timestamp = %s AND e.event_id > %s))")
+                params.extend([after[0], after[0], after[1]])
             query = """
                 SELECT e.*, c.cc_name, c.cc_hex
                 FROM frostedfabrics.calendar_events e
                 JOIN frostedfabrics.calendar_categories c ON e.cc_id = c.cc_id
-                ORDER BY e.event_timestamp
-            """
-            params = None
+            """ + where_clause(conditions) + " ORDER BY e.event_timestamp, e.event_id"
+            if limit is not None:
+                query += " LIMIT %s"
+                params.append(limit)
+            params = tuple(params) or None
 
         query_results = execute_select_query(query, params)
 
@@ -1017,12 +2461,79 @@ def calendareventsGet(resourceid=None):
                 return make_response(jsonify({"error": "Resource not found"}), 404)
             return make_response(jsonify(query_results[0]), 200)
         else:
-            return make_response(jsonify(query_results), 200)
+            cursor = next_cursor(query_results, limit, lambda row: [row['event_timestamp'], row['event_id']])
+            return paged_response(query_results, cursor)
 
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
     except Exception as e:
         logger.error(f"Error in calendareventsGet: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
 
+@app.route('/api/calendarevents/summary', methods=['GET'])
+@conditional_get('calendar_events')
+def calendareventsSummary():
+    """Event counts per day for a month (?month=YYYY-MM), a week
+    (?week=YYYY-MM-DD, the first day of the week) or an explicit from/to range."""
+    try:
+        month = request.args.get('month')
+        week = request.args.get('week')
+        if month:
+            try:
+                start = datetime.strptime(month, '%Y-%m')
+            except ValueError:
+                raise ValueError("month must be formatted as YYYY-MM")
+            end = (start + timedelta(days=32)).replace(day=1)
+        elif week:
+            try:
+                start = datetime.strptime(week, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError("week must be formatted as YYYY-MM-DD")
+            end = start + timedelta(days=7)
+        else:
+            start = get_datetime_arg('from')
+            end = get_datetime_arg('to')
+            if start is None or end is None:
+                raise ValueError("Provide month, week, or both from and to")
+        if end <= start:
+            raise ValueError("to must be after from")
+        if end - start > timedelta(days=366):
+            raise ValueError("Summary range cannot exceed one year")
+
+        cc_ids = get_id_list_arg('cc_id')
+        query = """
+            SELECT DATE(e.event_timestamp) AS event_date, COUNT(*) AS event_count
+            FROM frostedfabrics.calendar_events e
+            WHERE e.event_timestamp >= %s AND e.event_timestamp < %s
+        """
+        params = [start, end]
+        if cc_ids:
+            query += f" AND e.cc_id IN ({placeholders(cc_ids)})"
+            params.extend(cc_ids)
+        query += " GROUP BY DATE(e.event_timestamp)"
+
+        counts = {str(row['event_date']): row['event_count'] for row in execute_select_query(query, tuple(params))}
+
+        # Include the empty days so the client can render the grid directly
+        days = []
+        day = start.date()
+        last_day = (end - timedelta(microseconds=1)).date()
+        while day <= last_day:
+            days.append({"date": day.isoformat(), "count": counts.get(day.isoformat(), 0)})
+            day += timedelta(days=1)
+
+        return make_response(jsonify({
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "days": days
+        }), 200)
+
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
+    except Exception as e:
+        logger.error(f"Error in calendareventsSummary: {str(e)}")
+        return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
+
 @app.route('/api/calendarevents', methods=['POST'])
 def calendareventsPost():
     request_data = request.get_json()
@@ -1040,7 +2551,7 @@ def calendareventsPost():
             request_data.get('event_link'),
             request_data['event_timestamp']
         )
-        execute_write_query(query, params)
+        execute_insert_query(query, params, touches=('calendar_events',), table='calendar_events')
         return make_response("", 201)
     except Exception as e:
         logger.error(f"Error in calendareventsPost: {str(e)}")
@@ -1057,7 +2568,7 @@ def calendareventsEdit(resourceid=None):
         params = [request_data[field] for field in update_fields if field in request_data]
         query += " WHERE event_id = %s"
         params.append(resourceid)
-        execute_write_query(query, tuple(params))
+        execute_write_query(query, tuple(params), touches=('calendar_events',), changes=[('calendar_events', 'update', [(resourceid,)])])
         return make_response("", 200)
     except Exception as e:
         logger.error(f"Error in calendareventsEdit: {str(e)}")
@@ -1067,11 +2578,775 @@ def calendareventsEdit(resourceid=None):
 def calendareventsDelete(resourceid=None):
     try:
         query = "DELETE FROM frostedfabrics.calendar_events WHERE event_id = %s"
-        execute_write_query(query, (resourceid,))
+        execute_write_query(query, (resourceid,), touches=('calendar_events',), changes=[('calendar_events', 'delete', [(resourceid,)])])
         return make_response("", 200)
     except Exception as e:
         logger.error(f"Error in calendareventsDelete: {str(e)}")
         return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
 
+# ============== CHANGE FEED METHODS ============
+# GET /api/changes?since=<cursor> returns the rows changed since the cursor,
+# read from the change log. Change ids are handed out when an entry is
+# written but become visible at commit, so a lower id can still show up after
+# a higher one. The feed therefore stops before a gap in the ids until the gap
+# is CHANGE_FEED_GAP_GRACE seconds old; by then the missing id belongs to a
+# transaction that rolled back.
+CHANGE_FEED_GAP_GRACE = float(os.getenv('CHANGE_FEED_GAP_GRACE', '5'))  # seconds
+CHANGE_LOG_RETENTION_DAYS = float(os.getenv('CHANGE_LOG_RETENTION_DAYS', '7'))
+CHANGE_LOG_PRUNE_INTERVAL = 3600  # seconds
+CHANGE_LOG_PRUNE_BATCH = 10000  # rows per DELETE
+
+@functools.lru_cache(maxsize=1)
+def change_id_step():
+    """auto_increment_increment, the distance between consecutive ids."""
+    return execute_select_query("SELECT @@auto_increment_increment AS step")[0]['step']
+
+def fetch_rows_by_key(table, keys):
+    """Current rows of table for the given key tuples, by key."""
+    columns = TABLE_KEYS[table]
+    if len(columns) == 1:
+        condition = f"{columns[0]} IN ({placeholders(keys)})"
+        params = [key[0] for key in keys]
+    else:
+        row = "(" + placeholders(columns) + ")"
+        condition = f"({', '.join(columns)}) IN ({', '.join([row] * len(keys))})"
+        params = [value for key in keys for value in key]
+    rows = execute_select_query(f"SELECT * FROM frostedfabrics.{table} WHERE {condition}", tuple(params))
+    return {tuple(row[column] for column in columns): row for row in rows}
+
+def latest_change_id():
+    return execute_select_query("SELECT COALESCE(MAX(change_id), 0) AS change_id FROM frostedfabrics.change_log")[0]['change_id']
+
+def is_pruned(since):
+    """Whether entries after the change id since were already pruned."""
+    oldest = execute_select_query("SELECT MIN(change_id) AS change_id FROM frostedfabrics.change_log")[0]['change_id']
+    return oldest is not None and since + change_id_step() < oldest
+
+def read_change_log(since, limit):
+    """Read up to limit entries after the change id since. Returns (latest,
+    cursor, has_more): the latest (op, key_fields) of each changed row by
+    (table, key), in the order of each row's last change; the id to read on
+    from; and whether more entries may follow."""
+    entries = execute_select_query("""
+        SELECT change_id, table_name, op, row_key,
+               TIMESTAMPDIFF(MICROSECOND, changed_at, NOW(6)) / 1000000 AS age
+        FROM frostedfabrics.change_log
+        WHERE change_id > %s
+        ORDER BY change_id
+        LIMIT %s
+    """, (since, limit))
+
+    latest = {}
+    cursor = since
+    has_more = len(entries) == limit
+    for entry in entries:
+        if entry['change_id'] != cursor + change_id_step() and entry['age'] < CHANGE_FEED_GAP_GRACE:
+            has_more = True
+            break
+        cursor = entry['change_id']
+        table = entry['table_name']
+        key = json.loads(entry['row_key'])
+        row_key = (table, tuple(key[column] for column in TABLE_KEYS[table]))
+        latest.pop(row_key, None)
+        latest[row_key] = (entry['op'], key)
+    return latest, cursor, has_more
+
+def current_changes(latest):
+    """Change entries for latest, {(table, key): (op, key_fields)}, in its
+    order and with each row's current contents."""
+    keys_by_table = {}
+    for table, key in latest:
+        keys_by_table.setdefault(table, []).append(key)
+    current = {table: fetch_rows_by_key(table, keys) for table, keys in keys_by_table.items()}
+
+    changes = []
+    for (table, key), (op, key_fields) in latest.items():
+        row = current[table].get(key)
+        # Whatever was logged last, a row that is gone now is a delete
+        if row is None:
+            changes.append({"table": table, "op": "delete", "key": key_fields})
+        else:
+            changes.append({"table": table, "op": "update" if op == 'delete' else op, "key": key_fields, "row": row})
+    return changes
+
+@app.route('/api/changes', methods=['GET'])
+def changesGet():
+    try:
+        limit, _ = get_page_args()
+        limit = limit or MAX_PAGE_LIMIT
+        since = decode_cursor(request.args['since'])[0] if request.args.get('since') else None
+        if since is None:
+            # A new client loads the lists first, then polls from here
+            return make_response(jsonify({"changes": [], "cursor": encode_cursor([latest_change_id()]), "has_more": False}), 200)
+        if not isinstance(since, int):
+            raise ValueError("Invalid cursor")
+
+        if is_pruned(since):
+            return make_response(jsonify({"error": "Cursor is older than the change log, reload the lists and start again without since"}), 410)
+
+        latest, cursor, has_more = read_change_log(since, limit)
+        changes = current_changes(latest)
+        return make_response(jsonify({"changes": changes, "cursor": encode_cursor([cursor]), "has_more": has_more}), 200)
+
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
+    except Exception as e:
+        logger.error(f"Error in changesGet: {str(e)}")
+        return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
+
+def prune_change_log():
+    """Delete entries older than the retention period. The newest entry is
+    always kept, so a stale cursor can still be told from an idle log."""
+    newest = execute_select_query("SELECT MAX(change_id) AS change_id FROM frostedfabrics.change_log")[0]['change_id']
+    if newest is None:
+        return
+    retention = int(CHANGE_LOG_RETENTION_DAYS * 86400)
+    while execute_write_query(
+        "DELETE FROM frostedfabrics.change_log WHERE changed_at < NOW() - INTERVAL %s SECOND AND change_id < %s LIMIT %s",
+        (retention, newest, CHANGE_LOG_PRUNE_BATCH)
+    ) == CHANGE_LOG_PRUNE_BATCH:
+        pass
+
+def prune_change_log_periodically():
+    while True:
+        try:
+            prune_change_log()
+        except Exception as e:
+            logger.error(f"Change log pruning failed: {str(e)}")
+        time.sleep(CHANGE_LOG_PRUNE_INTERVAL)
+
+# ============== SEARCH METHODS ============
+# GET /api/search?q=<text> answers typeahead queries from an in-memory index
+# of material, brand, product and variation names and material SKUs (see
+# search.py); no query reaches the database. The index is loaded in the
+# background at startup. Writes made through this worker are indexed as
+# their request finishes, and every SEARCH_SYNC_INTERVAL seconds the change
+# log is read for the writes of the other workers.
+SEARCH_SYNC_INTERVAL = float(os.getenv('SEARCH_SYNC_INTERVAL', '2'))  # seconds
+SEARCH_SYNC_BATCH = 1000  # change log entries read at a time
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+
+# table -> (kind of document, name column, SKU column, columns returned with a match)
+SEARCH_TABLES = {
+    'materials': ('material', 'mat_name', 'mat_sku', ('brand_id',)),
+    'material_brands': ('brand', 'brand_name', None, ('mc_id',)),
+    'products': ('product', 'prod_name', None, ('pc_id',)),
+    'product_variations': ('variation', 'var_name', None, ('prod_id',)),
+}
+SEARCH_KINDS = {kind: table for table, (kind, *_) in SEARCH_TABLES.items()}
+# A match's parent document, whose name is returned with it
+SEARCH_PARENTS = {'material': ('brand', 'brand_id', 'brand_name'), 'variation': ('product', 'prod_id', 'prod_name')}
+
+def search_document(table, row):
+    kind, name_column, sku_column, columns = SEARCH_TABLES[table]
+    return search.Document(
+        kind,
+        row[TABLE_KEYS[table][0]],
+        row[name_column],
+        row[sku_column] if sku_column else None,
+        {column: row[column] for column in columns}
+    )
+
+class SearchIndexSync:
+    """Loads search_index and keeps it current with the change log."""
+
+    def __init__(self, index, interval):
+        self.index = index
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._cursor = None  # change id the index is current to; None until loaded
+        self._thread = None
+        # Serializes apply() with the end of a load: changes applied while
+        # a load reads the tables are held back and replayed once the new
+        # index is in place, or the swap would drop them
+        self._apply_lock = threading.Lock()
+        self._loading = False
+        self._held_back = []
+
+    @property
+    def ready(self):
+        return self._cursor is not None
+
+    def _load(self):
+        started_at = time.monotonic()
+        with self._apply_lock:
+            self._loading = True
+        try:
+            # Read before the rows, so writes racing the load are applied again
+            cursor = latest_change_id()
+            documents = []
+            for table, (kind, name_column, sku_column, columns) in SEARCH_TABLES.items():
+                selected = [TABLE_KEYS[table][0], name_column, *([sku_column] if sku_column else []), *columns]
+                rows = execute_select_query(f"SELECT {', '.join(selected)} FROM frostedfabrics.{table}")
+                documents.extend(search_document(table, row) for row in rows)
+            self.index.replace(documents)
+            self._cursor = cursor
+        finally:
+            # Also after a failed load, as the old index still needs them
+            with self._apply_lock:
+                for changes in self._held_back:
+                    self._apply(changes)
+                self._held_back = []
+                self._loading = False
+        metrics.SEARCH_INDEX_DOCUMENTS.set(len(self.index))
+        logger.info(f"Search index loaded: {len(documents)} documents in {time.monotonic() - started_at:.1f}s")
+
+    def load(self):
+        """Load the index now, unless it already is."""
+        with self._lock:
+            if self._cursor is None:
+                self._load()
+
+    def apply(self, changes):
+        """Index change entries in the /api/changes format."""
+        with self._apply_lock:
+            if self._loading:
+                self._held_back.append(changes)
+            else:
+                self._apply(changes)
+
+    def _apply(self, changes):
+        documents = []
+        removed = []
+        for change in changes:
+            if change['table'] not in SEARCH_TABLES:
+                continue
+            if change['op'] == 'delete':
+                removed.append((SEARCH_TABLES[change['table']][0], change['key'][TABLE_KEYS[change['table']][0]]))
+            else:
+                documents.append(search_document(change['table'], change['row']))
+        if documents or removed:
+            self.index.update(documents, removed)
+            metrics.SEARCH_INDEX_DOCUMENTS.set(len(self.index))
+
+    def catch_up(self):
+        """Apply the change log since the last load or catch up. Returns
+        whether more entries may be waiting."""
+        with self._lock:
+            if self._cursor is None or is_pruned(self._cursor):
+                self._load()
+                return False
+            latest, cursor, has_more = read_change_log(self._cursor, SEARCH_SYNC_BATCH)
+            latest = {row_key: change for row_key, change in latest.items() if row_key[0] in SEARCH_TABLES}
+            if latest:
+                self.apply(current_changes(latest))
+            self._cursor = cursor
+            return has_more
+
+    def _run(self):
+        # The change log names rows that a lagging replica may not have yet
+        primary_reads_only.set(True)
+        while True:
+            try:
+                if self.catch_up():
+                    continue
+            except Exception as e:
+                logger.error(f"Search index sync failed: {str(e)}")
+            time.sleep(self.interval)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="search-index-sync", daemon=True)
+        self._thread.start()
+
+search_index = search.SearchIndex()
+search_sync = SearchIndexSync(search_index, SEARCH_SYNC_INTERVAL)
+
+def get_kinds_arg():
+    """The kinds listed in ?kinds=material,product, or None for all."""
+    value = request.args.get('kinds')
+    if not value:
+        return None
+    kinds = set(value.split(','))
+    unknown = kinds - set(SEARCH_KINDS)
+    if unknown:
+        raise ValueError(f"Unknown kinds: {', '.join(sorted(unknown))}")
+    return kinds
+
+def search_result(rank, doc):
+    result = {"kind": doc.kind, "id": doc.id, "name": doc.name, "match": search.MATCHES[rank], **doc.fields}
+    if doc.kind == 'material':
+        result['sku'] = doc.sku
+    if doc.kind in SEARCH_PARENTS:
+        parent_kind, parent_id, parent_name = SEARCH_PARENTS[doc.kind]
+        parent = search_index.get(parent_kind, doc.fields[parent_id])
+        result[parent_name] = parent.name if parent is not None else None
+    return result
+
+@app.route('/api/search', methods=['GET'])
+def searchGet():
+    try:
+        query = request.args.get('q', '')
+        kinds = get_kinds_arg()
+        try:
+            limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        limit = min(max(limit, 1), SEARCH_MAX_LIMIT)
+        if not search_sync.ready:
+            # First search after startup, before the background load finished
+            search_sync.load()
+        matches = search_index.search(query, kinds, limit)
+        return make_response(jsonify([search_result(rank, doc) for rank, doc in matches]), 200)
+
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
+    except Exception as e:
+        logger.error(f"Error in searchGet: {str(e)}")
+        return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
+
+# ============== EVENT STREAM METHODS ============
+# GET /api/events is a Server-Sent Events stream of changes to inventory
+# (product variation and material rows, with their var_inv/mat_inv) and to
+# calendar events, pushed as the writes happen so open dashboards need not
+# poll. Each event's data is a change entry in the /api/changes format. A
+# write is published by the worker that made it once the request succeeds,
+# and relayed to the other workers by the event broker (see events.py).
+EVENT_TOPICS = {
+    'product_variations': 'inventory',
+    'materials': 'inventory',
+    'calendar_events': 'calendar',
+}
+EVENT_QUEUE_SIZE = int(os.getenv('EVENT_QUEUE_SIZE', '1000'))  # events buffered per stream
+EVENT_HEARTBEAT_INTERVAL = float(os.getenv('EVENT_HEARTBEAT_INTERVAL', '15'))  # seconds
+EVENT_RETRY = 3000  # milliseconds a disconnected client waits before reconnecting
+
+event_hub = events.EventHub(EVENT_QUEUE_SIZE, broker_path=os.getenv('EVENT_BROKER_SOCKET'))
+
+def publish_change_events(changes):
+    for change in changes:
+        if change['table'] in EVENT_TOPICS:
+            event_hub.publish(EVENT_TOPICS[change['table']], app.json.dumps(change))
+
+def get_topics_arg(args=None):
+    """The topics listed in ?topics=inventory,calendar, or None for all."""
+    value = (request.args if args is None else args).get('topics')
+    if not value:
+        return None
+    topics = set(value.split(','))
+    unknown = topics - set(EVENT_TOPICS.values())
+    if unknown:
+        raise ValueError(f"Unknown topics: {', '.join(sorted(unknown))}")
+    return topics
+
+def format_event(event):
+    if event is None:
+        # A comment line; keeps proxies from closing an idle stream
+        return ": keepalive\n\n"
+    topic, payload = event
+    return f"event: {topic}\ndata: {payload}\n\n"
+
+@app.route('/api/events', methods=['GET'])
+def eventsGet():
+    try:
+        topics = get_topics_arg()
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
+
+    subscription = event_hub.subscribe(topics)
+    def stream():
+        try:
+            yield f"retry: {EVENT_RETRY}\n\n"
+            while True:
+                yield format_event(subscription.get(timeout=EVENT_HEARTBEAT_INTERVAL))
+        finally:
+            subscription.close()
+
+    response = flask.Response(stream(), mimetype='text/event-stream')
+    # Also covers a response closed before the stream was started
+    response.call_on_close(subscription.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# ============== BATCH METHODS ============
+# POST /api/batch runs several GET routes in one HTTP round trip. All
+# sub-requests share one pooled connection (a single checkout and session
+# reset instead of one per request). A MySQL connection executes one statement
+# at a time, so sub-requests run in order; that also lets a later path refer
+# to an earlier result, e.g. "/api/productcategories/{product.pc_id}".
+MAX_BATCH_REQUESTS = 20
+UNBATCHABLE_PATHS = ('/api/batch', '/api/events')
+BATCH_REFERENCE = re.compile(r'\{(\w+)\.(\w+)\}')
+
+def resolve_batch_path(path, results):
+    def substitute(match):
+        name, field = match.groups()
+        body = results.get(name)
+        if not isinstance(body, dict) or field not in body:
+            raise ValueError(f"Cannot resolve {match.group(0)}")
+        return quote(str(body[field]), safe='')
+    return BATCH_REFERENCE.sub(substitute, path)
+
+@app.route('/api/batch', methods=['POST'])
+def batchGet():
+    request_data = request.get_json(silent=True)
+    sub_requests = request_data.get('requests') if isinstance(request_data, dict) else request_data
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return make_response(jsonify({"error": "Request body must contain a non-empty requests array"}), 400)
+    if len(sub_requests) > MAX_BATCH_REQUESTS:
+        return make_response(jsonify({"error": f"At most {MAX_BATCH_REQUESTS} requests can be batched"}), 400)
+
+    try:
+        responses = []
+        results = {}
+        with get_db_connection(read_only=True) as conn:
+            g.pinned_connection = conn
+            try:
+                for index, sub_request in enumerate(sub_requests):
+                    if isinstance(sub_request, str):
+                        sub_request = {"path": sub_request}
+                    name = sub_request.get('id', str(index)) if isinstance(sub_request, dict) else str(index)
+                    path = sub_request.get('path') if isinstance(sub_request, dict) else None
+                    if not isinstance(path, str) or not path.startswith('/api/') or path.startswith(UNBATCHABLE_PATHS):
+                        responses.append({"id": name, "status": 400, "body": {"error": "path must be an /api/ GET route"}})
+                        continue
+                    try:
+                        path = resolve_batch_path(path, results)
+                    except ValueError as e:
+                        responses.append({"id": name, "status": 424, "body": {"error": str(e)}})
+                        continue
+
+                    headers = {}
+                    if sub_request.get('if_none_match'):
+                        headers['If-None-Match'] = sub_request['if_none_match']
+                    with app.test_request_context(path, method='GET', headers=headers):
+                        g.pop('table_versions', None)
+                        sub_response = app.full_dispatch_request()
+                        body = sub_response.get_json(silent=True) if sub_response.status_code != 304 else None
+                        if body is None and sub_response.status_code != 304:
+                            body = sub_response.get_data(as_text=True)
+                        sub_response.close()
+                    results[name] = body
+                    responses.append({
+                        "id": name,
+                        "status": sub_response.status_code,
+                        "etag": sub_response.headers.get('ETag'),
+                        "body": body
+                    })
+            finally:
+                g.pop('pinned_connection', None)
+                g.pop('table_versions', None)
+
+        return make_response(jsonify({"responses": responses}), 200)
+
+    except Exception as e:
+        logger.error(f"Error in batchGet: {str(e)}")
+        return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
+
+# ============== BULK METHODS ============
+# Array-accepting counterparts of the single-row POST/PUT handlers. Each call
+# validates every item up front, then runs in one transaction on one pooled
+# connection with batched statements.
+MAX_BULK_ITEMS = 1000
+
+BULK_RESOURCES = {
+    'products': {
+        'table': 'products',
+        'key': ['prod_id'],
+        'create': ['pc_id', 'prod_name', 'prod_cost', 'prod_msrp', 'prod_time', 'img_id'],
+        'update': ['pc_id', 'prod_name', 'prod_cost', 'prod_msrp', 'prod_time', 'img_id']
+    },
+    'productvariations': {
+        'table': 'product_variations',
+        'key': ['var_id'],
+        'create': ['prod_id', 'var_name', 'var_inv', 'var_goal', 'img_id'],
+        'update': ['var_name', 'var_inv', 'var_goal', 'img_id'],
+        'consumes_materials': True
+    },
+    'productcategories': {
+        'table': 'product_categories',
+        'key': ['pc_id'],
+        'create': ['pc_name', 'img_id'],
+        'update': ['pc_name', 'img_id']
+    },
+    'materialcategories': {
+        'table': 'material_categories',
+        'key': ['mc_id'],
+        'create': ['meas_id', 'mc_name', 'img_id'],
+        'update': ['meas_id', 'mc_name', 'img_id']
+    },
+    'materialbrands': {
+        'table': 'material_brands',
+        'key': ['brand_id'],
+        'create': ['mc_id', 'brand_name', 'brand_price', 'img_id'],
+        'update': ['mc_id', 'brand_name', 'brand_price', 'img_id']
+    },
+    'materials': {
+        'table': 'materials',
+        'key': ['mat_id'],
+        'create': ['brand_id', 'mat_name', 'mat_sku', 'mat_inv', 'mat_alert', 'img_id'],
+        'update': ['brand_id', 'mat_name', 'mat_sku', 'mat_inv', 'mat_alert', 'img_id']
+    },
+    'variationmaterials': {
+        'table': 'variation_materials',
+        'key': ['var_id', 'mat_id'],
+        'create': ['var_id', 'mat_id', 'mat_amount'],
+        'update': ['mat_amount'],
+        'upsert': ['mat_amount'],
+        'references': {'var_id': ('product_variations', 'var_id'), 'mat_id': ('materials', 'mat_id')}
+    },
+    'calendarcategories': {
+        'table': 'calendar_categories',
+        'key': ['cc_id'],
+        'create': ['cc_name', 'cc_hex'],
+        'update': ['cc_name', 'cc_hex']
+    },
+    'calendarevents': {
+        'table': 'calendar_events',
+        'key': ['event_id'],
+        'create': ['cc_id', 'event_title', 'event_timestamp'],
+        'optional': ['event_subtitle', 'event_notes', 'event_link'],
+        'update': ['cc_id', 'event_title', 'event_subtitle', 'event_notes', 'event_link', 'event_timestamp']
+    }
+}
+
+def get_bulk_items():
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        raise ValueError("Request body must be a non-empty JSON array")
+    if len(items) > MAX_BULK_ITEMS:
+        raise ValueError(f"At most {MAX_BULK_ITEMS} items can be sent in one request")
+    return items
+
+def bulk_validation_response(errors):
+    return make_response(jsonify({"error": "Invalid items", "results": errors}), 400)
+
+def find_existing_keys(cursor, table, key, keys, lock=False):
+    """Return the subset of keys (tuples) that exist in table. With lock,
+    the rows are locked in key order until the transaction ends, so none of
+    them can be deleted before the caller writes to it."""
+    if not keys:
+        return set()
+    if len(key) == 1:
+        condition = f"{key[0]} IN ({placeholders(keys)})"
+        params = [k[0] for k in keys]
+    else:
+        row = "(" + ", ".join(["%s"] * len(key)) + ")"
+        condition = f"({', '.join(key)}) IN ({', '.join([row] * len(keys))})"
+        params = [value for k in keys for value in k]
+    query = f"SELECT {', '.join(key)} FROM frostedfabrics.{table} WHERE {condition}"
+    if lock:
+        query += f" ORDER BY {', '.join(key)} FOR UPDATE"
+    cursor.execute(query, tuple(params))
+    return {tuple(row) for row in cursor.fetchall()}
+
+@app.route('/api/<resource>/bulk', methods=['POST'])
+def bulkCreate(resource):
+    spec = BULK_RESOURCES.get(resource)
+    if spec is None:
+        return make_response(jsonify({"error": "Resource not found"}), 404)
+    try:
+        items = get_bulk_items()
+        errors = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors.append({"index": index, "status": "error", "error": "Item must be an object"})
+                continue
+            missing = [field for field in spec['create'] if field not in item]
+            if missing:
+                errors.append({"index": index, "status": "error", "error": f"Missing fields: {', '.join(missing)}"})
+        if errors:
+            return bulk_validation_response(errors)
+
+        table = spec['table']
+        columns = spec['create'] + spec.get('optional', [])
+        rows = [tuple(item.get(column) for column in columns) for item in items]
+        query = f"""
+            INSERT INTO frostedfabrics.{table} ({', '.join(columns)})
+            VALUES ({placeholders(columns)})
+        """
+        if spec.get('upsert'):
+            query += " ON DUPLICATE KEY UPDATE " + ", ".join(f"{field} = VALUES({field})" for field in spec['upsert'])
+
+        def create():
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    for field, (ref_table, ref_key) in spec.get('references', {}).items():
+                        wanted = {(item[field],) for item in items}
+                        found = find_existing_keys(cursor, ref_table, [ref_key], list(wanted))
+                        errors.extend(
+                            {"index": index, "status": "error", "error": f"Invalid {field}"}
+                            for index, item in enumerate(items) if (item[field],) not in found
+                        )
+                    if errors:
+                        conn.rollback()
+                        return bulk_validation_response(sorted(errors, key=lambda e: e['index']))
+
+                    # executemany rewrites this into a single multi-row INSERT, so
+                    # lastrowid is the first generated id and the rest follow it
+                    # (InnoDB allocates consecutive ids to one simple insert)
+                    cursor.executemany(query, rows)
+                    first_id = cursor.lastrowid
+                    cursor.execute("SELECT @@SESSION.auto_increment_increment")
+                    increment = cursor.fetchone()[0]
+                    if spec.get('upsert'):
+                        log_changes(cursor, table, 'update', [tuple(item[field] for field in spec['key']) for item in items])
+                    else:
+                        log_changes(cursor, table, 'insert', [(first_id + index * increment,) for index in range(len(items))])
+                    bump_table_versions(cursor, [table])
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    raise e
+
+            if table in DIMENSION_TABLES:
+                dimension_cache.invalidate()
+            if table == 'materials':
+                low_stock_index.apply({
+                    first_id + index * increment: (item['mat_inv'], item['mat_alert'])
+                    for index, item in enumerate(items)
+                })
+
+            results = []
+            for index, item in enumerate(items):
+                result = {"index": index}
+                if spec.get('upsert'):
+                    result["status"] = "upserted"
+                    result.update({field: item[field] for field in spec['key']})
+                else:
+                    result["status"] = "created"
+                    result[spec['key'][0]] = first_id + index * increment
+                results.append(result)
+            return make_response(jsonify({"results": results}), 201)
+        return db_policy.run(create, idempotent=False, log=logger.error)
+
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
+    except Exception as e:
+        logger.error(f"Error in bulkCreate ({resource}): {str(e)}")
+        return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
+
+@app.route('/api/<resource>/bulk', methods=['PUT', 'PATCH'])
+def bulkUpdate(resource):
+    spec = BULK_RESOURCES.get(resource)
+    if spec is None:
+        return make_response(jsonify({"error": "Resource not found"}), 404)
+    try:
+        items = get_bulk_items()
+        key = spec['key']
+        errors = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors.append({"index": index, "status": "error", "error": "Item must be an object"})
+            elif any(field not in item for field in key):
+                errors.append({"index": index, "status": "error", "error": f"Missing key fields: {', '.join(key)}"})
+            elif not any(field in item for field in spec['update']):
+                errors.append({"index": index, "status": "error", "error": "No fields to update"})
+        if errors:
+            return bulk_validation_response(errors)
+
+        table = spec['table']
+        keys = [tuple(item[field] for field in key) for item in items]
+
+        def update():
+            results = []
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    # Locked, or a row deleted meanwhile would still be reported
+                    # as updated. Variations are thereby locked in id order
+                    # before any material, as productvariationsEdit/Produce do
+                    existing = find_existing_keys(cursor, table, key, sorted(set(keys)), lock=True)
+
+                    current_inv = {}
+                    if spec.get('consumes_materials'):
+                        ids = sorted({k[0] for k in keys if k in existing})
+                        if ids:
+                            cursor.execute(
+                                f"SELECT var_id, var_inv FROM frostedfabrics.product_variations WHERE var_id IN ({placeholders(ids)}) ORDER BY var_id FOR UPDATE",
+                                tuple(ids)
+                            )
+                            current_inv = dict(cursor.fetchall())
+
+                    # Batch the UPDATEs by the set of fields each item changes
+                    groups = {}
+                    new_inv = {}
+                    for index, item in enumerate(items):
+                        if keys[index] not in existing:
+                            results.append({"index": index, "status": "not_found", **dict(zip(key, keys[index]))})
+                            continue
+                        if spec.get('consumes_materials') and 'var_inv' in item:
+                            new_inv[item['var_id']] = item['var_inv']
+                        fields = tuple(field for field in spec['update'] if field in item)
+                        groups.setdefault(fields, []).append(tuple(item[field] for field in fields) + keys[index])
+                        results.append({"index": index, "status": "updated", **dict(zip(key, keys[index]))})
+                    for fields, rows in groups.items():
+                        cursor.executemany(
+                            f"UPDATE frostedfabrics.{table} SET {', '.join(f'{field} = %s' for field in fields)} WHERE {' AND '.join(f'{field} = %s' for field in key)}",
+                            rows
+                        )
+
+                    log_changes(cursor, table, 'update', sorted({k for k in keys if k in existing}))
+                    touched = [table]
+                    stock_levels = {}
+                    for var_id in sorted(new_inv):
+                        if new_inv[var_id] > current_inv[var_id]:
+                            shortages, max_quantity, levels = consume_variation_materials(conn, var_id, new_inv[var_id] - current_inv[var_id])
+                            if shortages:
+                                conn.rollback()
+                                return insufficient_inventory_response(shortages, max_quantity, var_id=var_id)
+                            stock_levels.update(levels)
+                            touched.append('materials')
+                    log_changes(cursor, 'materials', 'update', [(mat_id,) for mat_id in sorted(stock_levels)])
+
+                    bump_table_versions(cursor, touched)
+                    conn.commit()
+                    low_stock_index.apply(stock_levels)
+                except Exception as e:
+                    conn.rollback()
+                    raise e
+            return results
+
+        results = db_policy.run(update, idempotent=False, log=logger.error)
+        if isinstance(results, flask.Response):
+            return results
+
+        if table in DIMENSION_TABLES:
+            dimension_cache.invalidate()
+        if table == 'materials':
+            low_stock_index.refresh(sorted({result[key[0]] for result in results if result['status'] == 'updated'}))
+
+        results.sort(key=lambda result: result['index'])
+        return make_response(jsonify({"results": results}), 200)
+
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
+    except Exception as e:
+        logger.error(f"Error in bulkUpdate ({resource}): {str(e)}")
+        return make_response(jsonify({"error": "Internal Server Error", "details": str(e)}), 500)
+
+# ============== BACKGROUND TASKS ============
+# The threads below are started by whatever is about to serve requests from
+# this process (gunicorn.conf.py's post_worker_init, asgi_app.py's lifespan
+# startup and __main__ below), never on import: the gunicorn master, the
+# debug reloader's watcher process and scripts or tests that import main
+# run none of them.
+background_tasks_lock = threading.Lock()
+background_tasks_started = False
+
+def start_background_tasks():
+    """Start the JSON log writer, the index builds and syncs, replica lag
+    checks, the event broker client and change log pruning. Later calls do
+    nothing."""
+    global background_tasks_started
+    with background_tasks_lock:
+        if background_tasks_started:
+            return
+        background_tasks_started = True
+    logpipeline.configure()
+    low_stock_index.start()
+    search_sync.start()
+    replica_set.start()
+    event_hub.start()
+    threading.Thread(target=prune_change_log_periodically, name="change-log-prune", daemon=True).start()
+
 if __name__ == '__main__':
-    app.run(threaded=True)
+    # With the reloader (DEBUG), this process only watches the files and
+    # restarts the one that serves
+    if not app.debug or is_running_from_reloader():
+        start_background_tasks()
+    app.run(host=os.getenv('BIND_HOST', '127.0.0.1'), port=5000, threaded=True)
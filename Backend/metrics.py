@@ -0,0 +1,180 @@
+"""Request metrics exported at /metrics in the Prometheus text format.
+
+Each request's wall time is split into phases: waiting for a pooled
+connection, executing statements and fetching rows, JSON serialization, and
+everything else in Python (mostly shaping rows into response dicts).
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty, writable directory
+before the workers start (gunicorn.conf.py does this) so every worker writes
+its samples there and /metrics reports the sum across workers.
+"""
+
+import os
+import threading
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    generate_latest, multiprocess
+)
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+PHASES = ('pool_wait', 'db_execute', 'row_shaping', 'serialization')
+
+REQUEST_COUNT = Counter(
+    'http_requests_total', 'HTTP requests handled',
+    ['route', 'method', 'status']
+)
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time from request start until the response body was sent',
+    ['route', 'method'], buckets=LATENCY_BUCKETS
+)
+PHASE_LATENCY = Histogram(
+    'http_request_phase_duration_seconds', 'Time spent in each phase of a request',
+    ['route', 'method', 'phase'], buckets=LATENCY_BUCKETS
+)
+
+# Pool gauges are summed over live workers in multiprocess mode. Every pool
+# metric is labelled with the pool: 'primary' or the host of a read replica
+POOL_IN_USE = Gauge('db_pool_connections_in_use', 'Connections checked out of the pool', ['pool'], multiprocess_mode='livesum')
+POOL_IDLE = Gauge('db_pool_connections_idle', 'Open connections waiting in the pool', ['pool'], multiprocess_mode='livesum')
+POOL_WAITERS = Gauge('db_pool_waiters', 'Threads waiting for a connection', ['pool'], multiprocess_mode='livesum')
+POOL_WAIT = Histogram('db_pool_wait_seconds', 'Time spent waiting to check out a connection', ['pool'], buckets=LATENCY_BUCKETS)
+POOL_SHED = Counter('db_pool_shed_total', 'Checkouts refused because the wait queue was full or timed out', ['pool'])
+STATEMENT_CACHE = Counter('db_statement_cache_total', 'Prepared statement cache lookups', ['result'])
+
+DB_RETRIES = Counter('db_retries_total', 'Database calls retried, by kind of transient error', ['reason'])
+DB_RETRY_BUDGET_EXHAUSTED = Counter('db_retry_budget_exhausted_total', 'Retries skipped because the retry budget was spent')
+BREAKER_STATE = Gauge('db_circuit_breaker_state', 'Database circuit breaker state (0 closed, 1 half-open, 2 open)', multiprocess_mode='livemax')
+BREAKER_OPENED = Counter('db_circuit_breaker_opened_total', 'Times the database circuit breaker opened')
+
+REPLICA_LAG = Gauge('db_replica_lag_seconds', 'Replication lag of each read replica (-1 while unknown or broken)',
+                    ['replica'], multiprocess_mode='livemax')
+DB_COALESCED = Counter('db_coalesced_reads_total', 'Reads that shared an identical SELECT already running instead of running their own',
+                       ['kind'])
+DB_READS = Counter('db_reads_total', 'Connections checked out for reads, by where they were routed', ['target'])
+
+RESPONSE_CACHE = Counter('http_response_cache_total', 'Response cache lookups (hit, shared_hit or miss)', ['result'])
+RESPONSE_CACHE_BYTES = Gauge('http_response_cache_bytes', 'Size of the bodies held in the response cache', multiprocess_mode='livesum')
+RESPONSE_CACHE_EVICTIONS = Counter('http_response_cache_evictions_total', 'Response cache entries dropped, by reason (size or write)', ['reason'])
+
+EVENT_SUBSCRIBERS = Gauge('event_subscribers', 'Open /api/events streams', multiprocess_mode='livesum')
+EVENTS_PUBLISHED = Counter('events_published_total', 'Change events published by this server, by topic', ['topic'])
+EVENTS_DROPPED = Counter('events_dropped_total', 'Times a subscriber fell behind and was sent resync instead of its events')
+
+SEARCH_INDEX_DOCUMENTS = Gauge('search_index_documents', 'Documents in the /api/search index', multiprocess_mode='livemax')
+
+LOG_RECORDS_DROPPED = Counter('log_records_dropped_total', 'Log records dropped because the log queue was full')
+
+_local = threading.local()
+
+
+def start_request():
+    """Start timing the current thread's request."""
+    _local.started_at = time.perf_counter()
+    _local.phases = dict.fromkeys(PHASES, 0.0)
+
+
+def add_phase(phase, seconds):
+    phases = getattr(_local, 'phases', None)
+    if phases is not None:
+        phases[phase] += seconds
+
+
+def finish_request(route, method, status):
+    """Record the request started by start_request. row_shaping is whatever
+    wall time the other phases do not account for."""
+    phases = getattr(_local, 'phases', None)
+    if phases is None:
+        return
+    total = time.perf_counter() - _local.started_at
+    _local.phases = None
+    phases['row_shaping'] = max(0.0, total - phases['pool_wait'] - phases['db_execute'] - phases['serialization'])
+
+    REQUEST_COUNT.labels(route, method, str(status)).inc()
+    REQUEST_LATENCY.labels(route, method).observe(total)
+    for phase, seconds in phases.items():
+        PHASE_LATENCY.labels(route, method, phase).observe(seconds)
+
+
+class timed:
+    """Context manager adding its elapsed time to a phase."""
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_phase(self.phase, time.perf_counter() - self.started_at)
+        return False
+
+
+class TimedCursor:
+    """Cursor proxy that counts execute and fetch calls as db_execute time."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed_call(self, name, *args, **kwargs):
+        with timed('db_execute'):
+            return getattr(self._cursor, name)(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        return self._timed_call('execute', *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._timed_call('executemany', *args, **kwargs)
+
+    def fetchone(self):
+        return self._timed_call('fetchone')
+
+    def fetchmany(self, *args, **kwargs):
+        return self._timed_call('fetchmany', *args, **kwargs)
+
+    def fetchall(self):
+        return self._timed_call('fetchall')
+
+
+class TimedConnection:
+    """Pooled connection proxy handing out TimedCursors. Commits and
+    rollbacks are round trips too, so they count as db_execute."""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._connection.cursor(*args, **kwargs))
+
+    def commit(self):
+        with timed('db_execute'):
+            return self._connection.commit()
+
+    def rollback(self):
+        with timed('db_execute'):
+            return self._connection.rollback()
+
+    def consume_results(self):
+        with timed('db_execute'):
+            return self._connection.consume_results()
+
+
+def render():
+    """Return (body, content_type) for the /metrics endpoint."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,19 @@
+-- Per-table change counters used for ETags / conditional GETs.
+-- The write handlers in main.py bump the row for every table they modify
+-- inside the same transaction as the change itself.
+CREATE TABLE IF NOT EXISTS frostedfabrics.table_versions (
+    table_name VARCHAR(64) NOT NULL PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0
+);
+
+INSERT IGNORE INTO frostedfabrics.table_versions (table_name, version) VALUES
+    ('calendar_categories', 0),
+    ('calendar_events', 0),
+    ('material_brands', 0),
+    ('material_categories', 0),
+    ('material_measurements', 0),
+    ('materials', 0),
+    ('product_categories', 0),
+    ('product_variations', 0),
+    ('products', 0),
+    ('variation_materials', 0);
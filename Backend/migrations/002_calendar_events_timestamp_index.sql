@@ -0,0 +1,9 @@
+-- Month/week calendar views filter calendar_events by a timestamp range
+-- (optionally per category) and page through it ordered by
+-- (event_timestamp, event_id). These indexes turn both into range scans
+-- whose cost depends on the window, not on the size of the history.
+CREATE INDEX idx_calendar_events_timestamp
+    ON frostedfabrics.calendar_events (event_timestamp, event_id);
+
+CREATE INDEX idx_calendar_events_category_timestamp
+    ON frostedfabrics.calendar_events (cc_id, event_timestamp);
@@ -0,0 +1,13 @@
+-- Append-only log of the rows the write handlers insert, update or delete,
+-- read by GET /api/changes. main.py writes the entries inside the same
+-- transaction as the change itself; row_key holds the row's key columns,
+-- e.g. {"var_id": 3, "mat_id": 12}. Entries older than
+-- CHANGE_LOG_RETENTION_DAYS are pruned by the server.
+CREATE TABLE IF NOT EXISTS frostedfabrics.change_log (
+    change_id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    table_name VARCHAR(64) NOT NULL,
+    op VARCHAR(6) NOT NULL,
+    row_key JSON NOT NULL,
+    changed_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    KEY idx_change_log_changed_at (changed_at)
+);
@@ -0,0 +1,243 @@
+"""A MySQL connection pool with a bounded, timed wait queue.
+
+mysql.connector's MySQLConnectionPool raises PoolError as soon as every
+connection is checked out, and it pings (and optionally resets) each
+connection on every checkout. This pool instead lets up to max_waiters
+threads wait up to wait_timeout seconds for a connection and raises
+PoolExhausted beyond that, so callers can shed load instead of sleeping and
+retrying. Idle connections are only pinged once they have sat unused for
+health_check_after seconds.
+
+Each pooled connection also keeps a StatementCache of server-side prepared
+statements, so the hot queries are parsed once per connection rather than
+once per request.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+import mysql.connector
+from mysql.connector import errorcode
+from mysql.connector.cursor import MySQLCursorPrepared
+
+try:
+    from mysql.connector.cursor_cext import CMySQLCursorPrepared
+except ImportError:  # connector installed without its C extension
+    CMySQLCursorPrepared = None
+
+import metrics
+
+
+class PoolExhausted(Exception):
+    """No connection became free in time, or too many threads were already
+    waiting for one. retry_after is a hint in seconds for the client."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class StatementCache:
+    """Server-side prepared statements of one connection, keyed by SQL text.
+
+    Prepared statements belong to the MySQL session, so the cache is dropped
+    whenever the connection has reconnected (its connection_id changed) and
+    when the server reports that it no longer knows a statement. With
+    max_size 0 statements run as plain text queries."""
+
+    def __init__(self, connection, max_size):
+        self._connection = connection
+        self.max_size = max_size
+        self._cursors = OrderedDict()  # sql -> prepared cursor, least recently used first
+        self._connection_id = connection.connection_id
+
+    def execute(self, sql, params=None):
+        """Execute sql as a prepared statement and return its cursor. Rows
+        come back as dicts."""
+        if not self.max_size:
+            cursor = self._connection.cursor(dictionary=True)
+            cursor.execute(sql, params)
+            return cursor
+        if self._connection.connection_id != self._connection_id:
+            self.clear()
+        try:
+            return self._execute(sql, params)
+        except mysql.connector.Error as err:
+            if err.errno != errorcode.ER_UNKNOWN_STMT_HANDLER:
+                raise
+            self.clear()
+            return self._execute(sql, params)
+
+    def _execute(self, sql, params):
+        cursor = self._cursors.get(sql)
+        if cursor is None:
+            metrics.STATEMENT_CACHE.labels('miss').inc()
+            cursor = self._connection.cursor(prepared=True, dictionary=True)
+            self._cursors[sql] = cursor
+            if len(self._cursors) > self.max_size:
+                _, evicted = self._cursors.popitem(last=False)
+                self._close_cursor(evicted)
+            try:
+                cursor.execute(sql, params)
+            except mysql.connector.Error:
+                # Don't keep a cursor whose statement never got prepared
+                self._cursors.pop(sql, None)
+                self._close_cursor(cursor)
+                raise
+        else:
+            metrics.STATEMENT_CACHE.labels('hit').inc()
+            self._cursors.move_to_end(sql)
+            execute_prepared(self._connection, cursor, sql, params)
+        return cursor
+
+    def clear(self):
+        for cursor in self._cursors.values():
+            self._close_cursor(cursor)
+        self._cursors.clear()
+        self._connection_id = self._connection.connection_id
+
+    def _close_cursor(self, cursor):
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            pass
+
+
+def execute_prepared(connection, cursor, sql, params):
+    """Run the statement cursor already prepared again.
+
+    The prepared cursors' own execute() sends COM_STMT_RESET before every
+    COM_STMT_EXECUTE, so a cached statement would cost two round trips where a
+    text query costs one. Only unbuffered execution without long data is used
+    here, which leaves nothing for a reset to clear, so it is skipped. Cursors
+    that are not mysql.connector prepared cursors just execute sql."""
+    params = tuple(params or ())
+    if isinstance(cursor, MySQLCursorPrepared):
+        prepared = cursor._prepared
+        result = connection.cmd_stmt_execute(prepared['statement_id'], data=params, parameters=prepared['parameters'])
+        cursor._handle_result(result)
+    elif CMySQLCursorPrepared is not None and isinstance(cursor, CMySQLCursorPrepared):
+        connection.handle_unread_result(prepared=True)
+        result = connection.cmd_stmt_execute(cursor._stmt, *params)
+        if result:
+            cursor._handle_result(result)
+    else:
+        cursor.execute(sql, params)
+
+
+class PooledConnection:
+    """A checked-out connection. close() hands it back to the pool."""
+
+    def __init__(self, pool, connection, statements):
+        self._pool = pool
+        self._connection = connection
+        self.statements = statements
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        self._pool.release(connection, self.statements)
+
+
+class ConnectionPool:
+    def __init__(self, name, size, max_waiters, wait_timeout, health_check_after, statement_cache_size, **connect_args):
+        self.name = name
+        self.size = size
+        self.statement_cache_size = statement_cache_size
+        self.max_waiters = max_waiters
+        self.wait_timeout = wait_timeout
+        self.health_check_after = health_check_after
+        self._connect_args = connect_args
+        self._condition = threading.Condition()
+        self._idle = deque()  # (connection, statements, released_at), most recently used on the right
+        self._opened = 0
+        self._waiters = 0
+        # Pool metrics are labelled with the pool name ('primary' or a replica host)
+        self._in_use = metrics.POOL_IN_USE.labels(name)
+        self._idle_gauge = metrics.POOL_IDLE.labels(name)
+        self._waiters_gauge = metrics.POOL_WAITERS.labels(name)
+        self._wait = metrics.POOL_WAIT.labels(name)
+        self._shed = metrics.POOL_SHED.labels(name)
+
+    def get_connection(self):
+        started_at = time.monotonic()
+        try:
+            connection, statements, released_at = self._checkout(started_at)
+        finally:
+            self._wait.observe(time.monotonic() - started_at)
+
+        if connection is None:
+            try:
+                connection = mysql.connector.connect(**self._connect_args)
+                statements = StatementCache(connection, self.statement_cache_size)
+            except Exception:
+                self._forget()
+                raise
+        elif time.monotonic() - released_at >= self.health_check_after:
+            # A reconnect starts a new session; StatementCache notices the
+            # new connection_id and prepares its statements again
+            try:
+                connection.ping(reconnect=True, attempts=1)
+            except mysql.connector.Error:
+                self._discard(connection)
+                raise
+        return PooledConnection(self, connection, statements)
+
+    def _checkout(self, started_at):
+        """Return an idle (connection, statements, released_at), or
+        (None, None, None) once a slot for a new connection has been
+        reserved."""
+        with self._condition:
+            if not self._idle and self._opened >= self.size and self._waiters >= self.max_waiters:
+                self._shed.inc()
+                raise PoolExhausted("Too many requests are waiting for a database connection", self.wait_timeout)
+            self._waiters += 1
+            self._waiters_gauge.inc()
+            try:
+                while not self._idle and self._opened >= self.size:
+                    remaining = self.wait_timeout - (time.monotonic() - started_at)
+                    if remaining <= 0:
+                        self._shed.inc()
+                        raise PoolExhausted("Timed out waiting for a database connection", self.wait_timeout)
+                    self._condition.wait(remaining)
+            finally:
+                self._waiters -= 1
+                self._waiters_gauge.dec()
+
+            self._in_use.inc()
+            if self._idle:
+                self._idle_gauge.dec()
+                return self._idle.pop()
+            self._opened += 1
+            return None, None, None
+
+    def release(self, connection, statements):
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except mysql.connector.Error:
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, statements, time.monotonic()))
+            self._in_use.dec()
+            self._idle_gauge.inc()
+            self._condition.notify()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except mysql.connector.Error:
+            pass
+        self._forget()
+
+    def _forget(self):
+        with self._condition:
+            self._opened -= 1
+            self._in_use.dec()
+            self._condition.notify()
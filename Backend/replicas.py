@@ -0,0 +1,187 @@
+"""Read replicas for read/write splitting.
+
+Reads may run on any replica listed in creds.Creds.replicaHosts. Writes,
+and every read made while handling a write, go to the primary. A background
+thread measures each replica's lag with SHOW REPLICA STATUS (the account
+needs the REPLICATION CLIENT privilege). Replicas that lag more than max_lag,
+or that could not be reached, are taken out of rotation until a later check
+succeeds. With no healthy replica, reads fall back to the primary.
+
+Read-your-writes comes from PrimaryPins: after a client writes, its reads go
+to the primary for `window` seconds, which should be longer than max_lag.
+Under gunicorn the pins are files in a shared directory, so every worker
+honours a pin set by another.
+"""
+
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import errorcode
+
+import metrics
+import resilience
+
+logger = logging.getLogger(__name__)
+
+# SHOW REPLICA STATUS needs MySQL 8.0.22+; older servers only know the old name
+REPLICA_STATUS_QUERIES = (
+    ("SHOW REPLICA STATUS", 'Seconds_Behind_Source'),
+    ("SHOW SLAVE STATUS", 'Seconds_Behind_Master'),
+)
+
+PIN_SWEEP_INTERVAL = 60  # seconds between deletions of expired pin files
+
+
+class Replica:
+    def __init__(self, host, pool):
+        self.host = host
+        self.pool = pool
+        self.lag = None  # seconds; None until measured, or while replication is broken
+        self.healthy = False
+
+
+class ReplicaSet:
+    def __init__(self, replicas, max_lag, check_interval):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._turns = itertools.count()
+        self._thread = None
+        for replica in replicas:
+            metrics.REPLICA_LAG.labels(replica.host).set(-1)
+
+    def choose(self):
+        """Return the next healthy replica in round-robin order, or None."""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._turns) % len(healthy)]
+
+    def report_error(self, replica, err):
+        """Take replica out of rotation if err means it is unreachable."""
+        if not resilience.is_connection_error(err):
+            return
+        # A replica outage must not trip the primary's circuit breaker
+        err.breaker_recorded = True
+        self.mark_down(replica)
+
+    def mark_down(self, replica):
+        if replica.healthy:
+            logger.warning(f"Read replica {replica.host} is unreachable, reading from the other databases")
+        replica.healthy = False
+
+    def _measure_lag(self, replica):
+        connection = replica.pool.get_connection()
+        try:
+            cursor = connection.cursor(dictionary=True)
+            for query, column in REPLICA_STATUS_QUERIES:
+                try:
+                    cursor.execute(query)
+                except mysql.connector.Error as err:
+                    if err.errno == errorcode.ER_PARSE_ERROR:
+                        continue
+                    raise
+                rows = cursor.fetchall()
+                cursor.close()
+                # No rows: the server replicates from nothing, so it is not behind
+                lags = [row[column] for row in rows]
+                return None if None in lags else max(lags, default=0)
+            raise RuntimeError("The server supports neither SHOW REPLICA STATUS nor SHOW SLAVE STATUS")
+        finally:
+            connection.close()
+
+    def check(self, replica):
+        try:
+            lag = self._measure_lag(replica)
+        except Exception as e:
+            logger.error(f"Could not read the replication status of {replica.host}: {str(e)}")
+            lag = None
+        if lag is None and replica.healthy:
+            logger.warning(f"Read replica {replica.host} is not replicating, reading from the other databases")
+        replica.lag = lag
+        replica.healthy = lag is not None and lag <= self.max_lag
+        metrics.REPLICA_LAG.labels(replica.host).set(-1 if lag is None else lag)
+
+    def _run(self):
+        while True:
+            for replica in self.replicas:
+                self.check(replica)
+            time.sleep(self.check_interval)
+
+    def start(self):
+        """Start checking lag in the background. Replicas stay out of
+        rotation until their first check."""
+        if not self.replicas or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="replica-lag", daemon=True)
+        self._thread.start()
+
+
+class PrimaryPins:
+    """Clients that wrote in the last `window` seconds. Pins are kept in
+    memory and, when shared_dir is set, as files whose mtime is the time the
+    pin expires, so other processes see them too."""
+
+    def __init__(self, window, shared_dir=None):
+        self.window = window
+        self.shared_dir = shared_dir
+        self._lock = threading.Lock()
+        self._until = {}  # client -> time.time() at which the pin expires
+        self._swept_at = time.monotonic()
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    def _path(self, client):
+        return os.path.join(self.shared_dir, hashlib.sha1(client.encode()).hexdigest())
+
+    def pin(self, client):
+        until = time.time() + self.window
+        with self._lock:
+            if len(self._until) > 10000:
+                now = time.time()
+                self._until = {c: t for c, t in self._until.items() if t > now}
+            self._until[client] = until
+        if self.shared_dir:
+            path = self._path(client)
+            try:
+                with open(path, 'a'):
+                    pass
+                os.utime(path, (until, until))
+            except OSError as e:
+                logger.error(f"Could not record the primary pin for a client: {str(e)}")
+            if time.monotonic() - self._swept_at >= PIN_SWEEP_INTERVAL:
+                self._swept_at = time.monotonic()
+                self.sweep()
+
+    def sweep(self):
+        """Delete the pin files that have expired, one per client that ever
+        wrote otherwise. A client pinned again by another process between
+        the stat and the unlink loses that pin in the other processes, but
+        keeps it in the one that pinned it."""
+        now = time.time()
+        try:
+            with os.scandir(self.shared_dir) as entries:
+                for file in entries:
+                    try:
+                        if file.stat().st_mtime <= now:
+                            os.unlink(file.path)
+                    except OSError:
+                        pass
+        except OSError as e:
+            logger.error(f"Could not sweep expired primary pins: {str(e)}")
+
+    def is_pinned(self, client):
+        now = time.time()
+        if self._until.get(client, 0) > now:
+            return True
+        if not self.shared_dir:
+            return False
+        try:
+            return os.stat(self._path(client)).st_mtime > now
+        except OSError:
+            return False
@@ -0,0 +1,177 @@
+"""Retry and circuit-breaker policy shared by every database call.
+
+Only errors that are known to be transient are retried:
+
+* connection errors (server gone, lost connection, cannot connect), and
+* lock contention (deadlock, lock wait timeout), where InnoDB has rolled the
+  statement or transaction back.
+
+A write that lost its connection may already have committed, so writes only
+retry lock contention and failures to connect. Retries back off
+exponentially with full jitter and draw on a per-process budget, so a
+database blip does not turn every request into several. Connection errors
+also feed a circuit breaker. After enough of them in a row, calls fail fast
+with CircuitOpen until a cooldown has passed and a probe succeeds.
+"""
+
+import random
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import errorcode
+
+import metrics
+
+CONNECT_ERRORS = frozenset([
+    errorcode.CR_CONNECTION_ERROR,
+    errorcode.CR_CONN_HOST_ERROR,
+])
+CONNECTION_ERRORS = CONNECT_ERRORS | frozenset([
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.CR_SERVER_LOST_EXTENDED,
+])
+CONTENTION_ERRORS = frozenset([
+    errorcode.ER_LOCK_DEADLOCK,
+    errorcode.ER_LOCK_WAIT_TIMEOUT,
+])
+
+
+def is_connection_error(err):
+    return isinstance(err, mysql.connector.Error) and err.errno in CONNECTION_ERRORS
+
+
+def retry_reason(err, idempotent):
+    """Why err may be retried ('connection' or 'contention'), or None."""
+    if not isinstance(err, mysql.connector.Error):
+        return None
+    if err.errno in CONTENTION_ERRORS:
+        return 'contention'
+    if err.errno in (CONNECTION_ERRORS if idempotent else CONNECT_ERRORS):
+        return 'connection'
+    return None
+
+
+class CircuitOpen(Exception):
+    """The database is considered down. retry_after is the remaining
+    cooldown in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__("Database unavailable, circuit breaker is open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, failure_threshold, cooldown):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        metrics.BREAKER_STATE.set(self.CLOSED)
+
+    @property
+    def state(self):
+        return self._state
+
+    def before_call(self):
+        """Raise CircuitOpen if calls are being short-circuited. Returns True
+        when the caller is the probe that decides whether to close again."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return False
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._probing:
+                raise CircuitOpen(max(remaining, 0) or self.cooldown)
+            self._set_state(self.HALF_OPEN)
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state == self.HALF_OPEN:
+                self._probing = False
+                self._set_state(self.CLOSED)
+
+    def record_error(self, err):
+        """Count err against the breaker if it means the database is
+        unreachable. Each exception is only counted once, however many
+        layers see it."""
+        if is_connection_error(err) and not getattr(err, 'breaker_recorded', False):
+            err.breaker_recorded = True
+            self.record_failure()
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    metrics.BREAKER_OPENED.inc()
+                self._set_state(self.OPEN)
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def _set_state(self, state):
+        self._state = state
+        metrics.BREAKER_STATE.set(state)
+
+
+class RetryBudget:
+    """Token bucket: every successful call deposits `ratio` tokens (up to
+    max_tokens) and every retry spends one, so retries stay a bounded
+    fraction of traffic."""
+
+    def __init__(self, ratio, max_tokens):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    def __init__(self, breaker, budget, max_attempts, base_delay, max_delay):
+        self.breaker = breaker
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def run(self, operation, idempotent=True, log=None):
+        """Call operation() until it succeeds or fails with an error that
+        may not be retried."""
+        for attempt in range(self.max_attempts):
+            try:
+                result = operation()
+            except mysql.connector.Error as err:
+                self.breaker.record_error(err)
+                reason = retry_reason(err, idempotent)
+                if reason is None or attempt == self.max_attempts - 1:
+                    raise
+                if not self.budget.withdraw():
+                    metrics.DB_RETRY_BUDGET_EXHAUSTED.inc()
+                    raise
+                metrics.DB_RETRIES.labels(reason).inc()
+                if log is not None:
+                    log(f"Database error on attempt {attempt + 1}, retrying: {err}")
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+                continue
+            self.breaker.record_success()
+            self.budget.deposit()
+            return result
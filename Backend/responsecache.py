@@ -0,0 +1,217 @@
+"""Cache of encoded GET responses, keyed by route and query parameters.
+
+Each entry remembers the versions of the tables it was built from (see
+TABLE VERSIONS in main.py) and is only served while those versions are
+current, so an entry can never outlive a write, whichever worker made it.
+Writes also evict the entries that read the tables they touch, which frees
+the memory straight away. The cache is bounded by the total size of the
+bodies it holds and drops the least recently used entries first.
+
+With a shared directory, entries are also written there as files named by a
+hash of the key and the table versions, so a response built by one worker is
+served by the others. A write anywhere makes the old files unreachable, and
+the least recently used files are deleted once the directory outgrows its
+size limit.
+
+Compressed bodies are kept in memory next to the entry they were made from,
+so each encoding is compressed once per entry rather than on every hit.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SHARED_TRIM_INTERVAL = 10  # seconds between size checks of the shared directory
+
+
+def cache_key(path, args, ndjson=False):
+    """path plus the query parameters in sorted order, so the order the
+    client listed them in does not matter."""
+    query = urlencode(sorted(args.items(multi=True)))
+    return f"{path}?{query}{' ndjson' if ndjson else ''}"
+
+
+class Entry:
+    def __init__(self, body, content_type, headers=(), versions=None):
+        self.body = body
+        self.content_type = content_type
+        self.headers = list(headers)  # (name, value) pairs to send with the body
+        self.versions = versions or {}
+        self.encoded = {}  # content coding -> body compressed with it
+        self.key = None
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(body) for body in self.encoded.values())
+
+
+class SharedDirectory:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._trimmed_at = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key, versions):
+        name = hashlib.sha1(json.dumps([key, sorted(versions.items())]).encode()).hexdigest()
+        return os.path.join(self.path, name)
+
+    def get(self, key, versions):
+        path = self._file(key, versions)
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                body = f.read()
+            # The mtime is the last use, for trimming
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return Entry(body, header['content_type'], [tuple(h) for h in header['headers']], versions)
+
+    def put(self, key, entry):
+        path = self._file(key, entry.versions)
+        header = json.dumps({'content_type': entry.content_type, 'headers': entry.headers}).encode()
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(header + b'\n')
+                f.write(entry.body)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"Could not write a shared response cache entry: {str(e)}")
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return
+        if time.monotonic() - self._trimmed_at >= SHARED_TRIM_INTERVAL:
+            self._trimmed_at = time.monotonic()
+            self.trim()
+
+    def trim(self):
+        """Delete the least recently used files until the directory fits
+        in max_bytes."""
+        files = []
+        total = 0
+        with os.scandir(self.path) as entries:
+            for file in entries:
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file.path))
+                total += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class ResponseCache:
+    def __init__(self, max_bytes, shared=None):
+        self.max_bytes = max_bytes
+        # Larger bodies would push out too much of the rest
+        self.max_entry_bytes = max_bytes // 4
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> Entry, least recently used first
+        self._keys_by_table = {}  # table -> keys of the entries that read it
+        self._bytes = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key, versions):
+        """The entry for key if it was built from exactly these table
+        versions, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.versions == versions:
+                self._entries.move_to_end(key)
+                metrics.RESPONSE_CACHE.labels('hit').inc()
+                return entry
+        if self.shared is not None:
+            entry = self.shared.get(key, versions)
+            if entry is not None:
+                metrics.RESPONSE_CACHE.labels('shared_hit').inc()
+                self._add(key, entry)
+                return entry
+        metrics.RESPONSE_CACHE.labels('miss').inc()
+        return None
+
+    def put(self, key, entry):
+        if entry.size > self.max_entry_bytes:
+            return
+        self._add(key, entry)
+        if self.shared is not None:
+            self.shared.put(key, entry)
+
+    def encoded(self, entry, encoding, encode):
+        """entry's body in the given content coding, made with
+        encode(body, encoding) the first time it is asked for."""
+        body = entry.encoded.get(encoding)
+        if body is not None:
+            return body
+        body = encode(entry.body, encoding)
+        with self._lock:
+            if encoding not in entry.encoded:
+                entry.encoded[encoding] = body
+                if self._entries.get(entry.key) is entry:
+                    self._bytes += len(body)
+                    self._trim()
+        return body
+
+    def _add(self, key, entry):
+        with self._lock:
+            self._remove(key)
+            entry.key = key
+            self._entries[key] = entry
+            self._bytes += entry.size
+            for table in entry.versions:
+                self._keys_by_table.setdefault(table, set()).add(key)
+            self._trim()
+
+    def _trim(self):
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            metrics.RESPONSE_CACHE_EVICTIONS.labels('size').inc()
+        metrics.RESPONSE_CACHE_BYTES.set(self._bytes)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for table in entry.versions:
+            keys = self._keys_by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_table[table]
+
+    def evict(self, tables):
+        """Drop every entry that read any of tables."""
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys.update(self._keys_by_table.get(table, ()))
+            for key in keys:
+                self._remove(key)
+            if keys:
+                metrics.RESPONSE_CACHE_EVICTIONS.labels('write').inc(len(keys))
+                metrics.RESPONSE_CACHE_BYTES.set(self._bytes)
@@ -0,0 +1,234 @@
+"""In-memory typeahead index over catalog names and SKUs.
+
+A document is one searchable row, identified by (kind, id), with a name and
+optionally a SKU. Four structures point at the documents:
+
+- names: a sorted list of (name, serial, doc), serial being unique per
+  document. The names starting with a prefix are one contiguous run, found
+  by bisect.
+- words: the same for every word of every name and SKU, so "twi" finds
+  "Cotton Twill".
+- trigrams: three-character substring -> docs whose words contain it, for
+  queries that match inside a word ("twil" in "Cotton Twill" is a prefix,
+  "otto" is not).
+- skus: the normalised SKU -> docs, for exact SKU lookups.
+
+Results are ranked by how the query matched (exact SKU, exact name, name
+prefix, word prefixes, substring), then by shorter name. Each kind of match
+is only looked for while the better ones found fewer than `limit` results,
+and only the first max_candidates entries of a run or set are looked at, so
+a one-letter query against 100,000 documents costs the same as a rare one.
+Within a rank, "shorter first" is therefore among those candidates.
+
+The index holds no database code; main.py loads it and feeds it the rows
+the change log says were written.
+"""
+
+import bisect
+import itertools
+import re
+import threading
+
+# Updates of more documents than this rebuild the sorted lists in one pass
+BULK_UPDATE_SIZE = 50
+
+# Ranks, best first, and how each is reported
+EXACT_SKU, EXACT_NAME, NAME_PREFIX, WORD_PREFIX, SUBSTRING = range(5)
+MATCHES = ('sku', 'name', 'name_prefix', 'word_prefix', 'substring')
+
+WORD = re.compile(r'[^\W_]+')
+
+
+def normalise(text):
+    return ' '.join(WORD.findall(text.casefold())) if text else ''
+
+
+def normalise_sku(sku):
+    return sku.strip().casefold() if sku else ''
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+_serials = itertools.count()
+
+
+class Document:
+    def __init__(self, kind, id, name, sku=None, fields=None):
+        # Orders the word entries of documents sharing a word
+        self.serial = next(_serials)
+        self.kind = kind
+        self.id = id
+        self.name = name or ''
+        self.sku = sku
+        self.fields = fields or {}  # extra columns returned with a match
+        self.text = normalise(self.name)
+        self.words = sorted(set(self.text.split()) | set(normalise(sku).split()))
+        # " word word ...": " " + term in it means a word starts with term
+        self.haystack = ' ' + ' '.join(self.words)
+
+    @property
+    def key(self):
+        return self.kind, self.id
+
+
+class SearchIndex:
+    def __init__(self, max_candidates=200):
+        self.max_candidates = max_candidates
+        self._lock = threading.Lock()
+        self._docs = {}  # (kind, id) -> Document
+        self._names = []  # sorted (normalised name, serial, Document)
+        self._words = []  # sorted (word, serial, Document)
+        self._trigrams = {}  # trigram -> set of Documents
+        self._skus = {}  # normalised SKU -> set of Documents
+
+    def __len__(self):
+        return len(self._docs)
+
+    def get(self, kind, id):
+        return self._docs.get((kind, id))
+
+    def replace(self, documents):
+        """Swap in a new index of documents, built without holding the lock."""
+        docs = {doc.key: doc for doc in documents}
+        names = sorted((doc.text, doc.serial, doc) for doc in docs.values())
+        words = sorted((word, doc.serial, doc) for doc in docs.values() for word in doc.words)
+        trigram_docs = {}
+        skus = {}
+        for doc in docs.values():
+            for trigram in set().union(*map(trigrams, doc.words)):
+                trigram_docs.setdefault(trigram, set()).add(doc)
+            if doc.sku:
+                skus.setdefault(normalise_sku(doc.sku), set()).add(doc)
+        with self._lock:
+            self._docs, self._names, self._words, self._trigrams, self._skus = docs, names, words, trigram_docs, skus
+
+    def update(self, documents=(), removed=()):
+        """Add or replace documents and drop the (kind, id) keys in removed."""
+        with self._lock:
+            keys = [doc.key for doc in documents] + list(removed)
+            stale = [self._docs.pop(key) for key in keys if key in self._docs]
+            if len(stale) + len(documents) <= BULK_UPDATE_SIZE:
+                for doc in stale:
+                    self._delete_entries(doc)
+                for doc in documents:
+                    self._insert_entries(doc)
+            else:
+                # One pass over the sorted lists instead of an O(n) insert or
+                # delete per entry
+                serials = {doc.serial for doc in stale}
+                self._names = [entry for entry in self._names if entry[1] not in serials]
+                self._words = [entry for entry in self._words if entry[1] not in serials]
+                for doc in stale:
+                    self._unlink(doc)
+                self._names.extend((doc.text, doc.serial, doc) for doc in documents)
+                self._names.sort()
+                self._words.extend((word, doc.serial, doc) for doc in documents for word in doc.words)
+                self._words.sort()
+                for doc in documents:
+                    self._link(doc)
+            for doc in documents:
+                self._docs[doc.key] = doc
+
+    def _insert_entries(self, doc):
+        bisect.insort(self._names, (doc.text, doc.serial, doc))
+        for word in doc.words:
+            bisect.insort(self._words, (word, doc.serial, doc))
+        self._link(doc)
+
+    def _delete_entries(self, doc):
+        self._delete_entry(self._names, doc.text, doc)
+        for word in doc.words:
+            self._delete_entry(self._words, word, doc)
+        self._unlink(doc)
+
+    def _link(self, doc):
+        """Add doc to the trigram and SKU sets."""
+        for word in doc.words:
+            for trigram in trigrams(word):
+                self._trigrams.setdefault(trigram, set()).add(doc)
+        if doc.sku:
+            self._skus.setdefault(normalise_sku(doc.sku), set()).add(doc)
+
+    def _unlink(self, doc):
+        for word in doc.words:
+            for trigram in trigrams(word):
+                docs = self._trigrams.get(trigram)
+                if docs is not None:
+                    docs.discard(doc)
+                    if not docs:
+                        del self._trigrams[trigram]
+        if doc.sku:
+            sku = normalise_sku(doc.sku)
+            docs = self._skus.get(sku)
+            if docs is not None:
+                docs.discard(doc)
+                if not docs:
+                    del self._skus[sku]
+
+    @staticmethod
+    def _delete_entry(entries, text, doc):
+        index = bisect.bisect_left(entries, (text, doc.serial))
+        if index < len(entries) and entries[index][2] is doc:
+            del entries[index]
+
+    def search(self, query, kinds=None, limit=10):
+        """Up to limit (rank, Document) pairs for query, best first. kinds
+        restricts the results to those kinds of document."""
+        text = normalise(query)
+        terms = text.split()
+        if not terms:
+            return []
+        with self._lock:
+            ranked = {}
+
+            def consider(doc, rank):
+                if kinds is not None and doc.kind not in kinds:
+                    return
+                if rank < ranked.get(doc, SUBSTRING + 1):
+                    ranked[doc] = rank
+
+            for doc in self._skus.get(normalise_sku(query), ()):
+                consider(doc, EXACT_SKU)
+
+            for _, _, doc in self._candidates(self._names, text):
+                consider(doc, EXACT_NAME if doc.text == text else NAME_PREFIX)
+
+            if len(ranked) < limit:
+                # Every term must start a word of the document. Candidates
+                # come from the term with the fewest words starting with it.
+                runs = {term: self._prefix_run(self._words, term) for term in terms}
+                rarest = min(runs, key=lambda term: runs[term][1] - runs[term][0])
+                others = [' ' + term for term in terms if term != rarest]
+                for _, _, doc in self._candidates(self._words, rarest, runs[rarest]):
+                    if all(term in doc.haystack for term in others):
+                        consider(doc, WORD_PREFIX)
+
+            if len(ranked) < limit:
+                self._substring_matches(terms, consider)
+
+            best = sorted(ranked.items(), key=lambda item: (item[1], len(item[0].name), item[0].serial))
+        return [(rank, doc) for doc, rank in best[:limit]]
+
+    def _candidates(self, entries, prefix, run=None):
+        start, stop = run or self._prefix_run(entries, prefix)
+        return entries[start:min(stop, start + self.max_candidates)]
+
+    @staticmethod
+    def _prefix_run(entries, prefix):
+        start = bisect.bisect_left(entries, (prefix,))
+        # Everything starting with prefix sorts below prefix + U+10FFFF
+        stop = bisect.bisect_left(entries, (prefix + '\U0010ffff',), start)
+        return start, stop
+
+    def _substring_matches(self, terms, consider):
+        grams = [self._trigrams.get(trigram, ()) for term in terms for trigram in trigrams(term)]
+        if not grams:
+            # Terms shorter than three characters were only tried as prefixes
+            return
+        candidates = min(grams, key=len)
+        for doc in itertools.islice(candidates, self.max_candidates):
+            # Terms hold no spaces, so they cannot match across two words
+            if all(term in doc.haystack for term in terms):
+                consider(doc, SUBSTRING)
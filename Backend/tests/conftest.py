@@ -0,0 +1,33 @@
+"""Shared fixtures. Tests that need the app get `backend`, the main module
+running on a small SQLite stand-in database (see bench/standin.py) seeded
+once per session, so they run without a MySQL server."""
+
+import argparse
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'bench'))
+
+
+@pytest.fixture(scope='session')
+def backend(tmp_path_factory):
+    import seed
+    import standin
+
+    path = str(tmp_path_factory.mktemp('standin') / 'frostedfabrics.db')
+    seed.seed_standin(argparse.Namespace(
+        materials=400, variations=200, products=None, brands=None, material_categories=None,
+        product_categories=None, events=50, seed=4375, standin=path,
+    ))
+    standin.install(path)
+    import main
+    return main
+
+
+@pytest.fixture
+def client(backend):
+    return backend.app.test_client()
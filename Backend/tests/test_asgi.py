@@ -0,0 +1,47 @@
+import asyncio
+
+import httpx
+import pytest
+
+
+@pytest.fixture
+def asgi_app(backend):
+    import asgi_app
+    return asgi_app
+
+
+def get(asgi_app, path, headers=None):
+    async def send():
+        transport = httpx.ASGITransport(app=asgi_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.get(path, headers=headers)
+    return asyncio.run(send())
+
+
+def test_unexpected_errors_get_a_json_500_with_cors_and_request_id(asgi_app, monkeypatch):
+    async def handler(request, resourceid):
+        raise OSError("shared response cache is not writable")
+
+    monkeypatch.setattr(asgi_app, 'match_route', lambda scope: (handler, 7, '/api/products/<int:resourceid>'))
+    response = get(asgi_app, '/api/products/7', headers={'x-request-id': 'req-1'})
+
+    assert response.status_code == 500
+    assert response.json() == {"error": "Internal Server Error", "details": "shared response cache is not writable"}
+    assert response.headers['x-request-id'] == 'req-1'
+    assert response.headers['access-control-allow-origin']
+
+
+def test_errors_while_compressing_are_answered_too(asgi_app, monkeypatch):
+    async def handler(request, resourceid):
+        return asgi_app.Response(200, [{"mat_id": 1}])
+
+    async def compress_response(request, response):
+        raise ValueError("bad accept-encoding")
+
+    monkeypatch.setattr(asgi_app, 'match_route', lambda scope: (handler, None, '/api/materials'))
+    monkeypatch.setattr(asgi_app, 'compress_response', compress_response)
+    response = get(asgi_app, '/api/materials')
+
+    assert response.status_code == 500
+    assert response.json()['details'] == "bad accept-encoding"
+    assert response.headers['x-request-id']
@@ -0,0 +1,96 @@
+import threading
+
+
+def material(client, mat_id):
+    return client.get(f'/api/materials/{mat_id}').get_json()
+
+
+def test_invalid_items_fail_the_whole_request(client):
+    before = material(client, 2)
+    response = client.put('/api/materials/bulk', json=[
+        {'mat_id': 2, 'mat_name': 'Renamed'},
+        'not an object',
+        {'mat_name': 'No key'},
+        {'mat_id': 3},
+    ])
+    assert response.status_code == 400
+    assert [(result['index'], result['error']) for result in response.get_json()['results']] == [
+        (1, 'Item must be an object'),
+        (2, 'Missing key fields: mat_id'),
+        (3, 'No fields to update'),
+    ]
+    assert material(client, 2) == before
+
+
+def test_missing_rows_are_reported_and_the_rest_updated(client):
+    response = client.patch('/api/materials/bulk', json=[
+        {'mat_id': 4, 'mat_alert': 11},
+        {'mat_id': 999999, 'mat_alert': 11},
+        {'mat_id': 5, 'mat_name': 'Sage Felt 5', 'mat_alert': 12},
+    ])
+    assert response.status_code == 200
+    assert response.get_json()['results'] == [
+        {'index': 0, 'status': 'updated', 'mat_id': 4},
+        {'index': 1, 'status': 'not_found', 'mat_id': 999999},
+        {'index': 2, 'status': 'updated', 'mat_id': 5},
+    ]
+    assert material(client, 4)['mat_alert'] == 11
+    assert (material(client, 5)['mat_name'], material(client, 5)['mat_alert']) == ('Sage Felt 5', 12)
+
+
+def test_a_shortage_rolls_back_every_item(client):
+    variations = [v for v in client.get('/api/productvariations').get_json() if v['materials']][:2]
+    mat_ids = {m['mat_id'] for v in variations for m in v['materials']}
+    stock = {mat_id: material(client, mat_id)['mat_inv'] for mat_id in mat_ids}
+
+    response = client.put('/api/productvariations/bulk', json=[
+        {'var_id': variations[0]['var_id'], 'var_name': 'Renamed', 'var_inv': variations[0]['var_inv'] + 1},
+        {'var_id': variations[1]['var_id'], 'var_inv': variations[1]['var_inv'] + 10 ** 6},
+    ])
+    assert response.status_code == 400
+    assert response.get_json()['var_id'] == variations[1]['var_id']
+    for variation in variations:
+        after = client.get(f"/api/productvariations/{variation['var_id']}").get_json()
+        assert (after['var_name'], after['var_inv']) == (variation['var_name'], variation['var_inv'])
+    assert {mat_id: material(client, mat_id)['mat_inv'] for mat_id in mat_ids} == stock
+
+
+def test_an_invalid_reference_rolls_back_every_item(client):
+    before = client.get('/api/variationmaterials').get_json()
+    response = client.post('/api/variationmaterials/bulk', json=[
+        {'var_id': 1, 'mat_id': 399, 'mat_amount': 2},
+        {'var_id': 1, 'mat_id': 999999, 'mat_amount': 2},
+    ])
+    assert response.status_code == 400
+    assert response.get_json()['results'] == [{'index': 1, 'status': 'error', 'error': 'Invalid mat_id'}]
+    assert client.get('/api/variationmaterials').get_json() == before
+
+
+def test_rows_cannot_be_deleted_between_the_check_and_the_update(backend, client, monkeypatch):
+    cc_id = client.get('/api/calendarcategories').get_json()[0]['cc_id']
+    find_existing_keys = backend.find_existing_keys
+    deleter = {}
+
+    def delete_after_the_check(*args, **kwargs):
+        found = find_existing_keys(*args, **kwargs)
+
+        def delete():
+            conn = backend.checkout_connection()
+            try:
+                conn.cursor().execute("DELETE FROM frostedfabrics.calendar_categories WHERE cc_id = %s", (cc_id,))
+                conn.commit()
+            finally:
+                conn.close()
+
+        deleter['thread'] = threading.Thread(target=delete)
+        deleter['thread'].start()
+        deleter['thread'].join(0.3)
+        deleter['blocked'] = deleter['thread'].is_alive()
+        return found
+
+    monkeypatch.setattr(backend, 'find_existing_keys', delete_after_the_check)
+    response = client.put('/api/calendarcategories/bulk', json=[{'cc_id': cc_id, 'cc_name': 'Renamed'}])
+    deleter['thread'].join(5)
+    assert response.get_json()['results'][0]['status'] == 'updated'
+    # The delete waited for the update's transaction to commit
+    assert deleter['blocked']
@@ -0,0 +1,44 @@
+import pytest
+
+
+def log_state(backend, table):
+    return backend.latest_change_id(), backend.get_table_versions((table,))
+
+
+@pytest.mark.parametrize('path, table, body', [
+    ('/api/products/999999', 'products', {'prod_name': 'Ghost'}),
+    ('/api/materials/999999', 'materials', {'mat_name': 'Ghost'}),
+    ('/api/variationmaterials/999999/1', 'variation_materials', {'mat_amount': 3}),
+])
+def test_edits_of_missing_rows_log_no_change(backend, client, path, table, body):
+    before = log_state(backend, table)
+    client.patch(path, json=body)
+    assert log_state(backend, table) == before
+
+
+def test_edits_log_the_changed_row(backend, client):
+    before_id, before_versions = log_state(backend, 'products')
+    assert client.patch('/api/products/1', json={'prod_name': 'Renamed Tote'}).status_code == 200
+    latest, cursor, has_more = backend.read_change_log(before_id, 10)
+    assert list(latest) == [('products', (1,))]
+    assert backend.get_table_versions(('products',))['products'] == before_versions['products'] + 1
+
+
+def test_prune_deletes_old_entries_and_keeps_the_newest(backend, monkeypatch):
+    conn = backend.checkout_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO frostedfabrics.change_log (table_name, op, row_key, changed_at) VALUES (%s, %s, %s, %s)",
+            [('products', 'update', '{"prod_id": 1}', '2020-01-01 00:00:00')] * 5
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    newest = backend.latest_change_id()
+    monkeypatch.setattr(backend, 'CHANGE_LOG_PRUNE_BATCH', 2)
+
+    backend.prune_change_log()
+    rows = backend.execute_select_query(
+        "SELECT change_id FROM frostedfabrics.change_log WHERE changed_at < %s", ('2021-01-01',))
+    assert [row['change_id'] for row in rows] == [newest]
@@ -0,0 +1,201 @@
+import threading
+import time
+
+import pytest
+
+QUERY = "SELECT mat_id FROM frostedfabrics.materials WHERE mat_id <= 10 ORDER BY mat_id"
+MAT_IDS = list(range(1, 11))
+
+
+def in_use(backend):
+    pool = backend.connection_pool
+    return pool._opened - len(pool._idle)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def run_in_threads(count, fn):
+    """Start count threads running fn(); returns a list that gets each one's
+    result or exception, and the threads."""
+    outcomes = [None] * count
+
+    def call(i):
+        try:
+            outcomes[i] = fn()
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return outcomes, threads
+
+
+def test_single_flight_leader_error_reaches_every_follower(backend):
+    flights = backend.SingleFlight()
+    release = threading.Event()
+    error = RuntimeError("lost connection")
+
+    def fail():
+        release.wait(5)
+        raise error
+
+    leader, leader_threads = run_in_threads(1, lambda: flights.run('key', fail))
+    wait_for(lambda: 'key' in flights._flights)
+    followers, follower_threads = run_in_threads(4, lambda: flights.run('key', lambda: pytest.fail("ran twice")))
+    wait_for(lambda: flights._flights['key'].followers == 4)
+    release.set()
+    for thread in leader_threads + follower_threads:
+        thread.join(5)
+    assert leader + followers == [error] * 5
+    assert flights._flights == {}
+
+
+def test_single_flight_followers_get_their_own_rows(backend):
+    flights = backend.SingleFlight()
+    release = threading.Event()
+
+    def rows():
+        release.wait(5)
+        return [{'mat_id': 1}]
+
+    outcomes, threads = run_in_threads(1, lambda: flights.run('key', rows))
+    wait_for(lambda: 'key' in flights._flights)
+    more, more_threads = run_in_threads(2, lambda: flights.run('key', rows))
+    wait_for(lambda: flights._flights['key'].followers == 2)
+    release.set()
+    for thread in threads + more_threads:
+        thread.join(5)
+    results = outcomes + more
+    assert results == [[{'mat_id': 1}]] * 3
+    results[0][0]['mat_id'] = 2
+    assert results[1] == results[2] == [{'mat_id': 1}]
+
+
+def test_stream_start_error_reaches_every_follower(backend, monkeypatch):
+    release = threading.Event()
+    error = backend.mysql.connector.errors.OperationalError("Lost connection to MySQL server")
+    checkout_connection = backend.checkout_connection
+
+    def fail_to_check_out(replica=None):
+        release.wait(5)
+        raise error
+
+    monkeypatch.setattr(backend, 'checkout_connection', fail_to_check_out)
+    leader, leader_threads = run_in_threads(1, lambda: backend.StreamedSelect(QUERY, chunk_size=2))
+    wait_for(lambda: backend.stream_flights._flights)
+    flight = next(iter(backend.stream_flights._flights.values()))
+    followers, follower_threads = run_in_threads(3, lambda: backend.StreamedSelect(QUERY, chunk_size=2))
+    wait_for(lambda: len(flight._positions) == 4)
+    release.set()
+    for thread in leader_threads + follower_threads:
+        thread.join(5)
+    assert leader + followers == [error] * 4
+    assert backend.stream_flights._flights == {}
+
+    # The next identical stream starts afresh
+    monkeypatch.setattr(backend, 'checkout_connection', checkout_connection)
+    assert [row['mat_id'] for row in backend.StreamedSelect(QUERY, chunk_size=2)] == MAT_IDS
+
+
+def test_stream_fetch_error_reaches_every_reader(backend):
+    baseline = in_use(backend)
+    leader = backend.StreamedSelect(QUERY, chunk_size=2)
+    follower = backend.StreamedSelect(QUERY, chunk_size=2)
+    flight = leader._flight
+    assert follower._flight is flight
+
+    class FailingCursor:
+        def __init__(self, cursor):
+            self.cursor = cursor
+
+        def fetchmany(self, size):
+            raise backend.mysql.connector.errors.OperationalError("Lost connection to MySQL server")
+
+        def close(self):
+            self.cursor.close()
+
+    rows = iter(leader)
+    assert next(rows)['mat_id'] == 1
+    flight._cursor = FailingCursor(flight._cursor)
+    with pytest.raises(backend.mysql.connector.Error):
+        list(rows)
+    with pytest.raises(backend.mysql.connector.Error):
+        # The follower still has the first chunk, then hits the same error
+        [row['mat_id'] for row in follower]
+    assert in_use(backend) == baseline
+    assert backend.stream_flights._flights == {}
+
+
+def test_readers_that_join_before_the_first_chunk_share_the_stream(backend):
+    baseline = in_use(backend)
+    first = backend.StreamedSelect(QUERY, chunk_size=2)
+    second = backend.StreamedSelect(QUERY, chunk_size=2)
+    assert second._flight is first._flight
+    assert in_use(backend) == baseline + 1
+
+    first_rows, second_rows = iter(first), iter(second)
+    seen = {'first': [], 'second': []}
+    # Interleave unevenly, so the readers are in different chunks
+    for _ in range(3):
+        seen['first'].append(next(first_rows)['mat_id'])
+    seen['second'].append(next(second_rows)['mat_id'])
+    seen['first'].extend(row['mat_id'] for row in first_rows)
+    seen['second'].extend(row['mat_id'] for row in second_rows)
+    assert seen == {'first': MAT_IDS, 'second': MAT_IDS}
+    assert in_use(backend) == baseline
+    assert backend.stream_flights._flights == {}
+
+
+def test_reader_that_joins_after_streaming_started_gets_every_row(backend):
+    baseline = in_use(backend)
+    early = backend.StreamedSelect(QUERY, chunk_size=2)
+    early_rows = iter(early)
+    # Past the first chunk, which is dropped once its only reader leaves it
+    read = [next(early_rows)['mat_id'] for _ in range(3)]
+
+    late = backend.StreamedSelect(QUERY, chunk_size=2)
+    assert late._flight is not early._flight
+    assert [row['mat_id'] for row in late] == MAT_IDS
+    read.extend(row['mat_id'] for row in early_rows)
+    assert read == MAT_IDS
+    assert in_use(backend) == baseline
+    assert backend.stream_flights._flights == {}
+
+
+def test_late_reader_of_a_shared_stream_starts_its_own(backend):
+    early = backend.StreamedSelect(QUERY, chunk_size=2)
+    joined = backend.StreamedSelect(QUERY, chunk_size=2)
+    early_rows, joined_rows = iter(early), iter(joined)
+    for _ in range(3):
+        next(early_rows)
+        next(joined_rows)
+
+    late = backend.StreamedSelect(QUERY, chunk_size=2)
+    assert late._flight is not early._flight
+    # The late flight replaces the old one for the next joiner
+    next_one = backend.StreamedSelect(QUERY, chunk_size=2)
+    assert next_one._flight is late._flight
+    for select in (early, joined, late, next_one):
+        select.close()
+    assert backend.stream_flights._flights == {}
+
+
+def test_disconnect_mid_stream_releases_the_connection(backend, client):
+    baseline = in_use(backend)
+    response = client.get('/api/variationmaterials', headers={'Accept': 'application/x-ndjson'}, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    chunks = iter(response.response)
+    next(chunks)
+    assert next(chunks).count(b'\n') == backend.STREAM_CHUNK_SIZE
+    # More rows are waiting on the connection
+    assert in_use(backend) == baseline + 1
+    response.close()
+    assert in_use(backend) == baseline
+    assert backend.stream_flights._flights == {}
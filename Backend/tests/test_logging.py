@@ -0,0 +1,88 @@
+import json
+import logging
+import random
+import sys
+
+import flask
+
+import logpipeline
+
+
+def make_record(message="something broke", level=logging.ERROR, name='main', lineno=10, exc_info=None):
+    return logging.LogRecord(name, level, '/srv/main.py', lineno, message, None, exc_info)
+
+
+def test_records_are_formatted_as_one_json_object():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record(exc_info=sys.exc_info())
+    record.request_id = 'req-1'
+    record.suppressed = 3
+
+    entry = json.loads(logpipeline.JSONFormatter().format(record))
+
+    assert set(entry) == {'ts', 'level', 'logger', 'message', 'request_id', 'thread', 'suppressed_repeats', 'exception'}
+    assert entry['level'] == 'ERROR'
+    assert entry['logger'] == 'main'
+    assert entry['message'] == "something broke"
+    assert entry['request_id'] == 'req-1'
+    assert entry['suppressed_repeats'] == 3
+    assert 'ValueError: boom' in entry['exception']
+    assert entry['ts'].endswith('+00:00')
+
+
+def test_records_are_tagged_with_the_request_id():
+    request_filter = logpipeline.RequestIdFilter()
+
+    app = flask.Flask(__name__)
+    with app.test_request_context('/'):
+        flask.g.request_id = 'from-flask'
+        record = make_record()
+        request_filter.filter(record)
+    assert record.request_id == 'from-flask'
+
+    token = logpipeline.current_request_id.set('from-asgi')
+    try:
+        record = make_record()
+        request_filter.filter(record)
+    finally:
+        logpipeline.current_request_id.reset(token)
+    assert record.request_id == 'from-asgi'
+
+    record = make_record()
+    request_filter.filter(record)
+    assert record.request_id is None
+
+
+def test_query_logs_are_sampled(monkeypatch):
+    assert all(logpipeline.SamplingFilter(1).filter(make_record()) for _ in range(100))
+    assert not any(logpipeline.SamplingFilter(0).filter(make_record()) for _ in range(100))
+
+    rng = random.Random(4375)
+    monkeypatch.setattr(logpipeline.random, 'random', rng.random)
+    sampling = logpipeline.SamplingFilter(0.1)
+    kept = sum(sampling.filter(make_record()) for _ in range(10000))
+    assert 800 < kept < 1200
+
+
+def test_repeated_errors_are_rate_limited(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(logpipeline.time, 'monotonic', lambda: now[0])
+    limit = logpipeline.ErrorRateLimitFilter(burst=2, window=60)
+
+    assert [limit.filter(make_record()) for _ in range(5)] == [True, True, False, False, False]
+    # Other messages, call sites and lower levels are counted apart
+    assert limit.filter(make_record("something else broke"))
+    assert limit.filter(make_record(lineno=11))
+    assert all(limit.filter(make_record(level=logging.WARNING)) for _ in range(5))
+
+    now[0] += 60
+    record = make_record()
+    assert limit.filter(record)
+    assert record.suppressed == 3
+
+
+def test_importing_main_does_not_start_the_log_writer(backend):
+    assert not backend.background_tasks_started
+    assert logpipeline._listener is None
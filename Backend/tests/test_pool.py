@@ -0,0 +1,127 @@
+import mysql.connector
+import pytest
+from mysql.connector import errorcode
+from mysql.connector.cursor import MySQLCursorPrepared
+from prometheus_client import REGISTRY
+
+import pool
+
+
+class FakeCursor(MySQLCursorPrepared):
+    """A prepared cursor that records what it was asked to do instead of
+    talking to a server."""
+
+    def __init__(self, connection, prepared):
+        self.connection = connection
+        self.is_prepared = prepared
+        self._prepared = None
+        self.results = []
+        self.closed = False
+
+    def execute(self, operation, params=None, multi=False):
+        self.connection.prepared.append(operation)
+        self._prepared = {'statement_id': len(self.connection.prepared), 'parameters': [None] * len(params or ())}
+        self.connection.resets += 1
+        self._handle_result(self.connection.cmd_stmt_execute(self._prepared['statement_id'], data=tuple(params or ())))
+
+    def _handle_result(self, result):
+        self.results.append(result)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self):
+        self.connection_id = 1
+        self.prepared = []
+        self.executed = []
+        self.resets = 0
+        self.cursors = []
+        self.forget_statements = 0  # executions that fail with ER_UNKNOWN_STMT_HANDLER
+
+    def cursor(self, prepared=False, dictionary=False):
+        cursor = FakeCursor(self, prepared)
+        self.cursors.append(cursor)
+        return cursor
+
+    def cmd_stmt_execute(self, statement_id, data=(), parameters=()):
+        if self.forget_statements:
+            self.forget_statements -= 1
+            raise mysql.connector.Error(errno=errorcode.ER_UNKNOWN_STMT_HANDLER)
+        self.executed.append((statement_id, data))
+        return {'statement_id': statement_id, 'data': data}
+
+
+def lookups(result):
+    return REGISTRY.get_sample_value('db_statement_cache_total', {'result': result}) or 0
+
+
+def test_hits_execute_the_prepared_statement_without_a_reset():
+    connection = FakeConnection()
+    cache = pool.StatementCache(connection, max_size=4)
+    hits, misses = lookups('hit'), lookups('miss')
+
+    first = cache.execute("SELECT * FROM materials WHERE mat_id = %s", (1,))
+    second = cache.execute("SELECT * FROM materials WHERE mat_id = %s", (2,))
+
+    assert first is second
+    assert connection.prepared == ["SELECT * FROM materials WHERE mat_id = %s"]
+    assert connection.resets == 1
+    assert connection.executed == [(1, (1,)), (1, (2,))]
+    assert second.results[-1] == {'statement_id': 1, 'data': (2,)}
+    assert lookups('hit') == hits + 1
+    assert lookups('miss') == misses + 1
+
+
+def test_cache_is_dropped_when_the_connection_reconnects():
+    connection = FakeConnection()
+    cache = pool.StatementCache(connection, max_size=4)
+    old = cache.execute("SELECT 1")
+
+    connection.connection_id = 2
+    new = cache.execute("SELECT 1")
+
+    assert old.closed
+    assert new is not old
+    assert len(connection.prepared) == 2
+
+
+def test_forgotten_statement_is_prepared_again_once():
+    connection = FakeConnection()
+    cache = pool.StatementCache(connection, max_size=4)
+    old = cache.execute("SELECT 1")
+
+    connection.forget_statements = 1
+    new = cache.execute("SELECT 1")
+
+    assert old.closed
+    assert new is not old and not new.closed
+    assert connection.executed[-1] == (2, ())
+
+    connection.forget_statements = 2
+    with pytest.raises(mysql.connector.Error):
+        cache.execute("SELECT 1")
+
+
+def test_least_recently_used_statement_is_evicted_and_closed():
+    connection = FakeConnection()
+    cache = pool.StatementCache(connection, max_size=2)
+    a = cache.execute("SELECT 'a'")
+    b = cache.execute("SELECT 'b'")
+    cache.execute("SELECT 'a'")
+    cache.execute("SELECT 'c'")
+
+    assert b.closed
+    assert not a.closed
+    assert cache.execute("SELECT 'a'") is a
+    assert len(connection.prepared) == 3
+
+
+def test_size_zero_runs_text_queries():
+    connection = FakeConnection()
+    cache = pool.StatementCache(connection, max_size=0)
+    first = cache.execute("SELECT 1")
+    second = cache.execute("SELECT 1")
+    assert first is not second
+    assert not any(cursor.is_prepared for cursor in connection.cursors)
@@ -0,0 +1,29 @@
+import os
+import time
+
+import replicas
+
+
+def test_expired_pin_files_are_swept(tmp_path, monkeypatch):
+    pins = replicas.PrimaryPins(window=0.05, shared_dir=str(tmp_path))
+    pins.pin('client-a')
+    pins.pin('client-b')
+    assert len(os.listdir(tmp_path)) == 2
+    time.sleep(0.1)
+
+    monkeypatch.setattr(replicas, 'PIN_SWEEP_INTERVAL', 0)
+    pins.pin('client-c')
+    assert os.listdir(tmp_path) == [os.path.basename(pins._path('client-c'))]
+    assert pins.is_pinned('client-c')
+    assert not pins.is_pinned('client-a')
+
+
+def test_pins_are_seen_by_other_processes_until_they_expire(tmp_path):
+    writer = replicas.PrimaryPins(window=0.2, shared_dir=str(tmp_path))
+    reader = replicas.PrimaryPins(window=0.2, shared_dir=str(tmp_path))
+    writer.pin('client')
+    assert reader.is_pinned('client')
+    time.sleep(0.3)
+    assert not reader.is_pinned('client')
+    reader.sweep()
+    assert os.listdir(tmp_path) == []
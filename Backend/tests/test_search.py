@@ -0,0 +1,166 @@
+import threading
+
+import search
+from search import EXACT_NAME, EXACT_SKU, NAME_PREFIX, SUBSTRING, WORD_PREFIX
+
+
+def build(*documents):
+    index = search.SearchIndex()
+    index.replace(documents)
+    return index
+
+
+def found(index, query, **kwargs):
+    return [(rank, doc.kind, doc.id) for rank, doc in index.search(query, **kwargs)]
+
+
+def test_ranks_exact_sku_name_prefix_word_prefix_and_substring():
+    index = build(
+        search.Document('material', 1, 'Cotton Twill', 'TW-1'),
+        search.Document('material', 2, 'Twill'),
+        search.Document('material', 3, 'Twill Tape Wide'),
+        search.Document('material', 4, 'Heavy Twill'),
+        search.Document('material', 5, 'Betwill Cord'),
+        search.Document('material', 6, 'Denim'),
+    )
+    assert found(index, 'twill') == [
+        (EXACT_NAME, 'material', 2),
+        (NAME_PREFIX, 'material', 3),
+        (WORD_PREFIX, 'material', 4),
+        (WORD_PREFIX, 'material', 1),
+        (SUBSTRING, 'material', 5),
+    ]
+    assert found(index, 'tw-1')[0] == (EXACT_SKU, 'material', 1)
+
+
+def test_shorter_names_first_within_a_rank():
+    index = build(
+        search.Document('product', 1, 'Linen Tote Bag Extra'),
+        search.Document('product', 2, 'Linen Tote'),
+        search.Document('product', 3, 'Linen Tote Bag'),
+    )
+    assert [id for _, _, id in found(index, 'linen t')] == [2, 3, 1]
+
+
+def test_every_term_must_match():
+    index = build(
+        search.Document('variation', 1, 'Navy Small'),
+        search.Document('variation', 2, 'Navy Large'),
+        search.Document('variation', 3, 'Rose Small'),
+    )
+    assert found(index, 'small navy') == [(WORD_PREFIX, 'variation', 1)]
+    assert found(index, 'sma ros') == [(WORD_PREFIX, 'variation', 3)]
+
+
+def test_sku_words_match_by_prefix():
+    index = build(search.Document('material', 1, 'Felt Sheet', 'FLT-2040'))
+    assert found(index, 'flt') == [(WORD_PREFIX, 'material', 1)]
+    assert found(index, '2040') == [(WORD_PREFIX, 'material', 1)]
+
+
+def test_short_terms_are_only_prefixes():
+    index = build(search.Document('material', 1, 'Cotton'))
+    assert found(index, 'co') == [(NAME_PREFIX, 'material', 1)]
+    assert found(index, 'ot') == []
+    assert found(index, 'ott') == [(SUBSTRING, 'material', 1)]
+
+
+def test_kinds_and_limit():
+    index = build(
+        search.Document('brand', 1, 'Wool Co'),
+        search.Document('material', 2, 'Wool Roving'),
+        search.Document('material', 3, 'Wool Yarn'),
+    )
+    assert found(index, 'wool', kinds={'material'}) == [(NAME_PREFIX, 'material', 3), (NAME_PREFIX, 'material', 2)]
+    assert len(found(index, 'wool', limit=1)) == 1
+
+
+def test_blank_query():
+    index = build(search.Document('material', 1, 'Cotton'))
+    assert found(index, '  ') == []
+    assert found(index, '--') == []
+
+
+def test_update_replaces_a_document_everywhere():
+    index = build(search.Document('material', 1, 'Cotton Twill', 'TW-1'), search.Document('material', 2, 'Denim'))
+    index.update([search.Document('material', 1, 'Linen Canvas', 'LC-9')])
+    assert len(index) == 2
+    assert index.get('material', 1).name == 'Linen Canvas'
+    for query in ('cotton', 'twill', 'otto', 'tw-1'):
+        assert found(index, query) == []
+    assert found(index, 'canvas') == [(WORD_PREFIX, 'material', 1)]
+    assert found(index, 'lc-9') == [(EXACT_SKU, 'material', 1)]
+
+
+def test_delete_removes_a_document_everywhere():
+    index = build(search.Document('material', 1, 'Cotton Twill', 'TW-1'), search.Document('material', 2, 'Cotton'))
+    index.update(removed=[('material', 1), ('material', 404)])
+    assert len(index) == 1
+    assert index.get('material', 1) is None
+    assert found(index, 'cotton') == [(EXACT_NAME, 'material', 2)]
+    assert found(index, 'twill') == []
+    assert found(index, 'tw-1') == []
+    assert index._trigrams.get('twi') is None
+    assert index._skus == {}
+
+
+def test_bulk_update_matches_one_at_a_time():
+    originals = [search.Document('material', i, f"Wool {i}", f"W-{i}") for i in range(200)]
+    renamed = [search.Document('material', i, f"Felt {i}", f"F-{i}") for i in range(0, 200, 2)]
+    removed = [('material', i) for i in range(1, 40, 2)]
+
+    one_at_a_time = build(*originals)
+    for doc in renamed:
+        one_at_a_time.update([doc])
+    for key in removed:
+        one_at_a_time.update(removed=[key])
+    bulk = build(*originals)
+    bulk.update(renamed, removed)
+    assert len(renamed) + len(removed) > search.BULK_UPDATE_SIZE
+
+    for index in (one_at_a_time, bulk):
+        assert len(index) == 180
+        assert len(index._names) == 180
+        assert len(index._words) == sum(len(doc.words) for doc in index._docs.values())
+    for query in ('wool', 'felt 1', 'f-10', 'w-11', 'w-41', '99'):
+        assert found(one_at_a_time, query, limit=50) == found(bulk, query, limit=50)
+    assert bulk.get('material', 11) is None
+    assert 11 not in [id for _, _, id in found(bulk, 'w-11', limit=50)]
+    assert found(bulk, 'f-10')[0] == (EXACT_SKU, 'material', 10)
+
+
+def material_change(mat_id, name, sku):
+    return {"table": "materials", "op": "insert", "key": {"mat_id": mat_id},
+            "row": {"mat_id": mat_id, "mat_name": name, "mat_sku": sku, "brand_id": 1}}
+
+
+def test_changes_applied_during_a_load_survive_it(backend, monkeypatch):
+    index = search.SearchIndex()
+    sync = backend.SearchIndexSync(index, interval=60)
+    latest_change_id = backend.latest_change_id
+
+    def write_during_load():
+        # A request finishing while the load reads the tables; apply()
+        # must not wait for the load, or every write would stall behind it
+        applied = threading.Thread(target=sync.apply, args=([material_change(900001, 'Zebra Felt', 'ZZ-1')],))
+        applied.start()
+        applied.join(5)
+        assert not applied.is_alive()
+        return latest_change_id()
+
+    monkeypatch.setattr(backend, 'latest_change_id', write_during_load)
+    sync.load()
+    assert sync.ready
+    assert [doc.id for _, doc in index.search('ZZ-1')] == [900001]
+
+
+def test_written_rows_are_searchable_straight_away(backend, client):
+    backend.search_sync.load()
+    response = client.post('/api/materials', json={
+        'brand_id': 1, 'mat_name': 'Quokka Fleece', 'mat_sku': 'QK-77', 'mat_inv': 5, 'mat_alert': 1, 'img_id': None,
+    })
+    assert response.status_code == 201
+    results = client.get('/api/search?q=qk-77').get_json()
+    assert [(result['name'], result['match']) for result in results] == [('Quokka Fleece', 'sku')]
+    assert client.get('/api/search?q=quokka&kinds=brand').get_json() == []
+    assert client.get('/api/search?q=quokka&kinds=nope').status_code == 400
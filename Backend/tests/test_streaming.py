@@ -0,0 +1,52 @@
+import json
+
+# The query and grouping variationmaterialsGet used before it streamed
+OLD_QUERY = """
+    SELECT
+        vm.var_id,
+        vm.mat_id,
+        vm.mat_amount,
+        m.mat_name,
+        m.mat_sku,
+        m.mat_inv,
+        mb.brand_name,
+        mc.mc_name,
+        mm.meas_unit
+    FROM frostedfabrics.variation_materials vm
+    JOIN frostedfabrics.materials m ON vm.mat_id = m.mat_id
+    JOIN frostedfabrics.material_brands mb ON m.brand_id = mb.brand_id
+    JOIN frostedfabrics.material_categories mc ON mb.mc_id = mc.mc_id
+    LEFT JOIN frostedfabrics.material_measurements mm ON mc.meas_id = mm.meas_id
+    ORDER BY vm.var_id, m.mat_name
+"""
+
+
+def old_variation_materials(backend):
+    grouped = {}
+    for row in backend.execute_select_query(OLD_QUERY):
+        grouped.setdefault(row['var_id'], []).append(row)
+    with backend.app.app_context():
+        return json.loads(backend.app.json.response(grouped).get_data())
+
+
+def test_streamed_variation_materials_match_the_old_grouping(backend, client):
+    expected = old_variation_materials(backend)
+    assert len(expected) > 1
+
+    response = client.get('/api/variationmaterials')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert json.loads(response.get_data()) == expected
+
+
+def test_ndjson_variation_materials_group_back_to_the_old_shape(backend, client):
+    expected = old_variation_materials(backend)
+
+    response = client.get('/api/variationmaterials?format=ndjson')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    grouped = {}
+    for line in response.get_data().splitlines():
+        row = json.loads(line)
+        grouped.setdefault(str(row['var_id']), []).append(row)
+    assert grouped == expected
@@ -0,0 +1,57 @@
+from mysql.connector import errorcode, errors
+
+
+def deadlock_once(monkeypatch, backend, name):
+    """Make backend.<name> fail with a deadlock on its first call, as InnoDB
+    does after rolling the transaction back."""
+    original = getattr(backend, name)
+    calls = []
+
+    def fail_first(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise errors.DatabaseError(msg="Deadlock found when trying to get lock", errno=errorcode.ER_LOCK_DEADLOCK)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(backend, name, fail_first)
+    return calls
+
+
+def variation_with_materials(client):
+    variation = next(v for v in client.get('/api/productvariations').get_json() if v['materials'])
+    return variation['var_id'], variation['var_inv']
+
+
+def stock(client, mat_ids):
+    return {mat_id: client.get(f'/api/materials/{mat_id}').get_json()['mat_inv'] for mat_id in mat_ids}
+
+
+def test_produce_is_retried_after_a_deadlock(backend, client, monkeypatch):
+    var_id, var_inv = variation_with_materials(client)
+    materials = client.get(f'/api/variationmaterials/{var_id}').get_json()
+    before = stock(client, [m['mat_id'] for m in materials])
+    calls = deadlock_once(monkeypatch, backend, 'consume_variation_materials')
+
+    response = client.post(f'/api/productvariations/{var_id}/produce', json={'quantity': 1})
+    assert response.status_code == 200, response.get_json()
+    assert len(calls) == 2
+    # The first attempt was rolled back, so everything happened once
+    assert response.get_json()['var_inv'] == var_inv + 1
+    assert stock(client, before) == {m['mat_id']: before[m['mat_id']] - m['mat_amount'] for m in materials}
+
+
+def test_bulk_update_is_retried_after_a_deadlock(backend, client, monkeypatch):
+    calls = deadlock_once(monkeypatch, backend, 'find_existing_keys')
+    response = client.put('/api/materials/bulk', json=[{'mat_id': 1, 'mat_alert': 7}])
+    assert response.status_code == 200, response.get_json()
+    assert len(calls) == 2
+    assert client.get('/api/materials/1').get_json()['mat_alert'] == 7
+
+
+def test_cascading_delete_is_retried_after_a_deadlock(backend, client, monkeypatch):
+    category = client.get('/api/calendarcategories').get_json()[-1]['cc_id']
+    calls = deadlock_once(monkeypatch, backend, 'log_deletes')
+    response = client.delete(f'/api/calendarcategories/{category}')
+    assert response.status_code == 200, response.get_json()
+    assert len(calls) == 2
+    assert category not in [c['cc_id'] for c in client.get('/api/calendarcategories').get_json()]
@@ -87,10 +87,10 @@ interface NewMaterial {
 
 const delay = (ms: number) => new Promise(resolve => setTimeout(resolve, ms))
 
-const fetchWithRetry = async (url: string, retries = 3, delayMs = 1000) => {
+const fetchWithRetry = async (url: string, init?: RequestInit, retries = 3, delayMs = 1000) => {
   for (let i = 0; i < retries; i++) {
     try {
-      const response = await fetch(url)
+      const response = await fetch(url, init)
       if (response.ok) return response
       if (response.status === 404) return null
     } catch (error) {
@@ -143,23 +143,30 @@ export default function ProductDetailPage() {
       setIsLoading(true)
       setError(null)
       try {
-        const [productRes, variationsRes] = await Promise.all([
-          fetchWithRetry(`http://localhost:5000/api/products/${params.product}`),
-          fetchWithRetry(`http://localhost:5000/api/productvariations?product=${params.product}`)
-        ])
+        // Product, variations and category in one round trip
+        const batchRes = await fetchWithRetry('http://localhost:5000/api/batch', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({
+            requests: [
+              { id: 'product', path: `/api/products/${params.product}` },
+              { id: 'variations', path: `/api/productvariations?product=${params.product}` },
+              { id: 'category', path: '/api/productcategories/{product.pc_id}' }
+            ]
+          })
+        })
+        if (!batchRes) throw new Error('Failed to fetch product data')
 
-        if (!productRes || !variationsRes) {
+        const { responses } = await batchRes.json()
+        const [productResult, variationsResult, categoryResult] = responses
+        if (productResult.status !== 200 || variationsResult.status !== 200) {
           throw new Error('Failed to fetch product or variations data')
         }
+        if (categoryResult.status !== 200) throw new Error('Failed to fetch category')
 
-        const [productData, variationsData] = await Promise.all([
-          productRes.json(),
-          variationsRes.json()
-        ])
-
-        const categoryRes = await fetchWithRetry(`http://localhost:5000/api/productcategories/${productData.pc_id}`)
-        if (!categoryRes) throw new Error('Failed to fetch category')
-        const categoryData = await categoryRes.json()
+        const productData = productResult.body
+        const variationsData = variationsResult.body
+        const categoryData = categoryResult.body
 
         setProduct(productData)
         setCategory(categoryData)
@@ -438,23 +445,22 @@ export default function ProductDetailPage() {
         })
       })
 
-      // Update variations and their materials
-      const variationUpdates = Object.values(editedVariations).map(async variation => {
-        const originalVariation = variations.find(v => v.var_id === variation.var_id)
-        if (originalVariation && variation.var_inv !== originalVariation.var_inv) {
-          variation = updateMaterialInventory(variation, variation.var_inv, originalVariation.var_inv)
-        }
-
-        return fetch(`http://localhost:5000/api/productvariations/${variation.var_id}`, {
-          method: 'PATCH',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            var_name: variation.var_name,
-            var_inv: variation.var_inv,
-            var_goal: variation.var_goal
-          })
-        })
-      })
+      // Update all variations in one transaction; the server deducts the
+      // materials for any raised var_inv, so they are not sent from here
+      const variationPayload = Object.values(editedVariations).map(variation => ({
+        var_id: variation.var_id,
+        var_name: variation.var_name,
+        var_inv: variation.var_inv,
+        var_goal: variation.var_goal
+      }))
+
+      const variationUpdates = variationPayload.length > 0
+        ? [fetch('http://localhost:5000/api/productvariations/bulk', {
+            method: 'PATCH',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(variationPayload)
+          })]
+        : []
 
       const results = await Promise.all([productUpdate, ...variationUpdates])
 
@@ -107,24 +107,18 @@ export default function ProductsCategoryPage() {
       
       setCategory(currentCategory)
 
-      const [productsRes, variationsRes] = await Promise.all([
-        fetch('http://localhost:5000/api/products', { signal }),
-        fetch('http://localhost:5000/api/productvariations', { signal })
-      ])
-
-      if (!productsRes.ok || !variationsRes.ok) {
-        throw new Error('Failed to fetch data')
+      const productsRes = await fetch(`http://localhost:5000/api/products?pc_id=${currentCategory.pc_id}`, { signal })
+      if (!productsRes.ok) throw new Error('Failed to fetch data')
+      const categoryProducts: Product[] = await productsRes.json()
+
+      let variationsData: ProductVariation[] = []
+      if (categoryProducts.length > 0) {
+        const prodIds = categoryProducts.map(product => product.prod_id).join(',')
+        const variationsRes = await fetch(`http://localhost:5000/api/productvariations?prod_id=${prodIds}`, { signal })
+        if (!variationsRes.ok) throw new Error('Failed to fetch data')
+        variationsData = await variationsRes.json()
       }
 
-      const [productsData, variationsData] = await Promise.all([
-        productsRes.json(),
-        variationsRes.json()
-      ])
-
-      const categoryProducts = productsData.filter((product: Product) => 
-        product.pc_id === currentCategory.pc_id
-      )
-
       setProducts(categoryProducts)
       setVariations(variationsData)
       setRetryCount(0)